@@ -67,6 +67,7 @@ class BGPAgent(service.Service, periodic_task.PeriodicTasks,
     def stop(self, graceful=False):
         LOG.info("Service '%s' stopping", self.__class__.__name__)
         super(BGPAgent, self).stop(graceful)
+        self.agent_driver.stop()
 
 
 def start():
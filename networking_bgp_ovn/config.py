@@ -47,6 +47,59 @@ agent_opts = [
                default=None,
                help='Router ID to be used by the Agent when running in BGP '
                     'mode and configuring the VRF route leaking.'),
+    cfg.StrOpt('exposing_method',
+               default='address',
+               choices=('address', 'route'),
+               help='How the BGP driver exposes the IPs through the ovn '
+                    'device. With "address" they are added as /32 and /128 '
+                    'addresses and FRR redistributes the connected routes. '
+                    'With "route" a host route through the device is added '
+                    'to the ovn-bgp-vrf routing table for each of them '
+                    'instead, and FRR redistributes the kernel routes. This '
+                    'avoids the address handling cost of the kernel (local '
+                    'routes and address notifications) on nodes exposing a '
+                    'large number of IPs.'),
+    cfg.StrOpt('steering_method',
+               default='rule',
+               choices=('rule', 'table'),
+               help='How the BGP driver steers the traffic to the exposed '
+                    'IPs into the routing table of their provider bridge. '
+                    'With "rule" an ip rule is added per exposed IP and '
+                    'subnet. With "table" there is a single ip rule per '
+                    'bridge (and IP version) and the routes on the bridge '
+                    'table, which then has no default route, decide which '
+                    'traffic goes through the bridge. This keeps the '
+                    'number of rules, that the kernel goes through '
+                    'linearly for every packet, independent of the number '
+                    'of exposed IPs.'),
+    cfg.BoolOpt('use_nexthop_objects',
+                default=False,
+                help='Program the routes on the provider bridge routing '
+                     'tables through kernel nexthop objects, one per '
+                     'provider network and per cr-lrp, instead of with the '
+                     'device and gateway in every route. Needs a kernel '
+                     'with nexthop objects support (5.3 or newer).'),
+    cfg.BoolOpt('sb_conditional_monitoring',
+                default=False,
+                help='Only monitor the OVN SB Port_Binding rows relevant to '
+                     'this chassis (router ports, localnet ports, ports '
+                     'bound to this chassis and ports on the tenant '
+                     'networks connected to its gateway ports) instead of '
+                     'the whole table.'),
+    cfg.BoolOpt('ovn_sb_leader_only',
+                default=True,
+                help='Only connect to the leader of a clustered OVN SB '
+                     'database. When disabled, the agent (which never writes '
+                     'to the SB) stays connected to any cluster member or '
+                     'relay. The ovs library picks the OVN SB remotes in a '
+                     'random order, which spreads the chassis across them.'),
+    cfg.StrOpt('ovsdb_schema_cache_dir',
+               default=None,
+               help='Directory where the OVN SB and OVS database schemas are '
+                    'cached, so they are not fetched from the servers on '
+                    'every start. The cached copies are checked against the '
+                    'server schema version once connected. Caching is '
+                    'disabled if not set.'),
 ]
 
 CONF = cfg.CONF
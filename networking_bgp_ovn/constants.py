@@ -17,6 +17,10 @@ OVN_VIF_PORT_TYPES = ("", "chassisredirect", "virtual")
 OVN_BGP_NIC = "ovn"
 OVN_BGP_VRF = "ovn-bgp-vrf"
 OVN_BGP_VRF_TABLE = 10
+EXPOSE_ADDRESS = 'address'
+EXPOSE_ROUTE = 'route'
+STEER_RULE = 'rule'
+STEER_TABLE = 'table'
 OVS_CONNECTION_STRING = "unix:/var/run/openvswitch/db.sock"
 OVS_RULE_COOKIE = "999"
 OVS_VRF_RULE_COOKIE = "998"
@@ -36,3 +40,21 @@ OVN_EVPN_BRIDGE_PREFIX = "br-"
 OVN_EVPN_VXLAN_PREFIX = "vxlan-"
 OVN_EVPN_LO_PREFIX = "lo-"
 OVN_INTEGRATION_BRIDGE = 'br-int'
+
+# Columns replicated by the agent IDLs, per table. Everything the watchers
+# and drivers read from a row must be listed here.
+OVN_SB_TABLE_COLUMNS = {
+    'Port_Binding': ['logical_port', 'type', 'mac', 'chassis', 'datapath',
+                     'options', 'nat_addresses', 'tag', 'external_ids'],
+    'Chassis': ['name', 'hostname'],
+    'Chassis_Private': ['name', 'chassis'],
+    'Datapath_Binding': ['tunnel_key', 'external_ids'],
+    'Encap': ['type', 'ip', 'chassis_name'],
+    'SB_Global': ['nb_cfg'],
+}
+OVS_TABLE_COLUMNS = {
+    'Open_vSwitch': ['external_ids'],
+    'Bridge': ['name'],
+    'Port': ['name'],
+    'Interface': ['name'],
+}
@@ -31,6 +31,9 @@ class AgentDriverBase(object, metaclass=abc.ABCMeta):
 
         return agent_driver
 
+    def stop(self):
+        """Release the resources held by the driver."""
+
     @abc.abstractmethod
     def expose_IP(self, ip_address):
         raise NotImplementedError()
@@ -14,7 +14,6 @@
 
 import collections
 import ipaddress
-import pyroute2
 
 from oslo_concurrency import lockutils
 from oslo_config import cfg
@@ -36,18 +35,41 @@ LOG = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG)
 
 OVN_TABLES = ("Port_Binding", "Chassis", "Datapath_Binding", "Chassis_Private")
+# Seconds to wait for the SB DB server to send the Port_Binding rows of a
+# widened monitor condition before syncing
+PORT_BINDING_CONDITION_TIMEOUT = 30
+
+
+class _DesiredState(object):
+    """Kernel and OVS state the sync computes from the SB DB."""
+
+    def __init__(self):
+        self.exposed_ips = set()
+        # {'172.24.4.10/32': {'table': 200, 'dev': 'br-ex', 'lladdr': mac}}
+        self.ip_rules = {}
+        # {(bridge, vlan_tag): set(ips)}
+        self.ndp_proxies = collections.defaultdict(set)
+        self.default_ovs_flows = False
 
 
 class OSPOVNBGPDriver(driver_api.AgentDriverBase):
 
     def __init__(self):
         self._expose_tenant_networks = CONF.expose_tenant_networks
+        self._exposing_method = CONF.exposing_method
+        self._steering_method = CONF.steering_method
+        self._nexthops = None
+        if CONF.use_nexthop_objects:
+            self._nexthops = linux_net.Nexthops()
         self.ovn_routing_tables = {}  # {'br-ex': 200}
         self.ovn_bridge_mappings = {}  # {'public': 'br-ex'}
+        # {datapath: (bridge, vlan_tag)}
+        self._provider_cache = {}
+        self._provider_cache_generation = None
         self.ovn_local_cr_lrps = {}
         self.ovn_local_lrps = set([])
-        # {'br-ex': [route1, route2]}
-        self.ovn_routing_tables_routes = collections.defaultdict()
+        self.ovn_routing_tables_routes = linux_net.RouteRegistry(
+            nexthops=self._nexthops)
 
         self.ovs_idl = ovs.OvsIdl()
         self.ovs_idl.start(constants.OVS_CONNECTION_STRING)
@@ -70,12 +92,16 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         # Ensure FRR is configure to leak the routes
         # NOTE: If we want to recheck this every X time, we should move it
         # inside the sync function instead
-        frr.vrf_leak(constants.OVN_BGP_VRF, CONF.bgp_AS, CONF.bgp_router_id)
+        frr.vrf_leak(constants.OVN_BGP_VRF, CONF.bgp_AS, CONF.bgp_router_id,
+                     exposing_method=self._exposing_method)
 
         # start the subscriptions to the OSP events. This ensures the watcher
         # calls the relevant driver methods upon registered events
         self.sb_idl = self._sb_idl.start()
 
+    def stop(self):
+        linux_net.close_netlink_context()
+
     def _get_events(self):
         events = set(["PortBindingChassisCreatedEvent",
                       "PortBindingChassisDeletedEvent",
@@ -89,11 +115,25 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                            "TenantPortDeletedEvent"])
         return events
 
-    @lockutils.synchronized('bgp')
     def sync(self):
+        # Until the SB DB server has sent the rows of the monitor condition
+        # the desired state is incomplete, so nothing can be withdrawn yet.
+        # The IDL wakes this up on the ack, and the bgp lock is not held
+        # meanwhile so the events keep being processed.
+        delete = self.sb_idl.wait_for_port_binding_condition(
+            PORT_BINDING_CONDITION_TIMEOUT)
+        if not delete:
+            LOG.warning("Port_Binding monitor condition not acknowledged "
+                        "by the SB DB yet, skipping the removal of the "
+                        "extra IPs, rules, routes and NDP proxies")
+        self._sync(delete=delete)
+
+    @lockutils.synchronized('bgp')
+    def _sync(self, delete=True):
         self.ovn_local_cr_lrps = {}
         self.ovn_local_lrps = set([])
-        self.ovn_routing_tables_routes = collections.defaultdict()
+        self.ovn_routing_tables_routes = linux_net.RouteRegistry(
+            nexthops=self._nexthops)
 
         LOG.debug("Ensuring VRF configuration for advertising routes")
         # Create VRF
@@ -106,107 +146,258 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         LOG.debug("Configuring br-ex default rule and routing tables for "
                   "each provider network")
         flows_info = {}
+        provider_devices = set()  # (bridge, vlan_tag)
         # 1) Get bridge mappings: xxxx:br-ex,yyyy:br-ex2
         bridge_mappings = self.ovs_idl.get_ovn_bridge_mappings()
+        self._set_bridge_mappings(bridge_mappings)
         # 2) Get macs for bridge mappings
-        extra_routes = {}
-        with pyroute2.NDB() as ndb:
-            for bridge_mapping in bridge_mappings:
-                network = bridge_mapping.split(":")[0]
-                bridge = bridge_mapping.split(":")[1]
-                self.ovn_bridge_mappings[network] = bridge
-                if not extra_routes.get(bridge):
-                    extra_routes[bridge] = (
-                        linux_net.ensure_routing_table_for_bridge(
-                            self.ovn_routing_tables, bridge))
-                vlan_tag = self.sb_idl.get_network_vlan_tag_by_network_name(
-                    network)
-                if vlan_tag:
-                    vlan_tag = vlan_tag[0]
-                    linux_net.ensure_vlan_device_for_network(bridge,
-                                                             vlan_tag)
-
-                if flows_info.get(bridge):
-                    continue
-                flows_info[bridge] = {
-                    'mac': ndb.interfaces[bridge]['address'],
-                    'in_port': set([])}
-                # 3) Get in_port for bridge mappings (br-ex, br-ex2)
-                ovs.get_ovs_flows_info(bridge, flows_info,
-                                       constants.OVS_RULE_COOKIE)
+        for network, bridge in self.ovn_bridge_mappings.items():
+            if bridge not in flows_info:
+                # the routes on the table are synced later on
+                linux_net.ensure_routing_table_for_bridge(
+                    self.ovn_routing_tables, bridge,
+                    table_steering=(self._steering_method ==
+                                    constants.STEER_TABLE))
+            vlan_tag = self.sb_idl.get_network_vlan_tag_by_network_name(
+                network)
+            if vlan_tag:
+                vlan_tag = vlan_tag[0]
+                linux_net.ensure_vlan_device_for_network(bridge,
+                                                         vlan_tag)
+            provider_devices.add((bridge, vlan_tag or None))
+
+            if flows_info.get(bridge):
+                continue
+            flows_info[bridge] = {
+                'mac': linux_net.get_interface_address(bridge),
+                'in_port': set([])}
+            # 3) Get in_port for bridge mappings (br-ex, br-ex2)
+            ovs.get_ovs_flows_info(bridge, flows_info,
+                                   constants.OVS_RULE_COOKIE)
         # 4) Add/Remove flows for each bridge mappings
         ovs.remove_extra_ovs_flows(flows_info, constants.OVS_RULE_COOKIE)
 
         LOG.debug("Syncing current routes.")
-        exposed_ips = linux_net.get_exposed_ips(constants.OVN_BGP_NIC)
-        # get the rules pointing to ovn bridges
-        ovn_ip_rules = linux_net.get_ovn_ip_rules(
-            self.ovn_routing_tables.values())
-
-        # add missing routes/ips for fips/provider VMs
+        # 5) Compute the desired state from the SB DB
+        desired = _DesiredState()
+        # routes/ips for fips/provider VMs
         ports = self.sb_idl.get_ports_on_chassis(self.chassis)
         for port in ports:
-            self._ensure_port_exposed(port, exposed_ips, ovn_ip_rules)
+            self._add_port_desired_state(port, desired)
 
-        # add missing route/ips for tenant network VMs
+        # route/ips for tenant network VMs
         if self._expose_tenant_networks:
-            for cr_lrp_info in self.ovn_local_cr_lrps.values():
+            for cr_lrp, cr_lrp_info in self.ovn_local_cr_lrps.items():
                 lrp_ports = self.sb_idl.get_lrp_ports_for_router(
                     cr_lrp_info['router_datapath'])
                 for lrp in lrp_ports:
                     if lrp.chassis:
                         continue
-                    self._ensure_network_exposed(
-                        lrp, cr_lrp_info, exposed_ips, ovn_ip_rules)
-
-        # remove extra routes/ips
-        # remove all the leftovers on the list of current ips on dev OVN
-        linux_net.delete_exposed_ips(exposed_ips, constants.OVN_BGP_NIC)
-        # remove all the leftovers on the list of current ip rules for ovn
-        # bridges
-        linux_net.delete_ip_rules(ovn_ip_rules)
-
-        # remove all the extra rules not needed
-        linux_net.delete_bridge_ip_routes(self.ovn_routing_tables,
-                                          self.ovn_routing_tables_routes,
-                                          extra_routes)
+                    self._add_network_desired_state(cr_lrp, lrp, cr_lrp_info,
+                                                    desired)
+
+        # 6) Apply only the difference with the current state
+        ips_drift = self._sync_exposed_ips(desired.exposed_ips, delete=delete)
+        rules_drift = self._sync_ip_rules(desired.ip_rules, delete=delete)
+        routes_drift = linux_net.sync_bridge_routes(
+            self.ovn_routing_tables, self.ovn_routing_tables_routes,
+            delete=delete)
+        proxies_drift = (0, 0)
+        for bridge, vlan_tag in provider_devices | set(desired.ndp_proxies):
+            added, removed = linux_net.sync_ndp_proxies(
+                desired.ndp_proxies[(bridge, vlan_tag)], bridge,
+                vlan=vlan_tag, delete=delete)
+            proxies_drift = (proxies_drift[0] + added,
+                             proxies_drift[1] + removed)
+        if desired.default_ovs_flows:
+            ovs.ensure_default_ovs_flows(self.ovn_bridge_mappings.values(),
+                                         constants.OVS_RULE_COOKIE)
+        LOG.info("Sync fixed drift on IPs (added %d, removed %d), "
+                 "ip rules (added %d, removed %d), routes (added %d, "
+                 "removed %d) and NDP proxies (added %d, removed %d)",
+                 *(ips_drift + rules_drift + routes_drift + proxies_drift))
+
+    def _expose_ips(self, ips):
+        if self._exposing_method == constants.EXPOSE_ROUTE:
+            linux_net.add_exposed_routes_batch(
+                constants.OVN_BGP_NIC, ips, constants.OVN_BGP_VRF_TABLE)
+        else:
+            linux_net.add_ips_to_dev_batch(constants.OVN_BGP_NIC, ips)
+
+    def _withdraw_ips(self, ips):
+        if self._exposing_method == constants.EXPOSE_ROUTE:
+            linux_net.del_exposed_routes_batch(
+                constants.OVN_BGP_NIC, ips, constants.OVN_BGP_VRF_TABLE)
+        else:
+            linux_net.del_ips_from_dev_batch(constants.OVN_BGP_NIC, ips)
+
+    def _withdraw_ips_on_network(self, network):
+        if self._exposing_method == constants.EXPOSE_ROUTE:
+            ips = linux_net.get_exposed_routes_on_network(
+                constants.OVN_BGP_NIC, constants.OVN_BGP_VRF_TABLE, network)
+        else:
+            ips = linux_net.get_exposed_ips_on_network(
+                constants.OVN_BGP_NIC, network)
+        self._withdraw_ips(ips)
+
+    def _sync_exposed_ips(self, ips, delete=True):
+        # the IPs exposed with the other method (e.g., before the agent
+        # was reconfigured) are withdrawn
+        if self._exposing_method == constants.EXPOSE_ROUTE:
+            linux_net.sync_exposed_ips(constants.OVN_BGP_NIC, set())
+            return linux_net.sync_exposed_routes(
+                constants.OVN_BGP_NIC, ips, constants.OVN_BGP_VRF_TABLE,
+                delete=delete)
+        linux_net.sync_exposed_routes(constants.OVN_BGP_NIC, set(),
+                                      constants.OVN_BGP_VRF_TABLE)
+        return linux_net.sync_exposed_ips(constants.OVN_BGP_NIC, ips,
+                                          delete=delete)
+
+    def _add_ip_rules(self, ips, bridge, lladdr=None):
+        if self._steering_method == constants.STEER_TABLE:
+            # the routes on the bridge table steer the traffic
+            if lladdr:
+                linux_net.add_ip_neighbours_batch(ips, bridge, lladdr)
+            return
+        linux_net.add_ip_rules_batch(ips, self.ovn_routing_tables[bridge],
+                                     bridge, lladdr=lladdr)
 
-    def _ensure_port_exposed(self, port, exposed_ips, ovn_ip_rules):
+    def _del_ip_rules(self, ips, bridge, lladdr=None):
+        if self._steering_method == constants.STEER_TABLE:
+            if lladdr:
+                linux_net.del_ip_neighbours_batch(ips, bridge)
+            return
+        for ip in ips:
+            linux_net.del_ip_rule(ip, self.ovn_routing_tables[bridge],
+                                  bridge, lladdr=lladdr)
+
+    def _sync_ip_rules(self, ip_rules, delete=True):
+        tables = list(self.ovn_routing_tables.values())
+        if self._steering_method == constants.STEER_TABLE:
+            # only the neighbours of the rules are needed, and the
+            # per destination rules (e.g., from before the agent was
+            # reconfigured) go away, so both count as rules drift
+            neighbours_drift = linux_net.sync_ip_neighbours(
+                ip_rules, list(self.ovn_routing_tables), delete=delete)
+            rules_drift = linux_net.sync_ip_rules({}, tables, delete=delete)
+            return tuple(map(sum, zip(neighbours_drift, rules_drift)))
+        return linux_net.sync_ip_rules(ip_rules, tables, delete=delete)
+
+    def _add_desired_ips(self, desired, ips, bridge, vlan_tag, lladdr=None):
+        table = self.ovn_routing_tables[bridge]
+        for ip in ips:
+            desired.exposed_ips.add(ip)
+            if linux_net.get_ip_version(ip) == constants.IP_VERSION_6:
+                ip_dst = "{}/128".format(ip)
+            else:
+                ip_dst = "{}/32".format(ip)
+            desired.ip_rules[ip_dst] = {'table': table, 'dev': bridge,
+                                        'lladdr': lladdr}
+            self._add_desired_route(bridge, vlan_tag, ip)
+
+    def _add_desired_route(self, bridge, vlan_tag, ip, mask=None, via=None,
+                           owner=None):
+        route = linux_net.get_bridge_route(
+            ip, self.ovn_routing_tables[bridge], bridge, vlan=vlan_tag,
+            mask=mask, via=via)
+        self.ovn_routing_tables_routes.add(bridge, route, vlan=vlan_tag,
+                                           owner=owner)
+
+    def _add_port_desired_state(self, port, desired):
         if port.type not in constants.OVN_VIF_PORT_TYPES:
             return
-        if (len(port.mac[0].split(' ')) != 2 and
-                len(port.mac[0].split(' ')) != 3):
+        addresses = ovn.get_port_addresses(port)
+        if not addresses.is_single_or_dual_stack():
             return
-        port_ips = [port.mac[0].split(' ')[1]]
-        if len(port.mac[0].split(' ')) == 3:
-            port_ips.append(port.mac[0].split(' ')[2])
-
-        fip = self._expose_IP(port_ips, port)
-        if fip:
-            if fip in exposed_ips:
-                exposed_ips.remove(fip)
-            fip_dst = "{}/32".format(fip)
-            if fip_dst in ovn_ip_rules.keys():
-                del ovn_ip_rules[fip_dst]
-
-        for port_ip in port_ips:
-            ip_address = port_ip.split("/")[0]
-            ip_version = linux_net.get_ip_version(port_ip)
-            if ip_version == constants.IP_VERSION_6:
-                ip_dst = "{}/128".format(ip_address)
+        ips = list(addresses.ips)
+
+        if port.type == "" or port.type == "virtual":
+            # VM on provider Network
+            if self.sb_idl.is_provider_network(port.datapath):
+                bridge, vlan_tag = self._get_bridge_for_datapath(
+                    port.datapath)
+                self._add_desired_ips(desired, ips, bridge, vlan_tag)
+                return
+            # VM with FIP
+            fip_address, fip_datapath = self.sb_idl.get_fip_associated(
+                port.logical_port)
+            if fip_address:
+                bridge, vlan_tag = self._get_bridge_for_datapath(
+                    fip_datapath)
+                self._add_desired_ips(desired, [fip_address], bridge,
+                                      vlan_tag)
             else:
-                ip_dst = "{}/32".format(ip_address)
-            if ip_address in exposed_ips:
-                # remove each ip to add from the list of current ips on dev OVN
-                exposed_ips.remove(ip_address)
-            if ip_dst in ovn_ip_rules.keys():
-                del ovn_ip_rules[ip_dst]
-
-    def _ensure_network_exposed(self, router_port, gateway, exposed_ips=[],
-                                ovn_ip_rules={}):
+                desired.default_ovs_flows = True
+
+        # CR-LRP Port
+        elif port.logical_port.startswith('cr-'):
+            _, cr_lrp_datapath = self.sb_idl.get_fip_associated(
+                port.logical_port)
+            if not cr_lrp_datapath:
+                return
+            # Keeping information about the associated network for
+            # tenant network advertisement
+            self.ovn_local_cr_lrps[port.logical_port] = {
+                'router_datapath': port.datapath,
+                'provider_datapath': cr_lrp_datapath,
+                'ips': ips
+            }
+            bridge, vlan_tag = self._get_bridge_for_datapath(cr_lrp_datapath)
+            self._add_desired_ips(desired, [ip.split("/")[0] for ip in ips],
+                                  bridge, vlan_tag, lladdr=addresses.mac)
+            for ip in ips:
+                # proxy ndp config for ipv6
+                if linux_net.get_ip_version(ip) == constants.IP_VERSION_6:
+                    desired.ndp_proxies[(bridge, vlan_tag)].add(ip)
+
+    def _add_network_desired_state(self, cr_lrp, router_port, gateway,
+                                   desired):
         gateway_ips = [ip.split('/')[0] for ip in gateway['ips']]
         try:
-            router_port_ip = router_port.mac[0].split(' ')[1]
+            router_port_ip = ovn.get_port_addresses(router_port).ips[0]
+        except IndexError:
+            return
+        router_ip = router_port_ip.split('/')[0]
+        if router_ip in gateway_ips:
+            return
+        self.ovn_local_lrps.add(router_port.logical_port)
+        bridge, vlan_tag = self._get_bridge_for_datapath(
+            gateway['provider_datapath'])
+
+        desired.ip_rules[router_port_ip] = {
+            'table': self.ovn_routing_tables[bridge], 'dev': bridge}
+
+        router_port_ip_version = linux_net.get_ip_version(router_port_ip)
+        for gateway_ip in gateway_ips:
+            if linux_net.get_ip_version(gateway_ip) == router_port_ip_version:
+                self._add_desired_route(bridge, vlan_tag, router_ip,
+                                        mask=router_port_ip.split("/")[1],
+                                        via=gateway_ip, owner=cr_lrp)
+                break
+
+        network_port_datapath = self.sb_idl.get_port_datapath(
+            router_port.options['peer'])
+        if not network_port_datapath:
+            return
+        ports = self.sb_idl.get_ports_on_datapath(network_port_datapath)
+        for port in ports:
+            if ((port.type != "" and port.type != "virtual") or
+                    (port.type == "" and not port.chassis)):
+                continue
+            try:
+                port_ips = list(ovn.get_port_addresses(port).ips[:2])
+            except IndexError:
+                continue
+            # Only adding the port ips that match the lrp IP version
+            desired.exposed_ips.update(
+                port_ip for port_ip in port_ips
+                if (linux_net.get_ip_version(port_ip) ==
+                    router_port_ip_version))
+
+    def _ensure_network_exposed(self, cr_lrp, router_port, gateway):
+        gateway_ips = [ip.split('/')[0] for ip in gateway['ips']]
+        try:
+            router_port_ip = ovn.get_port_addresses(router_port).ips[0]
         except IndexError:
             return
         router_ip = router_port_ip.split('/')[0]
@@ -216,11 +407,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         rule_bridge, vlan_tag = self._get_bridge_for_datapath(
             gateway['provider_datapath'])
 
-        linux_net.add_ip_rule(router_port_ip,
-                              self.ovn_routing_tables[rule_bridge],
-                              rule_bridge)
-        if router_port_ip in ovn_ip_rules.keys():
-            del ovn_ip_rules[router_port_ip]
+        self._add_ip_rules([router_port_ip], rule_bridge)
 
         router_port_ip_version = linux_net.get_ip_version(router_port_ip)
         for gateway_ip in gateway_ips:
@@ -232,7 +419,8 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                     rule_bridge,
                     vlan=vlan_tag,
                     mask=router_port_ip.split("/")[1],
-                    via=gateway_ip)
+                    via=gateway_ip,
+                    owner=cr_lrp)
                 break
 
         network_port_datapath = self.sb_idl.get_port_datapath(
@@ -240,38 +428,31 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         if network_port_datapath:
             ports = self.sb_idl.get_ports_on_datapath(
                 network_port_datapath)
+            network_ips = []
             for port in ports:
                 if ((port.type != "" and port.type != "virtual") or
                         (port.type == "" and not port.chassis)):
                     continue
                 try:
-                    port_ips = [port.mac[0].split(' ')[1]]
+                    port_ips = list(ovn.get_port_addresses(port).ips[:2])
                 except IndexError:
                     continue
-                if len(port.mac[0].split(' ')) == 3:
-                    port_ips.append(port.mac[0].split(' ')[2])
+                if not port_ips:
+                    continue
 
                 for port_ip in port_ips:
                     # Only adding the port ips that match the lrp
                     # IP version
                     port_ip_version = linux_net.get_ip_version(port_ip)
                     if port_ip_version == router_port_ip_version:
-                        linux_net.add_ips_to_dev(
-                            constants.OVN_BGP_NIC, [port_ip])
-                        if port_ip in exposed_ips:
-                            exposed_ips.remove(port_ip)
-                        if router_port_ip_version == constants.IP_VERSION_6:
-                            ip_dst = "{}/128".format(port_ip)
-                        else:
-                            ip_dst = "{}/32".format(port_ip)
-
-                        if ip_dst in ovn_ip_rules.keys():
-                            del ovn_ip_rules[ip_dst]
+                        network_ips.append(port_ip)
+            if network_ips:
+                self._expose_ips(network_ips)
 
     def _remove_network_exposed(self, router_port, gateway):
         gateway_ips = [ip.split('/')[0] for ip in gateway['ips']]
         try:
-            router_port_ip = router_port.mac[0].split(' ')[1]
+            router_port_ip = ovn.get_port_addresses(router_port).ips[0]
         except IndexError:
             return
         router_ip = router_port_ip.split('/')[0]
@@ -283,9 +464,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         rule_bridge, vlan_tag = self._get_bridge_for_datapath(
             gateway['provider_datapath'])
 
-        linux_net.del_ip_rule(router_port_ip,
-                              self.ovn_routing_tables[rule_bridge],
-                              rule_bridge)
+        self._del_ip_rules([router_port_ip], rule_bridge)
 
         router_port_ip_version = linux_net.get_ip_version(router_port_ip)
         for gateway_ip in gateway_ips:
@@ -306,18 +485,36 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                 break
         # Check if there are VMs on the network
         # and if so withdraw the routes
-        vms_on_net = linux_net.get_exposed_ips_on_network(
-            constants.OVN_BGP_NIC, net)
-        linux_net.delete_exposed_ips(vms_on_net, constants.OVN_BGP_NIC)
+        self._withdraw_ips_on_network(net)
+
+    def _set_bridge_mappings(self, bridge_mappings):
+        ovn_bridge_mappings = dict(
+            bridge_mapping.split(":") for bridge_mapping in bridge_mappings)
+        if ovn_bridge_mappings != self.ovn_bridge_mappings:
+            self.ovn_bridge_mappings = ovn_bridge_mappings
+            self._provider_cache = {}
 
     def _get_bridge_for_datapath(self, datapath):
+        # The cache is only rebuilt when a localnet port changes in the SB
+        # or when the ovn-bridge-mappings change
+        generation = self.sb_idl.localnet_generation
+        if generation != self._provider_cache_generation:
+            self._provider_cache = {}
+            self._provider_cache_generation = generation
+        try:
+            return self._provider_cache[datapath]
+        except KeyError:
+            pass
+
+        bridge, vlan_tag = None, None
         network_name, network_tag = self.sb_idl.get_network_name_and_tag(
             datapath, self.ovn_bridge_mappings.keys())
         if network_name:
+            bridge = self.ovn_bridge_mappings[network_name]
             if network_tag:
-                return self.ovn_bridge_mappings[network_name], network_tag[0]
-            return self.ovn_bridge_mappings[network_name], None
-        return None, None
+                vlan_tag = network_tag[0]
+        self._provider_cache[datapath] = (bridge, vlan_tag)
+        return bridge, vlan_tag
 
     @lockutils.synchronized('bgp')
     def expose_IP(self, ips, row, associated_port=None):
@@ -342,17 +539,14 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         if ((row.type == "" or row.type == "virtual") and
                 self.sb_idl.is_provider_network(row.datapath)):
             LOG.info("Add BGP route for logical port with ip {}".format(ips))
-            linux_net.add_ips_to_dev(constants.OVN_BGP_NIC, ips)
+            self._expose_ips(ips)
 
             rule_bridge, vlan_tag = self._get_bridge_for_datapath(row.datapath)
-            for ip in ips:
-                linux_net.add_ip_rule(ip,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
-                linux_net.add_ip_route(
-                    self.ovn_routing_tables_routes, ip,
-                    self.ovn_routing_tables[rule_bridge], rule_bridge,
-                    vlan=vlan_tag)
+            self._add_ip_rules(ips, rule_bridge)
+            linux_net.add_ip_routes_batch(
+                self.ovn_routing_tables_routes, ips,
+                self.ovn_routing_tables[rule_bridge], rule_bridge,
+                vlan=vlan_tag)
 
         # VM with FIP
         elif row.type == "" or row.type == "virtual":
@@ -362,14 +556,11 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
             if fip_address:
                 LOG.info("Add BGP route for FIP with ip {}".format(
                     fip_address))
-                linux_net.add_ips_to_dev(constants.OVN_BGP_NIC,
-                                         [fip_address])
+                self._expose_ips([fip_address])
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     fip_datapath)
-                linux_net.add_ip_rule(fip_address,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
+                self._add_ip_rules([fip_address], rule_bridge)
                 linux_net.add_ip_route(
                     self.ovn_routing_tables_routes, fip_address,
                     self.ovn_routing_tables[rule_bridge], rule_bridge,
@@ -384,18 +575,15 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
             if (associated_port and self.sb_idl.is_port_on_chassis(
                     associated_port, self.chassis)):
                 LOG.info("Add BGP route for FIP with ip {}".format(ips))
-                linux_net.add_ips_to_dev(constants.OVN_BGP_NIC, ips)
+                self._expose_ips(ips)
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     row.datapath)
-                for ip in ips:
-                    linux_net.add_ip_rule(ip,
-                                          self.ovn_routing_tables[rule_bridge],
-                                          rule_bridge)
-                    linux_net.add_ip_route(
-                        self.ovn_routing_tables_routes, ip,
-                        self.ovn_routing_tables[rule_bridge], rule_bridge,
-                        vlan=vlan_tag)
+                self._add_ip_rules(ips, rule_bridge)
+                linux_net.add_ip_routes_batch(
+                    self.ovn_routing_tables_routes, ips,
+                    self.ovn_routing_tables[rule_bridge], rule_bridge,
+                    vlan=vlan_tag)
 
         # CR-LRP Port
         elif (row.type == "chassisredirect" and
@@ -412,25 +600,24 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                     'ips': ips
                 }
                 ips_without_mask = [ip.split("/")[0] for ip in ips]
-                linux_net.add_ips_to_dev(constants.OVN_BGP_NIC,
-                                         ips_without_mask)
+                self._expose_ips(ips_without_mask)
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     cr_lrp_datapath)
 
-                for ip in ips:
-                    ip_without_mask = ip.split("/")[0]
-                    linux_net.add_ip_rule(
-                        ip_without_mask, self.ovn_routing_tables[rule_bridge],
-                        rule_bridge, lladdr=row.mac[0].split(' ')[0])
-                    linux_net.add_ip_route(
-                        self.ovn_routing_tables_routes, ip_without_mask,
-                        self.ovn_routing_tables[rule_bridge], rule_bridge,
-                        vlan=vlan_tag)
-                    # add proxy ndp config for ipv6
-                    if (linux_net.get_ip_version(ip_without_mask) ==
-                            constants.IP_VERSION_6):
-                        linux_net.add_ndp_proxy(ip, rule_bridge, vlan_tag)
+                self._add_ip_rules(ips_without_mask, rule_bridge,
+                                   lladdr=ovn.get_port_addresses(row).mac)
+                linux_net.add_ip_routes_batch(
+                    self.ovn_routing_tables_routes, ips_without_mask,
+                    self.ovn_routing_tables[rule_bridge], rule_bridge,
+                    vlan=vlan_tag)
+                # add proxy ndp config for ipv6
+                ipv6_ips = [ip for ip in ips
+                            if (linux_net.get_ip_version(ip) ==
+                                constants.IP_VERSION_6)]
+                if ipv6_ips:
+                    linux_net.add_ndp_proxies(ipv6_ips, rule_bridge,
+                                              vlan=vlan_tag)
 
                 # Check if there are networks attached to the router,
                 # and if so, add the needed routes/rules
@@ -442,7 +629,8 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                     if lrp.chassis:
                         continue
                     self._ensure_network_exposed(
-                        lrp, self.ovn_local_cr_lrps[row.logical_port])
+                        row.logical_port, lrp,
+                        self.ovn_local_cr_lrps[row.logical_port])
 
     @lockutils.synchronized('bgp')
     def withdraw_IP(self, ips, row, associated_port=None):
@@ -466,13 +654,11 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                 self.sb_idl.is_provider_network(row.datapath)):
             LOG.info("Delete BGP route for logical port with ip {}".format(
                 ips))
-            linux_net.del_ips_from_dev(constants.OVN_BGP_NIC, ips)
+            self._withdraw_ips(ips)
 
             rule_bridge, vlan_tag = self._get_bridge_for_datapath(row.datapath)
             for ip in ips:
-                linux_net.del_ip_rule(ip,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
+                self._del_ip_rules([ip], rule_bridge)
                 linux_net.del_ip_route(
                     self.ovn_routing_tables_routes, ip,
                     self.ovn_routing_tables[rule_bridge], rule_bridge,
@@ -486,14 +672,11 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
             if fip_address:
                 LOG.info("Delete BGP route for FIP with ip {}".format(
                          fip_address))
-                linux_net.del_ips_from_dev(constants.OVN_BGP_NIC,
-                                           [fip_address])
+                self._withdraw_ips([fip_address])
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     fip_datapath)
-                linux_net.del_ip_rule(fip_address,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
+                self._del_ip_rules([fip_address], rule_bridge)
                 linux_net.del_ip_route(
                     self.ovn_routing_tables_routes, fip_address,
                     self.ovn_routing_tables[rule_bridge], rule_bridge,
@@ -506,14 +689,12 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                         associated_port, self.chassis) or
                     self.sb_idl.is_port_deleted(associated_port))):
                 LOG.info("Delete BGP route for FIP with ip {}".format(ips))
-                linux_net.del_ips_from_dev(constants.OVN_BGP_NIC, ips)
+                self._withdraw_ips(ips)
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     row.datapath)
                 for ip in ips:
-                    linux_net.del_ip_rule(ip,
-                                          self.ovn_routing_tables[rule_bridge],
-                                          rule_bridge)
+                    self._del_ip_rules([ip], rule_bridge)
                     linux_net.del_ip_route(
                         self.ovn_routing_tables_routes, ip,
                         self.ovn_routing_tables[rule_bridge], rule_bridge,
@@ -529,8 +710,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                 # Removing information about the associated network for
                 # tenant network advertisement
                 ips_without_mask = [ip.split("/")[0] for ip in ips]
-                linux_net.del_ips_from_dev(constants.OVN_BGP_NIC,
-                                           ips_without_mask)
+                self._withdraw_ips(ips_without_mask)
 
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     cr_lrp_datapath)
@@ -540,9 +720,9 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                         cr_lrp_ip = '{}/128'.format(ip)
                     else:
                         cr_lrp_ip = '{}/32'.format(ip)
-                    linux_net.del_ip_rule(
-                        cr_lrp_ip, self.ovn_routing_tables[rule_bridge],
-                        rule_bridge, lladdr=row.mac[0].split(' ')[0])
+                    self._del_ip_rules(
+                        [cr_lrp_ip], rule_bridge,
+                        lladdr=ovn.get_port_addresses(row).mac)
                     linux_net.del_ip_route(
                         self.ovn_routing_tables_routes, ip,
                         self.ovn_routing_tables[rule_bridge], rule_bridge,
@@ -580,7 +760,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         if port_lrp in self.ovn_local_lrps:
             LOG.info("Add BGP route for tenant IP {} on chassis {}".format(
                      ips, self.chassis))
-            linux_net.add_ips_to_dev(constants.OVN_BGP_NIC, ips)
+            self._expose_ips(ips)
 
     @lockutils.synchronized('bgp')
     def withdraw_remote_IP(self, ips, row):
@@ -591,7 +771,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
         if port_lrp in self.ovn_local_lrps:
             LOG.info("Delete BGP route for tenant IP {} on chassis {}".format(
                      ips, self.chassis))
-            linux_net.del_ips_from_dev(constants.OVN_BGP_NIC, ips)
+            self._withdraw_ips(ips)
 
     @lockutils.synchronized('bgp')
     def expose_subnet(self, ip, row):
@@ -610,9 +790,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                               for ip_address in cr_lrp_info.get('ips', [])]
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     cr_lrp_datapath)
-                linux_net.add_ip_rule(ip,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
+                self._add_ip_rules([ip], rule_bridge)
 
                 ip_version = linux_net.get_ip_version(ip)
                 for cr_lrp_ip in cr_lrp_ips:
@@ -624,7 +802,8 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                             rule_bridge,
                             vlan=vlan_tag,
                             mask=ip.split("/")[1],
-                            via=cr_lrp_ip)
+                            via=cr_lrp_ip,
+                            owner=cr_lrp)
                         break
 
                 # Check if there are VMs on the network
@@ -634,23 +813,26 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                 if network_port_datapath:
                     ports = self.sb_idl.get_ports_on_datapath(
                         network_port_datapath)
+                    network_ips = []
                     for port in ports:
                         if port.type != "" and port.type != "virtual":
                             continue
                         try:
-                            port_ips = [port.mac[0].split(' ')[1]]
+                            addresses = ovn.get_port_addresses(port)
+                            port_ips = list(addresses.ips[:2])
                         except IndexError:
                             continue
-                        if len(port.mac[0].split(' ')) == 3:
-                            port_ips.append(port.mac[0].split(' ')[2])
+                        if not port_ips:
+                            continue
 
                         for port_ip in port_ips:
                             # Only adding the port ips that match the lrp
                             # IP version
                             port_ip_version = linux_net.get_ip_version(port_ip)
                             if port_ip_version == ip_version:
-                                linux_net.add_ips_to_dev(
-                                    constants.OVN_BGP_NIC, [port_ip])
+                                network_ips.append(port_ip)
+                    if network_ips:
+                        self._expose_ips(network_ips)
 
     @lockutils.synchronized('bgp')
     def withdraw_subnet(self, ip, row):
@@ -671,9 +853,7 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
                               for ip_address in cr_lrp_info.get('ips', [])]
                 rule_bridge, vlan_tag = self._get_bridge_for_datapath(
                     cr_lrp_datapath)
-                linux_net.del_ip_rule(ip,
-                                      self.ovn_routing_tables[rule_bridge],
-                                      rule_bridge)
+                self._del_ip_rules([ip], rule_bridge)
 
                 ip_version = linux_net.get_ip_version(ip)
                 for cr_lrp_ip in cr_lrp_ips:
@@ -695,7 +875,4 @@ class OSPOVNBGPDriver(driver_api.AgentDriverBase):
 
                 # Check if there are VMs on the network
                 # and if so withdraw the routes
-                vms_on_net = linux_net.get_exposed_ips_on_network(
-                    constants.OVN_BGP_NIC, net)
-                linux_net.delete_exposed_ips(vms_on_net,
-                                             constants.OVN_BGP_NIC)
+                self._withdraw_ips_on_network(net)
@@ -41,10 +41,12 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
 
     def __init__(self):
         self.ovn_bridge_mappings = {}  # {'public': 'br-ex'}
+        # {datapath: (bridge, vlan_tag)}
+        self._provider_cache = {}
+        self._provider_cache_generation = None
         self.ovn_local_cr_lrps = {}
         self.ovn_local_lrps = {}
-        # {'br-ex': [route1, route2]}
-        self._ovn_routing_tables_routes = collections.defaultdict()
+        self._ovn_routing_tables_routes = linux_net.RouteRegistry()
         self._ovn_exposed_evpn_ips = collections.defaultdict()
 
         self.ovs_idl = ovs.OvsIdl()
@@ -69,6 +71,9 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
         # calls the relevant driver methods upon registered events
         self.sb_idl = self._sb_idl.start()
 
+    def stop(self):
+        linux_net.close_netlink_context()
+
     def _get_events(self):
         events = set(["PortBindingChassisCreatedEvent",
                       "PortBindingChassisDeletedEvent",
@@ -83,16 +88,12 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
     def sync(self):
         self.ovn_local_cr_lrps = {}
         self.ovn_local_lrps = {}
-        self._ovn_routing_tables_routes = collections.defaultdict()
+        self._ovn_routing_tables_routes = linux_net.RouteRegistry()
         self._ovn_exposed_evpn_ips = collections.defaultdict()
 
         # 1) Get bridge mappings: xxxx:br-ex,yyyy:br-ex2
         bridge_mappings = self.ovs_idl.get_ovn_bridge_mappings()
-        # 2) Get macs for bridge mappings
-        for bridge_mapping in bridge_mappings:
-            network = bridge_mapping.split(":")[0]
-            bridge = bridge_mapping.split(":")[1]
-            self.ovn_bridge_mappings[network] = bridge
+        self._set_bridge_mappings(bridge_mappings)
 
         # TO DO
         # add missing routes/ips for fips/provider VMs
@@ -117,7 +118,7 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
 
         gateway_ips = [ip.split('/')[0] for ip in gateway['ips']]
         try:
-            router_port_ip = router_port.mac[0].split(' ')[1]
+            router_port_ip = ovn.get_port_addresses(router_port).ips[0]
         except IndexError:
             return
         router_ip = router_port_ip.split('/')[0]
@@ -171,11 +172,11 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
                     (port.type == "" and not port.chassis)):
                 continue
             try:
-                port_ips = [port.mac[0].split(' ')[1]]
+                port_ips = list(ovn.get_port_addresses(port).ips[:2])
             except IndexError:
                 continue
-            if len(port.mac[0].split(' ')) == 3:
-                port_ips.append(port.mac[0].split(' ')[2])
+            if not port_ips:
+                continue
 
             for port_ip in port_ips:
                 # Only adding the port ips that match the lrp
@@ -188,14 +189,34 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
                     self._ovn_exposed_evpn_ips.setdefault(
                         gateway['lo'], []).extend([port_ip])
 
+    def _set_bridge_mappings(self, bridge_mappings):
+        ovn_bridge_mappings = dict(
+            bridge_mapping.split(":") for bridge_mapping in bridge_mappings)
+        if ovn_bridge_mappings != self.ovn_bridge_mappings:
+            self.ovn_bridge_mappings = ovn_bridge_mappings
+            self._provider_cache = {}
+
     def _get_bridge_for_datapath(self, datapath):
+        # The cache is only rebuilt when a localnet port changes in the SB
+        # or when the ovn-bridge-mappings change
+        generation = self.sb_idl.localnet_generation
+        if generation != self._provider_cache_generation:
+            self._provider_cache = {}
+            self._provider_cache_generation = generation
+        try:
+            return self._provider_cache[datapath]
+        except KeyError:
+            pass
+
+        bridge, vlan_tag = None, None
         network_name, network_tag = self.sb_idl.get_network_name_and_tag(
             datapath, self.ovn_bridge_mappings.keys())
         if network_name:
+            bridge = self.ovn_bridge_mappings[network_name]
             if network_tag:
-                return self.ovn_bridge_mappings[network_name], network_tag[0]
-            return self.ovn_bridge_mappings[network_name], None
-        return None, None
+                vlan_tag = network_tag[0]
+        self._provider_cache[datapath] = (bridge, vlan_tag)
+        return bridge, vlan_tag
 
     @lockutils.synchronized('evpn')
     def expose_IP(self, row, cr_lrp=False):
@@ -226,13 +247,9 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
         if not cr_lrp_datapath:
             return
 
-        if (len(cr_lrp_port.mac[0].split(' ')) != 2 and
-                len(cr_lrp_port.mac[0].split(' ')) != 3):
+        if not ovn.get_port_addresses(cr_lrp_port).is_single_or_dual_stack():
             return
-        ips = [cr_lrp_port.mac[0].split(' ')[1]]
-        # for dual-stack
-        if len(cr_lrp_port.mac[0].split(' ')) == 3:
-            ips.append(cr_lrp_port.mac[0].split(' ')[2])
+        ips = list(ovn.get_port_addresses(cr_lrp_port).ips)
 
         if cr_lrp:
             evpn_info = self.sb_idl.get_evpn_info_from_crlrp_port_name(
@@ -254,7 +271,7 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
             'router_datapath': cr_lrp_port.datapath,
             'provider_datapath': cr_lrp_datapath,
             'ips': ips,
-            'mac': cr_lrp_port.mac[0].split(' ')[0],
+            'mac': ovn.get_port_addresses(cr_lrp_port).mac,
             'vni': int(evpn_info['vni']),
             'bgp_as': evpn_info['bgp_as'],
             'lo': lo,
@@ -470,11 +487,11 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
             if port.type != "" and port.type != "virtual":
                 continue
             try:
-                port_ips = [port.mac[0].split(' ')[1]]
+                port_ips = list(ovn.get_port_addresses(port).ips[:2])
             except IndexError:
                 continue
-            if len(port.mac[0].split(' ')) == 3:
-                port_ips.append(port.mac[0].split(' ')[2])
+            if not port_ips:
+                continue
 
             for port_ip in port_ips:
                 # Only adding the port ips that match the lrp
@@ -637,11 +654,9 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
             bridges.append(cr_lrp_info['bridge'])
             vxlans.append(cr_lrp_info['vxlan'])
 
-        filter_out = ["{}.{}".format(key, value[0]['vlan'])
-                      for key, value in self._ovn_routing_tables_routes.items()
-                      if value[0]['vlan']]
+        filter_out = self._ovn_routing_tables_routes.get_vlan_devices()
 
-        interfaces = linux_net.get_interfaces(filter_out)
+        interfaces = linux_net.get_interfaces(list(filter_out))
         for interface in interfaces:
             if (interface.startswith(constants.OVN_EVPN_VRF_PREFIX) and
                     interface not in vrfs):
@@ -664,32 +679,9 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
         vrf_routes = linux_net.get_routes_on_tables(table_ids)
         if not vrf_routes:
             return
-        # remove from vrf_routes the routes that should be kept
-        for bridge, routes_info in self._ovn_routing_tables_routes.items():
-            for route_info in routes_info:
-                oif = linux_net.get_interface_index(bridge)
-                if route_info['vlan']:
-                    vlan_device_name = '{}.{}'.format(bridge,
-                                                      route_info['vlan'])
-                    oif = linux_net.get_interface_index(vlan_device_name)
-                if 'gateway' in route_info['route'].keys():  # subnet route
-                    possible_matchings = [
-                        r for r in vrf_routes
-                        if (r['dst'] == route_info['route']['dst'] and
-                            r['dst_len'] == route_info['route']['dst_len'] and
-                            r['gateway'] == route_info['route']['gateway'] and
-                            r['table'] == route_info['route']['table'])]
-                else:  # cr-lrp
-                    possible_matchings = [
-                        r for r in vrf_routes
-                        if (r['dst'] == route_info['route']['dst'] and
-                            r['dst_len'] == route_info['route']['dst_len'] and
-                            r['oif'] == oif and
-                            r['table'] == route_info['route']['table'])]
-                for r in possible_matchings:
-                    vrf_routes.remove(r)
-
-        linux_net.delete_ip_routes(vrf_routes)
+        # only remove the routes that should not be kept
+        linux_net.delete_ip_routes(
+            self._ovn_routing_tables_routes.get_stale(vrf_routes))
 
     def _remove_extra_ovs_flows(self):
         cr_lrp_mac_vrf_mappings = self._get_cr_lrp_mac_vrf_mapping()
@@ -714,7 +706,6 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
                             ovs.del_flow(flow, bridge,
                                          constants.OVS_VRF_RULE_COOKIE)
                         nw_src_ip = nw_src_mask = None
-                        matching_dst = False
                         if flow_info.get('nw_src'):
                             nw_src_ip = flow_info['nw_src'].split('/')[0]
                             nw_src_mask = int(
@@ -724,13 +715,8 @@ class OSPOVNEVPNDriver(driver_api.AgentDriverBase):
                             nw_src_mask = int(
                                 flow_info['ipv6_src'].split('/')[1])
 
-                        for route_info in self._ovn_routing_tables_routes[
-                                bridge]:
-                            if (route_info['route']['dst'] == nw_src_ip and
-                                    route_info['route'][
-                                        'dst_len'] == nw_src_mask):
-                                matching_dst = True
-                        if not matching_dst:
+                        if not self._ovn_routing_tables_routes.has_dst(
+                                bridge, nw_src_ip, nw_src_mask):
                             ovs.del_flow(flow, bridge,
                                          constants.OVS_VRF_RULE_COOKIE)
 
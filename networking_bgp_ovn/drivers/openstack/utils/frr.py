@@ -60,15 +60,27 @@ router bgp {{ bgp_as }}
 router bgp {{ bgp_as }} vrf {{ vrf_name }}
   bgp router-id {{ bgp_router_id }}
   address-family ipv4 unicast
-    redistribute connected
+    redistribute {{ redistribute }}
+{%- for protocol in no_redistribute %}
+    no redistribute {{ protocol }}
+{%- endfor %}
   exit-address-family
 
   address-family ipv6 unicast
-    redistribute connected
+    redistribute {{ redistribute }}
+{%- for protocol in no_redistribute %}
+    no redistribute {{ protocol }}
+{%- endfor %}
   exit-address-family
 
 '''
 
+# routes FRR redistributes from the leaked VRF for each exposing method
+REDISTRIBUTE = {
+    constants.EXPOSE_ADDRESS: 'connected',
+    constants.EXPOSE_ROUTE: 'kernel',
+}
+
 
 def _run_vtysh_config(frr_config_file):
     vtysh_command = "copy {} running-config".format(frr_config_file)
@@ -98,7 +110,24 @@ def _get_router_id(bgp_as):
     return json.loads(output).get('ipv4Unicast', {}).get('routerId')
 
 
-def vrf_leak(vrf, bgp_as, bgp_router_id=None):
+def _get_vrf_redistribute(bgp_as, vrf):
+    """Return the protocols redistributed on the bgp_as vrf router."""
+    output = _run_vtysh_command(command='show running-config')
+    router = 'router bgp {} vrf {}'.format(bgp_as, vrf)
+    protocols = set()
+    in_router = False
+    for line in output.splitlines():
+        if not line.startswith(' '):
+            in_router = line.strip() == router
+            continue
+        fields = line.split()
+        if in_router and len(fields) > 1 and fields[0] == 'redistribute':
+            protocols.add(fields[1])
+    return protocols
+
+
+def vrf_leak(vrf, bgp_as, bgp_router_id=None,
+             exposing_method=constants.EXPOSE_ADDRESS):
     LOG.info("Add VRF leak for VRF {} on router bgp {}".format(vrf, bgp_as))
     if not bgp_router_id:
         bgp_router_id = _get_router_id(bgp_as)
@@ -107,8 +136,15 @@ def vrf_leak(vrf, bgp_as, bgp_router_id=None):
             return
 
     vrf_template = Template(LEAK_VRF_TEMPLATE)
+    redistribute = REDISTRIBUTE[exposing_method]
+    # drop the redistribution of a previously used exposing method
+    no_redistribute = sorted(
+        protocol for protocol in _get_vrf_redistribute(bgp_as, vrf)
+        if protocol in REDISTRIBUTE.values() and protocol != redistribute)
     vrf_config = vrf_template.render(vrf_name=vrf, bgp_as=bgp_as,
-                                     bgp_router_id=bgp_router_id)
+                                     bgp_router_id=bgp_router_id,
+                                     redistribute=redistribute,
+                                     no_redistribute=no_redistribute)
     frr_config_file = "frr-config-vrf-leak-{}".format(vrf)
     with open(frr_config_file, 'w') as vrf_config_file:
         vrf_config_file.write(vrf_config)
@@ -12,23 +12,66 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import random
+import threading
+
 from oslo_config import cfg
+from oslo_log import log as logging
 
 from ovs.stream import Stream
 from ovsdbapp.backend import ovs_idl
 from ovsdbapp.backend.ovs_idl import connection
-from ovsdbapp.backend.ovs_idl import idlutils
 from ovsdbapp import event
 from ovsdbapp.schema.ovn_southbound import impl_idl as sb_impl_idl
 
 from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import ovsdb_schema
 
 CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def register_table_columns(helper, table, columns=None):
+    """Register only the given columns of a table, or all if not given."""
+    if columns:
+        helper.register_columns(table, list(columns))
+    else:
+        helper.register_table(table)
+
+
+def _is_local_remote(remote):
+    if remote.startswith('unix:'):
+        return True
+    address = remote.split(':', 1)[-1]
+    if address.startswith('['):
+        address = address[1:].split(']')[0]
+    else:
+        address = address.split(':')[0]
+    return address in ('127.0.0.1', '::1', 'localhost')
+
+
+def spread_remotes(remotes, chassis):
+    """Order the OVSDB remotes to spread the chassis between them.
+
+    Local endpoints (unix sockets and loopback, i.e. a relay running on
+    the node) go first. The rest are shuffled with the chassis name as
+    seed, so each chassis always gets the same order and the chassis are
+    spread evenly across the remotes.
+
+    Note the ovs library shuffles the remotes again when it opens the
+    session (ovs.jsonrpc.Session), which on its own already spreads the
+    chassis across the remotes, so this order is a preference that the
+    session does not keep.
+    """
+    remotes = sorted(remotes)
+    random.Random(chassis).shuffle(remotes)
+    return sorted(remotes, key=lambda remote: not _is_local_remote(remote))
 
 
 class OvnIdl(connection.OvsdbIdl):
-    def __init__(self, driver, remote, schema):
-        super(OvnIdl, self).__init__(remote, schema)
+    def __init__(self, driver, remote, schema, **kwargs):
+        super(OvnIdl, self).__init__(remote, schema, **kwargs)
         self.driver = driver
         self.notify_handler = OvnDbNotifyHandler(driver)
         self.event_lock_name = "neutron_ovn_event_lock"
@@ -45,29 +88,446 @@ class OvnDbNotifyHandler(event.RowEventHandler):
         self.driver = driver
 
 
+def _get_uuid(value):
+    return getattr(value, 'uuid', value)
+
+
+def parse_nat_address(nat):
+    """Split a Port_Binding nat_addresses entry.
+
+    Entries look like 'MAC IP [IP ...] [is_chassis_resident("port")]'.
+    Returns a (mac, ips, port) tuple, where port is the logical port the
+    NAT is bound to, or None if the entry is not bound to any.
+    """
+    fields = nat.split(' ')
+    ips = []
+    port = None
+    for field in fields[1:]:
+        if field.startswith('is_chassis_resident('):
+            port = field.split('"')[1]
+            break
+        ips.append(field)
+    return fields[0], ips, port
+
+
+class PortAddresses(collections.namedtuple(
+        'PortAddresses', ['mac', 'ips', 'ipv4', 'ipv6', 'prefixlens'])):
+    """Parsed Port_Binding mac column entry.
+
+    ips keeps the addresses as they appear in the entry (including the
+    prefix length for router ports), ipv4 and ipv6 hold the bare
+    addresses per family and prefixlens the prefix length of each entry
+    in ips (or None).
+    """
+    __slots__ = ()
+
+    def is_single_or_dual_stack(self):
+        return len(self.ips) in (1, 2)
+
+
+NatAddress = collections.namedtuple('NatAddress', ['mac', 'ips', 'port'])
+
+
+def parse_port_addresses(mac):
+    fields = mac.split(' ')
+    ips = tuple(fields[1:])
+    ipv4 = []
+    ipv6 = []
+    prefixlens = []
+    for ip in ips:
+        address, _, prefixlen = ip.partition('/')
+        prefixlens.append(int(prefixlen) if prefixlen.isdigit() else None)
+        if ':' in address:
+            ipv6.append(address)
+        else:
+            ipv4.append(address)
+    return PortAddresses(fields[0], ips, tuple(ipv4), tuple(ipv6),
+                         tuple(prefixlens))
+
+
+def _parse_nat_addresses(nat_addresses):
+    nats = []
+    for nat in nat_addresses:
+        mac, ips, port = parse_nat_address(nat)
+        nats.append(NatAddress(mac, tuple(ips), port))
+    return tuple(nats)
+
+
+# {(row_uuid, column): {raw_value: parsed_value}}
+# The last two values of each column are kept, so that events comparing
+# the new and old version of a row do not keep parsing them again.
+_ADDRESSES_CACHE = {}
+_ADDRESSES_CACHE_LOCK = threading.Lock()
+_ADDRESSES_CACHE_VERSIONS = 2
+
+
+def _get_cached_addresses(row, column, raw, parser):
+    key = (row.uuid, column)
+    with _ADDRESSES_CACHE_LOCK:
+        parsed = _ADDRESSES_CACHE.get(key, {}).get(raw)
+    if parsed is not None:
+        return parsed
+    parsed = parser(raw)
+    with _ADDRESSES_CACHE_LOCK:
+        versions = _ADDRESSES_CACHE.setdefault(key, {})
+        while len(versions) >= _ADDRESSES_CACHE_VERSIONS:
+            versions.pop(next(iter(versions)))
+        versions[raw] = parsed
+    return parsed
+
+
+def get_port_addresses(row):
+    """Return the PortAddresses of the first entry of row.mac.
+
+    Parsing is done once per row and mac value. Raises IndexError if the
+    row has no mac, as indexing row.mac would.
+    """
+    mac = row.mac[0]
+    return _get_cached_addresses(row, 'mac', mac, parse_port_addresses)
+
+
+def get_nat_addresses(row):
+    """Return the row nat_addresses as a tuple of NatAddress."""
+    nat_addresses = tuple(row.nat_addresses)
+    return _get_cached_addresses(row, 'nat_addresses', nat_addresses,
+                                 _parse_nat_addresses)
+
+
+def forget_row_addresses(row_uuid):
+    with _ADDRESSES_CACHE_LOCK:
+        _ADDRESSES_CACHE.pop((row_uuid, 'mac'), None)
+        _ADDRESSES_CACHE.pop((row_uuid, 'nat_addresses'), None)
+
+
+def clear_addresses_cache():
+    with _ADDRESSES_CACHE_LOCK:
+        _ADDRESSES_CACHE.clear()
+
+
+class _ForgetRowAddresses(object):
+    """Drops a deleted row from the addresses cache.
+
+    Queued to the notifications after the events matching the deletion,
+    which run later, from the notify thread, and parse the addresses of
+    the row again.
+    """
+
+    ONETIME = False
+
+    @staticmethod
+    def run(event, row, updates=None):
+        forget_row_addresses(row.uuid)
+
+
+class PortBindingIndex(object):
+    """In-memory indexes over the Port_Binding rows seen by the IDL.
+
+    The indexes are kept up to date from the IDL row notifications and
+    only store row UUIDs. Lookups resolve them against the IDL table, so
+    rows removed while the connection was down (and therefore never
+    notified as deleted) are silently skipped.
+    """
+
+    def __init__(self, chassis=None):
+        self._lock = threading.Lock()
+        self.chassis = chassis
+        # Port_Bindings bound to self.chassis
+        self._local = set()
+        # {row_uuid: (logical_port, datapath_uuid, type)}
+        self._keys = {}
+        self._by_name = {}
+        self._by_datapath = collections.defaultdict(set)
+        self._by_datapath_type = collections.defaultdict(set)
+        self._by_type = collections.defaultdict(set)
+        # bumped every time a localnet port is added, changed or removed
+        self.localnet_generation = 0
+        # {row_uuid: [nat_port1, nat_port2]}
+        self._nat_keys = {}
+        # {nat_port: {row_uuid: nat_ip}}
+        self._by_nat_port = collections.defaultdict(dict)
+
+    def update(self, event, row):
+        with self._lock:
+            old_keys = self._keys.get(row.uuid)
+            self._remove(row.uuid)
+            if event != 'delete':
+                self._add(row)
+            if (row.type == 'localnet' or
+                    (old_keys and old_keys[2] == 'localnet')):
+                self.localnet_generation += 1
+
+    def _add(self, row):
+        keys = (row.logical_port, _get_uuid(row.datapath), row.type)
+        self._keys[row.uuid] = keys
+        self._by_name[keys[0]] = row.uuid
+        self._by_datapath[keys[1]].add(row.uuid)
+        self._by_datapath_type[keys[1:]].add(row.uuid)
+        self._by_type[keys[2]].add(row.uuid)
+        if row.type == 'patch' and row.nat_addresses:
+            self._add_nat_addresses(row)
+        if self._is_local(row):
+            self._local.add(row.uuid)
+
+    def _is_local(self, row):
+        try:
+            return row.chassis[0].name == self.chassis
+        except (IndexError, AttributeError):
+            return False
+
+    def _add_nat_addresses(self, row):
+        nat_ports = []
+        for nat in get_nat_addresses(row):
+            if not nat.port or not nat.ips:
+                continue
+            nat_ports.append(nat.port)
+            self._by_nat_port[nat.port][row.uuid] = nat.ips[0]
+        self._nat_keys[row.uuid] = nat_ports
+
+    def _remove(self, row_uuid):
+        self._local.discard(row_uuid)
+        for port in self._nat_keys.pop(row_uuid, ()):
+            nat_rows = self._by_nat_port.get(port, {})
+            nat_rows.pop(row_uuid, None)
+            if not nat_rows:
+                self._by_nat_port.pop(port, None)
+        keys = self._keys.pop(row_uuid, None)
+        if not keys:
+            return
+        if self._by_name.get(keys[0]) == row_uuid:
+            del self._by_name[keys[0]]
+        self._discard(self._by_datapath, keys[1], row_uuid)
+        self._discard(self._by_datapath_type, keys[1:], row_uuid)
+        self._discard(self._by_type, keys[2], row_uuid)
+
+    @staticmethod
+    def _discard(index, key, row_uuid):
+        uuids = index.get(key)
+        if uuids is None:
+            return
+        uuids.discard(row_uuid)
+        if not uuids:
+            del index[key]
+
+    def get_by_name(self, rows, logical_port):
+        with self._lock:
+            row_uuid = self._by_name.get(logical_port)
+        if row_uuid is None:
+            return None
+        return rows.get(row_uuid)
+
+    def get_by_datapath(self, rows, datapath, port_type=None):
+        datapath = _get_uuid(datapath)
+        with self._lock:
+            if port_type is None:
+                uuids = list(self._by_datapath.get(datapath, ()))
+            else:
+                uuids = list(self._by_datapath_type.get(
+                    (datapath, port_type), ()))
+        ports = [rows.get(row_uuid) for row_uuid in uuids]
+        return [port for port in ports if port is not None]
+
+    def get_by_type(self, rows, port_type):
+        with self._lock:
+            uuids = list(self._by_type.get(port_type, ()))
+        ports = [rows.get(row_uuid) for row_uuid in uuids]
+        return [port for port in ports if port is not None]
+
+    def rebuild(self, rows):
+        """Rebuild all the indexes from the whole table.
+
+        Needed when the local Chassis row (re)appears, which means the
+        IDL got a full dump of the database: rows removed while the
+        connection was down were never notified as deleted, and bindings
+        referencing the chassis before it was known could not be resolved.
+        """
+        with self._lock:
+            self._local = set()
+            self._keys = {}
+            self._by_name = {}
+            self._by_datapath = collections.defaultdict(set)
+            self._by_datapath_type = collections.defaultdict(set)
+            self._by_type = collections.defaultdict(set)
+            self._nat_keys = {}
+            self._by_nat_port = collections.defaultdict(dict)
+            for row in list(rows.values()):
+                self._add(row)
+            self.localnet_generation += 1
+
+    def get_local_ports(self, rows):
+        with self._lock:
+            uuids = list(self._local)
+        ports = [rows.get(row_uuid) for row_uuid in uuids]
+        return [port for port in ports if port is not None]
+
+    def get_nat_address(self, rows, logical_port):
+        with self._lock:
+            nat_rows = list(self._by_nat_port.get(logical_port, {}).items())
+        for row_uuid, nat_ip in nat_rows:
+            row = rows.get(row_uuid)
+            if row is not None:
+                return nat_ip, row.datapath
+        return None, None
+
+
 class OvnSbIdl(OvnIdl):
     SCHEMA = 'OVN_Southbound'
 
     def __init__(self, connection_string, chassis=None, events=None,
-                 tables=None):
+                 tables=None, fetch_schema=False):
         if connection_string.startswith("ssl"):
             self._check_and_set_ssl_files(self.SCHEMA)
+        self._init_args = (connection_string, chassis, events, tables)
+        self._cached_schema = not fetch_schema
         helper = self._get_ovsdb_helper(connection_string)
         self._events = events
         if tables is None:
             tables = ('Chassis', 'Encap', 'Port_Binding', 'Datapath_Binding',
                       'SB_Global')
         for table in tables:
-            helper.register_table(table)
+            register_table_columns(
+                helper, table, constants.OVN_SB_TABLE_COLUMNS.get(table))
+        # The agent never writes to the SB, so it can be served by any
+        # cluster member or relay instead of only by the leader.
+        kwargs = {}
+        remotes = connection_string.split(',')
+        if not CONF.ovn_sb_leader_only:
+            kwargs['leader_only'] = False
+            if chassis and len(remotes) > 1:
+                connection_string = ','.join(spread_remotes(remotes,
+                                                            chassis))
         super(OvnSbIdl, self).__init__(
-            None, connection_string, helper)
+            None, connection_string, helper, **kwargs)
+        self.port_binding_index = PortBindingIndex(chassis)
+        self._conditional_monitoring = bool(
+            chassis and CONF.sb_conditional_monitoring and
+            'Port_Binding' in tables)
+        self._chassis_uuid = None
+        self._tenant_datapaths = set()
+        self._port_binding_cond_seqno = 0
+        # kept up to date by run(), so the waiters are woken up as soon as
+        # the server acknowledges the condition
+        self._port_binding_condition_acked = threading.Event()
+        self._port_binding_rows_loaded = not self._conditional_monitoring
         if chassis:
             table = ('Chassis_Private' if 'Chassis_Private' in tables
                      else 'Chassis')
             self.tables[table].condition = [['name', '==', chassis]]
+        if self._conditional_monitoring:
+            self.tables['Port_Binding'].condition = (
+                self._get_port_binding_condition())
+
+    def notify(self, event, row, updates=None):
+        update_condition = False
+        if row._table.name == 'Port_Binding':
+            self.port_binding_index.update(event, row)
+            update_condition = row.type in ('chassisredirect', 'patch')
+        elif (row._table.name == 'Chassis' and event == 'create' and
+                row.name == self.port_binding_index.chassis):
+            # The IDL resumes monitoring with monitor_cond_since, so this
+            # only happens on the first connection or when the server could
+            # not provide the changes missed while disconnected and sent
+            # the whole database instead.
+            self._chassis_uuid = row.uuid
+            clear_addresses_cache()
+            self.port_binding_index.rebuild(
+                self.tables['Port_Binding'].rows)
+            update_condition = True
+        if self._conditional_monitoring and update_condition:
+            self._update_port_binding_condition()
+        if (event == 'create' and row._table.name == 'Port_Binding' and
+                not self._port_binding_rows_loaded):
+            # Until the first condition ack only part of the rows are
+            # there, and the sync waiting for it exposes them at once.
+            return
+        super(OvnSbIdl, self).notify(event, row, updates)
+        if row._table.name == 'Port_Binding' and event == 'delete':
+            self.notify_handler.notifications.put(
+                (_ForgetRowAddresses, event, row, updates))
+
+    def _get_port_binding_condition(self):
+        condition = [['type', '==', port_type]
+                     for port_type in ('patch', 'chassisredirect',
+                                       'localnet')]
+        if self._chassis_uuid:
+            condition.append(
+                ['chassis', '==', ['uuid', str(self._chassis_uuid)]])
+        for datapath in sorted(self._tenant_datapaths):
+            condition.append(['datapath', '==', ['uuid', str(datapath)]])
+        return condition
+
+    def _get_tenant_datapaths(self):
+        # Tenant networks connected to routers whose gateway port is bound
+        # to this chassis. All their ports are needed to expose the VMs on
+        # them, wherever they are bound.
+        index = self.port_binding_index
+        rows = self.tables['Port_Binding'].rows
+        datapaths = set()
+        for cr_lrp in index.get_local_ports(rows):
+            if cr_lrp.type != 'chassisredirect':
+                continue
+            for lrp in index.get_by_datapath(rows, cr_lrp.datapath, 'patch'):
+                peer_name = (lrp.options or {}).get('peer')
+                peer = index.get_by_name(rows, peer_name)
+                if (peer is None or peer.datapath is None or
+                        index.get_by_datapath(rows, peer.datapath,
+                                              'localnet')):
+                    continue
+                datapaths.add(peer.datapath.uuid)
+        return datapaths
+
+    def _update_port_binding_condition(self):
+        tenant_datapaths = self._get_tenant_datapaths()
+        if (tenant_datapaths == self._tenant_datapaths and
+                self.tables['Port_Binding'].condition ==
+                self._get_port_binding_condition()):
+            return
+        self._tenant_datapaths = tenant_datapaths
+        seqno = self.cond_change('Port_Binding',
+                                 self._get_port_binding_condition())
+        # cond_seqno reaches the returned value once the server has sent
+        # the rows matching the new condition (older ovs returns nothing)
+        if seqno is not None:
+            self._port_binding_cond_seqno = seqno
+
+    def run(self):
+        changed = super(OvnSbIdl, self).run()
+        if self.is_port_binding_condition_acked():
+            self._port_binding_rows_loaded = True
+            self._port_binding_condition_acked.set()
+        else:
+            self._port_binding_condition_acked.clear()
+        return changed
+
+    def wait_for_port_binding_condition(self, timeout):
+        """Wait until the Port_Binding condition is acknowledged.
+
+        Returns False if it is still not after timeout seconds.
+        """
+        return self._port_binding_condition_acked.wait(timeout)
+
+    def is_port_binding_condition_acked(self):
+        """Whether the local Port_Binding rows are complete.
+
+        With conditional monitoring only the rows this chassis cares about
+        are received, and which ones is only known once the chassis and
+        the routers bound to it are. Until the server acknowledges the
+        widened condition, the rows are a partial view of the SB DB.
+        """
+        if not self._conditional_monitoring:
+            return True
+        if self._chassis_uuid is None:
+            return False
+        return self.cond_seqno >= self._port_binding_cond_seqno
 
     def _get_ovsdb_helper(self, connection_string):
-        return idlutils.get_schema_helper(connection_string, self.SCHEMA)
+        helper = None
+        if self._cached_schema:
+            helper = ovsdb_schema.get_cached_schema_helper(self.SCHEMA)
+        if helper is None:
+            self._cached_schema = False
+            helper = ovsdb_schema.fetch_schema_helper(connection_string,
+                                                      self.SCHEMA)
+        return helper
 
     def _check_and_set_ssl_files(self, schema_name):
         priv_key_file = CONF.ovn_sb_private_key
@@ -86,11 +546,29 @@ class OvnSbIdl(OvnIdl):
     def start(self):
         conn = connection.Connection(
             self, timeout=180)
-        ovsdbSbConn = OvsdbSbOvnIdl(conn)
+        try:
+            ovsdbSbConn = OvsdbSbOvnIdl(conn)
+        except Exception:
+            self.close()
+            if not self._cached_schema:
+                raise
+            LOG.exception("Unable to connect to the SB DB with the cached "
+                          "%s schema", self.SCHEMA)
+            return self._rebuild()
+        if (self._cached_schema and
+                not ovsdb_schema.validate_cached_schema(self, self.SCHEMA)):
+            conn.stop()
+            return self._rebuild()
         if self._events:
             self.notify_handler.watch_events(self._events)
         return ovsdbSbConn
 
+    def _rebuild(self):
+        # the cached schema may no longer be usable against the server
+        LOG.warning("Rebuilding the %s IDL with the schema fetched from the "
+                    "server", self.SCHEMA)
+        return type(self)(*self._init_args, fetch_schema=True).start()
+
 
 class Backend(ovs_idl.Backend):
     lookup_table = {}
@@ -113,36 +591,38 @@ class OvsdbSbOvnIdl(sb_impl_idl.OvnSbApiIdlImpl, Backend):
     def __init__(self, connection):
         super(OvsdbSbOvnIdl, self).__init__(connection)
         self.idl._session.reconnect.set_probe_interval(60000)
+        self._localnet_cache = None
+        self._localnet_cache_generation = None
+
+    def wait_for_port_binding_condition(self, timeout):
+        """Wait for the server to send all the relevant Port_Binding rows.
+
+        Returns False if they are still incomplete after timeout seconds.
+        """
+        return self.idl.wait_for_port_binding_condition(timeout)
+
+    @property
+    def _port_binding_rows(self):
+        return self.tables['Port_Binding'].rows
 
     def _get_port_by_name(self, port):
-        cmd = self.db_find_rows('Port_Binding', ('logical_port', '=', port))
-        port_info = cmd.execute(check_error=True)
+        port_info = self.idl.port_binding_index.get_by_name(
+            self._port_binding_rows, port)
         if port_info:
-            return port_info[0]
+            return port_info
         return []
 
     def _get_ports_by_datapath(self, datapath, port_type=None):
-        if port_type:
-            cmd = self.db_find_rows('Port_Binding',
-                                    ('datapath', '=', datapath),
-                                    ('type', '=', port_type))
-        else:
-            cmd = self.db_find_rows('Port_Binding',
-                                    ('datapath', '=', datapath))
-        return cmd.execute(check_error=True)
+        return self.idl.port_binding_index.get_by_datapath(
+            self._port_binding_rows, datapath, port_type)
 
     def is_provider_network(self, datapath):
-        cmd = self.db_find_rows('Port_Binding', ('datapath', '=', datapath),
-                                ('type', '=', 'localnet'))
-        return next(iter(cmd.execute(check_error=True)), None)
+        return next(iter(self._get_ports_by_datapath(datapath, 'localnet')),
+                    None)
 
     def get_fip_associated(self, port):
-        cmd = self.db_find_rows('Port_Binding', ('type', '=', 'patch'))
-        for row in cmd.execute(check_error=True):
-            for fip in row.nat_addresses:
-                if port in fip:
-                    return fip.split(" ")[1], row.datapath
-        return None, None
+        return self.idl.port_binding_index.get_nat_address(
+            self._port_binding_rows, port)
 
     def is_port_on_chassis(self, port_name, chassis):
         port_info = self._get_port_by_name(port_name)
@@ -161,23 +641,46 @@ class OvsdbSbOvnIdl(sb_impl_idl.OvnSbApiIdlImpl, Backend):
         return True
 
     def get_ports_on_chassis(self, chassis):
+        if chassis == self.idl.port_binding_index.chassis:
+            return self.idl.port_binding_index.get_local_ports(
+                self._port_binding_rows)
         rows = self.db_list_rows('Port_Binding').execute(check_error=True)
         return [r for r in rows if r.chassis and r.chassis[0].name == chassis]
 
+    @property
+    def localnet_generation(self):
+        return self.idl.port_binding_index.localnet_generation
+
+    def _get_localnet_info(self):
+        # NOTE: read the generation before the rows, so that a change
+        # racing with the rebuild just triggers another one
+        generation = self.localnet_generation
+        if self._localnet_cache_generation != generation:
+            networks_by_datapath = collections.defaultdict(list)
+            network_tags = {}
+            for row in self.idl.port_binding_index.get_by_type(
+                    self._port_binding_rows, 'localnet'):
+                network_name = (row.options or {}).get('network_name')
+                if not network_name:
+                    continue
+                networks_by_datapath[_get_uuid(row.datapath)].append(
+                    (network_name, row.tag))
+                network_tags.setdefault(network_name, row.tag)
+            self._localnet_cache = (networks_by_datapath, network_tags)
+            self._localnet_cache_generation = generation
+        return self._localnet_cache
+
     def get_network_name_and_tag(self, datapath, bridge_mappings):
-        for row in self._get_ports_by_datapath(datapath, 'localnet'):
-            if (row.options and
-                    row.options.get('network_name') in bridge_mappings):
-                return row.options.get('network_name'), row.tag
+        networks_by_datapath, _ = self._get_localnet_info()
+        for network_name, tag in networks_by_datapath.get(
+                _get_uuid(datapath), ()):
+            if network_name in bridge_mappings:
+                return network_name, tag
         return None, None
 
     def get_network_vlan_tag_by_network_name(self, network_name):
-        cmd = self.db_find_rows('Port_Binding', ('type', '=', 'localnet'))
-        for row in cmd.execute(check_error=True):
-            if (row.options and
-                    row.options.get('network_name') == network_name):
-                return row.tag
-        return None
+        _, network_tags = self._get_localnet_info()
+        return network_tags.get(network_name)
 
     def is_router_gateway_on_chassis(self, datapath, chassis):
         port_info = self._get_ports_by_datapath(datapath, 'chassisredirect')
@@ -217,7 +720,7 @@ class OvsdbSbOvnIdl(sb_impl_idl.OvnSbApiIdlImpl, Backend):
     def get_ip_from_port_peer(self, port):
         peer_name = port.options['peer']
         peer_port = self._get_port_by_name(peer_name)
-        return peer_port.mac[0].split(' ')[1]
+        return get_port_addresses(peer_port).ips[0]
 
     def get_evpn_info_from_port(self, port):
         return self.get_evpn_info(port)
@@ -12,18 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pyroute2
-
 from oslo_concurrency import processutils
+from oslo_log import log as logging
 from ovs.db import idl
 
 from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import ovsdb_schema
 from networking_bgp_ovn.utils import linux_net
 
 from ovsdbapp.backend.ovs_idl import connection
-from ovsdbapp.backend.ovs_idl import idlutils
 from ovsdbapp.schema.open_vswitch import impl_idl as idl_ovs
 
+LOG = logging.getLogger(__name__)
+
 
 def ovs_cmd(command, args, timeout=None):
     full_args = [command]
@@ -97,36 +98,31 @@ def ensure_evpn_ovs_flow(bridge, cookie, mac, port, net, strip_vlan=False):
         'ovs-vsctl', ['get', 'Interface', port, 'ofport']
         )[0].rstrip()
 
+    bridge_mac = linux_net.get_interface_address(bridge)
     ip_version = linux_net.get_ip_version(net)
     if ip_version == constants.IP_VERSION_6:
-        with pyroute2.NDB() as ndb:
-            if strip_vlan:
-                flow = (
-                    "cookie={},priority=1000,ipv6,in_port={},dl_src:{},"
-                    "ipv6_src={} actions=mod_dl_dst:{},strip_vlan,"
-                    "output={}".format(
-                        cookie, ovs_ofport, mac, net,
-                        ndb.interfaces[bridge]['address'], vrf_ofport))
-            else:
-                flow = (
-                    "cookie={},priority=1000,ipv6,in_port={},dl_src:{},"
-                    "ipv6_src={} actions=mod_dl_dst:{},output={}".format(
-                        cookie, ovs_ofport, mac, net,
-                        ndb.interfaces[bridge]['address'], vrf_ofport))
+        if strip_vlan:
+            flow = (
+                "cookie={},priority=1000,ipv6,in_port={},dl_src:{},"
+                "ipv6_src={} actions=mod_dl_dst:{},strip_vlan,"
+                "output={}".format(
+                    cookie, ovs_ofport, mac, net, bridge_mac, vrf_ofport))
+        else:
+            flow = (
+                "cookie={},priority=1000,ipv6,in_port={},dl_src:{},"
+                "ipv6_src={} actions=mod_dl_dst:{},output={}".format(
+                    cookie, ovs_ofport, mac, net, bridge_mac, vrf_ofport))
     else:
-        with pyroute2.NDB() as ndb:
-            if strip_vlan:
-                flow = (
-                    "cookie={},priority=1000,ip,in_port={},dl_src:{},nw_src={}"
-                    "actions=mod_dl_dst:{},strip_vlan,output={}".format(
-                        cookie, ovs_ofport, mac, net,
-                        ndb.interfaces[bridge]['address'], vrf_ofport))
-            else:
-                flow = (
-                    "cookie={},priority=1000,ip,in_port={},dl_src:{},nw_src={}"
-                    "actions=mod_dl_dst:{},output={}".format(
-                        cookie, ovs_ofport, mac, net,
-                        ndb.interfaces[bridge]['address'], vrf_ofport))
+        if strip_vlan:
+            flow = (
+                "cookie={},priority=1000,ip,in_port={},dl_src:{},nw_src={}"
+                "actions=mod_dl_dst:{},strip_vlan,output={}".format(
+                    cookie, ovs_ofport, mac, net, bridge_mac, vrf_ofport))
+        else:
+            flow = (
+                "cookie={},priority=1000,ip,in_port={},dl_src:{},nw_src={}"
+                "actions=mod_dl_dst:{},output={}".format(
+                    cookie, ovs_ofport, mac, net, bridge_mac, vrf_ofport))
     ovs_cmd('ovs-ofctl', ['add-flow', bridge, flow])
 
 
@@ -195,15 +191,13 @@ def ensure_default_ovs_flows(ovn_bridge_mappings, cookie):
             # and in_port
             continue
 
-        with pyroute2.NDB() as ndb:
-            flow = ("cookie={},priority=900,ip,in_port={},"
-                    "actions=mod_dl_dst:{},NORMAL".format(
-                        cookie, ovs_ofport,
-                        ndb.interfaces[bridge]['address']))
-            flow_v6 = ("cookie={},priority=900,ipv6,in_port={},"
-                       "actions=mod_dl_dst:{},NORMAL".format(
-                           cookie, ovs_ofport,
-                           ndb.interfaces[bridge]['address']))
+        bridge_mac = linux_net.get_interface_address(bridge)
+        flow = ("cookie={},priority=900,ip,in_port={},"
+                "actions=mod_dl_dst:{},NORMAL".format(
+                    cookie, ovs_ofport, bridge_mac))
+        flow_v6 = ("cookie={},priority=900,ipv6,in_port={},"
+                   "actions=mod_dl_dst:{},NORMAL".format(
+                       cookie, ovs_ofport, bridge_mac))
         ovs_cmd('ovs-ofctl', ['add-flow', bridge, flow])
         ovs_cmd('ovs-ofctl', ['add-flow', bridge, flow_v6])
 
@@ -276,18 +270,46 @@ def get_flow_info(flow):
             'ipv6_src': flow_ipv6_src}
 
 
+class OvsdbIdl(idl_ovs.OvsdbIdl):
+    # one connection per instance, so that it can be replaced when the
+    # IDL is rebuilt with another schema
+    ovsdb_connection = None
+
+
 class OvsIdl(object):
     def start(self, connection_string):
-        helper = idlutils.get_schema_helper(connection_string,
-                                            'Open_vSwitch')
-        tables = ('Open_vSwitch', 'Bridge', 'Port', 'Interface')
-        for table in tables:
-            helper.register_table(table)
+        helper = ovsdb_schema.get_cached_schema_helper('Open_vSwitch')
+        if helper is not None:
+            try:
+                ovs_idl = self._connect(connection_string, helper)
+            except Exception:
+                LOG.exception("Unable to connect to %s with the cached "
+                              "Open_vSwitch schema", connection_string)
+            else:
+                if ovsdb_schema.validate_cached_schema(ovs_idl,
+                                                       'Open_vSwitch'):
+                    return
+                self.idl_ovs.ovsdb_connection.stop()
+            # the cached schema may no longer be usable against the server
+            LOG.warning("Rebuilding the Open_vSwitch IDL with the schema "
+                        "fetched from the server")
+        helper = ovsdb_schema.fetch_schema_helper(connection_string,
+                                                  'Open_vSwitch')
+        self._connect(connection_string, helper)
+
+    def _connect(self, connection_string, helper):
+        for table, columns in constants.OVS_TABLE_COLUMNS.items():
+            helper.register_columns(table, columns)
         ovs_idl = idl.Idl(connection_string, helper)
         ovs_idl._session.reconnect.set_probe_interval(60000)
         conn = connection.Connection(
             ovs_idl, timeout=180)
-        self.idl_ovs = idl_ovs.OvsdbIdl(conn)
+        try:
+            self.idl_ovs = OvsdbIdl(conn)
+        except Exception:
+            ovs_idl.close()
+            raise
+        return ovs_idl
 
     def get_own_chassis_name(self):
         """Return the external_ids:system-id value of the Open_vSwitch table.
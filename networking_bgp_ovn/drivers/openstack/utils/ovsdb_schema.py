@@ -0,0 +1,124 @@
+# Copyright 2021 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from ovsdbapp.backend.ovs_idl import idlutils
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def _get_cache_file(schema_name):
+    if not CONF.ovsdb_schema_cache_dir:
+        return None
+    return os.path.join(CONF.ovsdb_schema_cache_dir,
+                        '{}.ovsschema'.format(schema_name))
+
+
+def _get_schema_id(schema):
+    return schema.get('version'), schema.get('cksum')
+
+
+def load_cached_schema(schema_name):
+    cache_file = _get_cache_file(schema_name)
+    if not cache_file:
+        return None
+    try:
+        with open(cache_file) as f:
+            schema = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(schema, dict) or schema.get('name') != schema_name:
+        return None
+    return schema
+
+
+def store_cached_schema(schema_name, schema):
+    cache_file = _get_cache_file(schema_name)
+    if not cache_file:
+        return
+    try:
+        os.makedirs(CONF.ovsdb_schema_cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'w', dir=CONF.ovsdb_schema_cache_dir, delete=False) as f:
+            json.dump(schema, f)
+        os.replace(f.name, cache_file)
+    except (IOError, OSError) as e:
+        LOG.warning("Unable to store OVSDB schema %s at %s: %s",
+                    schema_name, cache_file, e)
+
+
+def get_cached_schema_helper(schema_name):
+    """Return a SchemaHelper from the local cache, or None if not cached."""
+    schema = load_cached_schema(schema_name)
+    if schema is None:
+        return None
+    return idlutils.create_schema_helper(schema)
+
+
+def fetch_schema_helper(connection_string, schema_name):
+    """Return a SchemaHelper for the schema the server is running.
+
+    The fetched schema replaces the cached copy.
+    """
+    schema = idlutils.fetch_schema_json(connection_string, schema_name)
+    store_cached_schema(schema_name, schema)
+    return idlutils.create_schema_helper(schema)
+
+
+def _get_server_schema(idl, schema_name):
+    if not idl.server_tables or 'Database' not in idl.server_tables:
+        return None
+    for database in idl.server_tables['Database'].rows.values():
+        if database.name != schema_name:
+            continue
+        schema = database.schema
+        if isinstance(schema, list):
+            schema = schema[0] if schema else None
+        if schema:
+            return json.loads(schema)
+    return None
+
+
+def validate_cached_schema(idl, schema_name):
+    """Check the cached schema against the one the server is running.
+
+    The server publishes its schema in the _Server database the IDL
+    monitors, so no extra request is needed. On mismatch the cache is
+    refreshed with the server copy and False is returned.
+    """
+    if not _get_cache_file(schema_name):
+        return True
+    try:
+        server_schema = _get_server_schema(idl, schema_name)
+    except (AttributeError, KeyError, ValueError):
+        return True
+    if server_schema is None:
+        return True
+    cached_schema = load_cached_schema(schema_name)
+    if (cached_schema is not None and
+            _get_schema_id(cached_schema) == _get_schema_id(server_schema)):
+        return True
+    LOG.warning("Cached OVSDB schema %s (version %s) does not match the "
+                "server one (version %s), refreshing it",
+                schema_name,
+                cached_schema and cached_schema.get('version'),
+                server_schema.get('version'))
+    store_cached_schema(schema_name, server_schema)
+    return False
@@ -13,14 +13,27 @@
 # limitations under the License.
 
 from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import ovn
 
 from ovsdbapp.backend.ovs_idl import event as row_event
 
 from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
 
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
 _SYNC_STATE_LOCK = lockutils.ReaderWriterLock()
 
 
+def _binding_events():
+    # With conditional monitoring, ports start matching the SB condition
+    # when they get bound, so they are notified as new rows.
+    if CONF.sb_conditional_monitoring:
+        return (row_event.RowEvent.ROW_UPDATE, row_event.RowEvent.ROW_CREATE)
+    return (row_event.RowEvent.ROW_UPDATE,)
+
+
 class PortBindingChassisEvent(row_event.RowEvent):
     def __init__(self, bgp_agent, events):
         self.agent = bgp_agent
@@ -32,16 +45,17 @@ class PortBindingChassisEvent(row_event.RowEvent):
 
 class PortBindingChassisCreatedEvent(PortBindingChassisEvent):
     def __init__(self, bgp_agent):
-        events = (self.ROW_UPDATE,)
+        events = _binding_events()
         super(PortBindingChassisCreatedEvent, self).__init__(
             bgp_agent, events)
 
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
+            if event == self.ROW_CREATE:
+                return row.chassis[0].name == self.agent.chassis
             return (row.chassis[0].name == self.agent.chassis and
                     not old.chassis)
         except (IndexError, AttributeError):
@@ -51,10 +65,7 @@ class PortBindingChassisCreatedEvent(PortBindingChassisEvent):
         if row.type not in constants.OVN_VIF_PORT_TYPES:
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.expose_IP(ips, row)
 
 
@@ -67,8 +78,7 @@ class PortBindingChassisDeletedEvent(PortBindingChassisEvent):
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             if event == self.ROW_UPDATE:
                 return (old.chassis[0].name == self.agent.chassis and
@@ -83,10 +93,7 @@ class PortBindingChassisDeletedEvent(PortBindingChassisEvent):
         if row.type not in constants.OVN_VIF_PORT_TYPES:
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.withdraw_IP(ips, row)
 
 
@@ -108,11 +115,11 @@ class FIPSetEvent(PortBindingChassisEvent):
         if row.type != 'patch':
             return
         with _SYNC_STATE_LOCK.read_lock():
-            for nat in row.nat_addresses:
-                if nat not in old.nat_addresses:
-                    ip = nat.split(" ")[1]
-                    port = nat.split(" ")[2].split("\"")[1]
-                    self.agent.expose_IP([ip], row, associated_port=port)
+            nats = ovn.get_nat_addresses(old)
+            for nat in ovn.get_nat_addresses(row):
+                if nat not in nats and nat.ips and nat.port:
+                    self.agent.expose_IP([nat.ips[0]], row,
+                                         associated_port=nat.port)
 
 
 class FIPUnsetEvent(PortBindingChassisEvent):
@@ -133,11 +140,11 @@ class FIPUnsetEvent(PortBindingChassisEvent):
         if row.type != 'patch':
             return
         with _SYNC_STATE_LOCK.read_lock():
-            for nat in old.nat_addresses:
-                if nat not in row.nat_addresses:
-                    ip = nat.split(" ")[1]
-                    port = nat.split(" ")[2].split("\"")[1]
-                    self.agent.withdraw_IP([ip], row, associated_port=port)
+            nats = ovn.get_nat_addresses(row)
+            for nat in ovn.get_nat_addresses(old):
+                if nat not in nats and nat.ips and nat.port:
+                    self.agent.withdraw_IP([nat.ips[0]], row,
+                                           associated_port=nat.port)
 
 
 class SubnetRouterAttachedEvent(PortBindingChassisEvent):
@@ -149,8 +156,7 @@ class SubnetRouterAttachedEvent(PortBindingChassisEvent):
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             return (not row.chassis and row.logical_port.startswith('lrp-'))
         except (IndexError, AttributeError):
@@ -160,7 +166,7 @@ class SubnetRouterAttachedEvent(PortBindingChassisEvent):
         if row.type != 'patch':
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ip_address = row.mac[0].split(' ')[1]
+            ip_address = ovn.get_port_addresses(row).ips[0]
             self.agent.expose_subnet(ip_address, row)
 
 
@@ -173,8 +179,7 @@ class SubnetRouterDetachedEvent(PortBindingChassisEvent):
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             return (not row.chassis and row.logical_port.startswith('lrp-'))
         except (IndexError, AttributeError):
@@ -184,22 +189,23 @@ class SubnetRouterDetachedEvent(PortBindingChassisEvent):
         if row.type != 'patch':
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ip_address = row.mac[0].split(' ')[1]
+            ip_address = ovn.get_port_addresses(row).ips[0]
             self.agent.withdraw_subnet(ip_address, row)
 
 
 class TenantPortCreatedEvent(PortBindingChassisEvent):
     def __init__(self, bgp_agent):
-        events = (self.ROW_UPDATE,)
+        events = _binding_events()
         super(TenantPortCreatedEvent, self).__init__(
             bgp_agent, events)
 
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
+            if event == self.ROW_CREATE:
+                return (row.chassis and self.agent.ovn_local_lrps != [])
             return (not old.chassis and
                     self.agent.ovn_local_lrps != [])
         except (IndexError, AttributeError):
@@ -209,10 +215,7 @@ class TenantPortCreatedEvent(PortBindingChassisEvent):
         if row.type != "" and row.type != "virtual":
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.expose_remote_IP(ips, row)
 
 
@@ -225,8 +228,7 @@ class TenantPortDeletedEvent(PortBindingChassisEvent):
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             return (self.agent.ovn_local_lrps != [])
         except (IndexError, AttributeError):
@@ -236,10 +238,7 @@ class TenantPortDeletedEvent(PortBindingChassisEvent):
         if row.type != "" and row.type != "virtual":
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.withdraw_remote_IP(ips, row)
 
 
@@ -255,10 +254,16 @@ class ChassisCreateEventBase(row_event.RowEvent):
         self.event_name = self.__class__.__name__
 
     def run(self, event, row, old):
+        # On reconnection the IDL resumes monitoring from the last
+        # transaction it got (monitor_cond_since), and the changes missed
+        # meanwhile are notified as regular row events. The chassis row is
+        # only created again when the server could not provide them and
+        # sent the whole database instead, which needs a full sync.
         if self.first_time:
             self.first_time = False
         else:
-            print("Connection to OVSDB established, doing a full sync")
+            LOG.info("Connection to OVSDB established without the missed "
+                     "changes, doing a full sync")
             self.agent.sync()
 
 
@@ -13,14 +13,27 @@
 # limitations under the License.
 
 from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import ovn
 
 from ovsdbapp.backend.ovs_idl import event as row_event
 
 from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
 
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
 _SYNC_STATE_LOCK = lockutils.ReaderWriterLock()
 
 
+def _binding_events():
+    # With conditional monitoring, ports start matching the SB condition
+    # when they get bound, so they are notified as new rows.
+    if CONF.sb_conditional_monitoring:
+        return (row_event.RowEvent.ROW_UPDATE, row_event.RowEvent.ROW_CREATE)
+    return (row_event.RowEvent.ROW_UPDATE,)
+
+
 class PortBindingChassisEvent(row_event.RowEvent):
     def __init__(self, bgp_agent, events):
         self.agent = bgp_agent
@@ -32,7 +45,7 @@ class PortBindingChassisEvent(row_event.RowEvent):
 
 class PortBindingChassisCreatedEvent(PortBindingChassisEvent):
     def __init__(self, bgp_agent):
-        events = (self.ROW_UPDATE,)
+        events = _binding_events()
         super(PortBindingChassisCreatedEvent, self).__init__(
             bgp_agent, events)
 
@@ -41,9 +54,10 @@ class PortBindingChassisCreatedEvent(PortBindingChassisEvent):
             # single and dual-stack format
             if row.type != 'chassisredirect':
                 return False
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
+            if event == self.ROW_CREATE:
+                return row.chassis[0].name == self.agent.chassis
             return (row.chassis[0].name == self.agent.chassis and
                     not old.chassis)
         except (IndexError, AttributeError):
@@ -67,8 +81,7 @@ class PortBindingChassisDeletedEvent(PortBindingChassisEvent):
             if row.type != 'chassisredirect':
                 return False
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             if event == self.ROW_UPDATE:
                 return (old.chassis[0].name == self.agent.chassis and
@@ -158,16 +171,17 @@ class SubnetRouterDetachedEvent(PortBindingChassisEvent):
 
 class TenantPortCreatedEvent(PortBindingChassisEvent):
     def __init__(self, bgp_agent):
-        events = (self.ROW_UPDATE,)
+        events = _binding_events()
         super(TenantPortCreatedEvent, self).__init__(
             bgp_agent, events)
 
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
+            if event == self.ROW_CREATE:
+                return (row.chassis and self.agent.ovn_local_lrps != [])
             return (not old.chassis and row.chassis and
                     self.agent.ovn_local_lrps != [])
         except (IndexError, AttributeError):
@@ -177,10 +191,7 @@ class TenantPortCreatedEvent(PortBindingChassisEvent):
         if row.type != "" and row.type != "virtual":
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.expose_remote_IP(ips, row)
 
 
@@ -193,8 +204,7 @@ class TenantPortDeletedEvent(PortBindingChassisEvent):
     def match_fn(self, event, row, old):
         try:
             # single and dual-stack format
-            if (len(row.mac[0].split(' ')) != 2 and
-                    len(row.mac[0].split(' ')) != 3):
+            if not ovn.get_port_addresses(row).is_single_or_dual_stack():
                 return False
             if event == self.ROW_UPDATE:
                 return (old.chassis and not row.chassis and
@@ -208,10 +218,7 @@ class TenantPortDeletedEvent(PortBindingChassisEvent):
         if row.type != "" and row.type != "virtual":
             return
         with _SYNC_STATE_LOCK.read_lock():
-            ips = [row.mac[0].split(' ')[1]]
-            # for dual-stack
-            if len(row.mac[0].split(' ')) == 3:
-                ips.append(row.mac[0].split(' ')[2])
+            ips = list(ovn.get_port_addresses(row).ips)
             self.agent.withdraw_remote_IP(ips, row)
 
 
@@ -227,10 +234,16 @@ class ChassisCreateEventBase(row_event.RowEvent):
         self.event_name = self.__class__.__name__
 
     def run(self, event, row, old):
+        # On reconnection the IDL resumes monitoring from the last
+        # transaction it got (monitor_cond_since), and the changes missed
+        # meanwhile are notified as regular row events. The chassis row is
+        # only created again when the server could not provide them and
+        # sent the whole database instead, which needs a full sync.
         if self.first_time:
             self.first_time = False
         else:
-            print("Connection to OVSDB established, doing a full sync")
+            LOG.info("Connection to OVSDB established without the missed "
+                     "changes, doing a full sync")
             self.agent.sync()
 
 
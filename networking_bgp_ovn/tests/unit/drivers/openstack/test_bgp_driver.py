@@ -10,4 +10,290 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+from unittest import mock
+
+from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack import ovn_bgp_driver as driver
+from networking_bgp_ovn.drivers.openstack.utils import ovn as ovn_utils
+from networking_bgp_ovn.tests import base as test_base
+from networking_bgp_ovn.utils import linux_net
+
+
+def _fake_port(uuid, logical_port, port_type, mac, datapath='dp-1',
+               chassis=None, options=None):
+    port = mock.Mock(uuid=uuid, logical_port=logical_port, type=port_type,
+                     mac=[mac], datapath=datapath, chassis=chassis or [],
+                     options=options or {})
+    return port
+
+
+def _fake_bridge_route(ip, table, dev, vlan=None, mask=None, via=None):
+    return linux_net._get_route(ip, table, 6, mask=mask, via=via)
+
+
+class _TestOSPOVNBGPDriverBase(test_base.TestCase):
+
+    def setUp(self):
+        super(_TestOSPOVNBGPDriverBase, self).setUp()
+        mock.patch.object(driver.ovs, 'OvsIdl').start()
+        mock.patch.object(driver.ovn, 'OvnSbIdl').start()
+        mock.patch.object(driver.linux_net, 'get_bridge_route',
+                          side_effect=_fake_bridge_route).start()
+        self.addCleanup(mock.patch.stopall)
+        ovn_utils.clear_addresses_cache()
+
+        self.bgp_driver = driver.OSPOVNBGPDriver()
+        self.bgp_driver.ovs_idl.get_ovn_bridge_mappings.return_value = [
+            'public:br-ex']
+        self.bgp_driver.ovn_bridge_mappings = {'public': 'br-ex'}
+        self.bgp_driver.ovn_routing_tables = {'br-ex': 200}
+        self.sb_idl = self.bgp_driver.sb_idl = mock.Mock()
+        self.sb_idl.localnet_generation = 1
+        self.sb_idl.get_network_name_and_tag.return_value = ('public', [])
+        self.sb_idl.get_network_vlan_tag_by_network_name.return_value = []
+        self.sb_idl.is_provider_network.return_value = False
+        self.sb_idl.get_fip_associated.return_value = (None, None)
+        self.sb_idl.wait_for_port_binding_condition.return_value = True
+        self.desired = driver._DesiredState()
+
+    def _get_routes(self):
+        return sorted(route['dst'] for route in
+                      self.bgp_driver.ovn_routing_tables_routes.get_routes())
+
+
+class TestOSPOVNBGPDriver(_TestOSPOVNBGPDriverBase):
+
+    def test_add_port_desired_state_provider_network(self):
+        self.sb_idl.is_provider_network.return_value = True
+        port = _fake_port('uuid-1', 'port-1', '',
+                          'fa:16:3e:00:00:01 172.24.4.5 2001:db8::5')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual({'172.24.4.5', '2001:db8::5'},
+                         self.desired.exposed_ips)
+        self.assertEqual(
+            {'172.24.4.5/32': {'table': 200, 'dev': 'br-ex',
+                               'lladdr': None},
+             '2001:db8::5/128': {'table': 200, 'dev': 'br-ex',
+                                 'lladdr': None}},
+            self.desired.ip_rules)
+        self.assertEqual(['172.24.4.5', '2001:db8::5'], self._get_routes())
+        self.assertFalse(self.desired.default_ovs_flows)
+
+    def test_add_port_desired_state_fip(self):
+        self.sb_idl.get_fip_associated.return_value = ('172.24.4.10',
+                                                       'provider-dp')
+        port = _fake_port('uuid-1', 'port-1', '',
+                          'fa:16:3e:00:00:01 10.0.0.5')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual({'172.24.4.10'}, self.desired.exposed_ips)
+        self.assertEqual(['172.24.4.10/32'], list(self.desired.ip_rules))
+        self.sb_idl.get_network_name_and_tag.assert_called_once_with(
+            'provider-dp', mock.ANY)
+
+    def test_add_port_desired_state_tenant_port(self):
+        port = _fake_port('uuid-1', 'port-1', '',
+                          'fa:16:3e:00:00:01 10.0.0.5')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual(set(), self.desired.exposed_ips)
+        self.assertEqual({}, self.desired.ip_rules)
+        self.assertTrue(self.desired.default_ovs_flows)
+
+    def test_add_port_desired_state_other_types(self):
+        port = _fake_port('uuid-1', 'lrp-1', 'patch',
+                          'fa:16:3e:00:00:01 10.0.0.1/24')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual(set(), self.desired.exposed_ips)
+        self.assertFalse(self.desired.default_ovs_flows)
+
+    def test_add_port_desired_state_cr_lrp(self):
+        self.sb_idl.get_fip_associated.return_value = (None, 'provider-dp')
+        port = _fake_port(
+            'uuid-1', 'cr-lrp-1', 'chassisredirect',
+            'fa:16:3e:00:00:02 172.24.4.20/24 2001:db8::20/64',
+            datapath='router-dp')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual({'172.24.4.20', '2001:db8::20'},
+                         self.desired.exposed_ips)
+        self.assertEqual('fa:16:3e:00:00:02',
+                         self.desired.ip_rules['172.24.4.20/32']['lladdr'])
+        self.assertEqual({('br-ex', None): {'2001:db8::20/64'}},
+                         dict(self.desired.ndp_proxies))
+        self.assertEqual(
+            {'cr-lrp-1': {'router_datapath': 'router-dp',
+                          'provider_datapath': 'provider-dp',
+                          'ips': ['172.24.4.20/24', '2001:db8::20/64']}},
+            self.bgp_driver.ovn_local_cr_lrps)
+
+    def test_add_port_desired_state_cr_lrp_no_gateway(self):
+        port = _fake_port('uuid-1', 'cr-lrp-1', 'chassisredirect',
+                          'fa:16:3e:00:00:02 172.24.4.20/24')
+
+        self.bgp_driver._add_port_desired_state(port, self.desired)
+
+        self.assertEqual(set(), self.desired.exposed_ips)
+        self.assertEqual({}, self.bgp_driver.ovn_local_cr_lrps)
+
+    def test_add_network_desired_state(self):
+        gateway = {'router_datapath': 'router-dp',
+                   'provider_datapath': 'provider-dp',
+                   'ips': ['172.24.4.20/24', '2001:db8::20/64']}
+        lrp = _fake_port('uuid-1', 'lrp-1', 'patch',
+                         'fa:16:3e:00:00:03 10.0.0.1/24',
+                         options={'peer': 'lrp-1-peer'})
+        vm_port = _fake_port('uuid-2', 'port-1', '',
+                             'fa:16:3e:00:00:04 10.0.0.5 fd00::5',
+                             chassis=[mock.Mock()])
+        unbound_port = _fake_port('uuid-3', 'port-2', '',
+                                  'fa:16:3e:00:00:05 10.0.0.6')
+        self.sb_idl.get_port_datapath.return_value = 'tenant-dp'
+        self.sb_idl.get_ports_on_datapath.return_value = [vm_port,
+                                                          unbound_port]
+
+        self.bgp_driver._add_network_desired_state('cr-lrp-1', lrp, gateway,
+                                                   self.desired)
+
+        self.assertEqual({'lrp-1'}, self.bgp_driver.ovn_local_lrps)
+        self.assertEqual({'10.0.0.1/24': {'table': 200, 'dev': 'br-ex'}},
+                         self.desired.ip_rules)
+        # only the IPs of the bound ports with the router port IP version
+        self.assertEqual({'10.0.0.5'}, self.desired.exposed_ips)
+        routes = self.bgp_driver.ovn_routing_tables_routes.get_routes()
+        self.assertEqual([('10.0.0.0', 24, '172.24.4.20')],
+                         [(route['dst'], route['dst_len'], route['gateway'])
+                          for route in routes])
+        # the route goes through the nexthop of the cr-lrp
+        self.assertEqual(
+            'cr-lrp-1',
+            self.bgp_driver.ovn_routing_tables_routes.get_owner(routes[0]))
+
+    def test_add_network_desired_state_gateway_port(self):
+        gateway = {'router_datapath': 'router-dp',
+                   'provider_datapath': 'provider-dp',
+                   'ips': ['172.24.4.20/24']}
+        lrp = _fake_port('uuid-1', 'lrp-1', 'patch',
+                         'fa:16:3e:00:00:03 172.24.4.20/24')
+
+        self.bgp_driver._add_network_desired_state('cr-lrp-1', lrp, gateway,
+                                                   self.desired)
+
+        self.assertEqual(set(), self.bgp_driver.ovn_local_lrps)
+        self.assertEqual({}, self.desired.ip_rules)
+
+
+class TestOSPOVNBGPDriverSync(_TestOSPOVNBGPDriverBase):
+
+    def setUp(self):
+        super(TestOSPOVNBGPDriverSync, self).setUp()
+        for name in ('ensure_vrf', 'ensure_ovn_device',
+                     'ensure_vlan_device_for_network',
+                     'ensure_routing_table_for_bridge',
+                     'get_interface_address', 'add_ips_to_dev_batch',
+                     'delete_exposed_ips', 'add_ip_rules_batch',
+                     'delete_ip_rules', 'sync_bridge_routes',
+                     'sync_ndp_proxies'):
+            setattr(self, 'm_' + name, mock.patch.object(
+                driver.linux_net, name).start())
+        self.m_sync_bridge_routes.return_value = (0, 0)
+        self.m_sync_ndp_proxies.return_value = (0, 0)
+        mock.patch.object(driver.linux_net, 'get_exposed_routes',
+                          return_value=[]).start()
+        self.m_get_exposed_ips = mock.patch.object(
+            driver.linux_net, 'get_exposed_ips').start()
+        self.m_get_ovn_ip_rules = mock.patch.object(
+            driver.linux_net, 'get_ovn_ip_rules').start()
+        for name in ('get_ovs_flows_info', 'remove_extra_ovs_flows',
+                     'ensure_default_ovs_flows'):
+            mock.patch.object(driver.ovs, name).start()
+
+        # a VM on the provider network, already exposed, and a FIP that
+        # is not exposed yet
+        self.sb_idl.is_provider_network.side_effect = (
+            lambda datapath: datapath == 'provider-dp')
+        self.sb_idl.get_fip_associated.return_value = ('172.24.4.10',
+                                                       'provider-dp')
+        self.sb_idl.get_ports_on_chassis.return_value = [
+            _fake_port('uuid-1', 'port-1', '', 'fa:16:3e:00:00:01 172.24.4.5',
+                       datapath='provider-dp'),
+            _fake_port('uuid-2', 'port-2', '', 'fa:16:3e:00:00:02 10.0.0.5',
+                       datapath='tenant-dp')]
+        # and a stale IP that is no longer on the SB DB
+        self.m_get_exposed_ips.return_value = ['172.24.4.5', '172.24.4.99']
+        self.m_get_ovn_ip_rules.return_value = {
+            '172.24.4.5/32': {'table': 200, 'family': linux_net.AF_INET},
+            '172.24.4.99/32': {'table': 200, 'family': linux_net.AF_INET}}
+
+    def test_sync(self):
+        self.bgp_driver.sync()
+
+        # only the missing IP is exposed, and only the stale one withdrawn
+        self.m_add_ips_to_dev_batch.assert_called_once_with(
+            constants.OVN_BGP_NIC, ['172.24.4.10'])
+        self.m_delete_exposed_ips.assert_called_once_with(
+            ['172.24.4.99'], constants.OVN_BGP_NIC)
+        self.m_delete_ip_rules.assert_called_once_with(
+            {'172.24.4.99/32': {'table': 200, 'family': linux_net.AF_INET}})
+        # the batch skips the rules already in place
+        self.assertEqual(
+            ['172.24.4.10/32', '172.24.4.5/32'],
+            sorted(self.m_add_ip_rules_batch.call_args[0][0]))
+        self.m_sync_bridge_routes.assert_called_once_with(
+            {'br-ex': 200}, self.bgp_driver.ovn_routing_tables_routes,
+            delete=True)
+        self.assertEqual(['172.24.4.10', '172.24.4.5'], self._get_routes())
+        self.m_sync_ndp_proxies.assert_called_once_with(
+            set(), 'br-ex', vlan=None, delete=True)
+
+    @mock.patch.object(driver.linux_net, 'sync_ip_neighbours',
+                       return_value=(1, 2))
+    def test_sync_table_steering(self, mock_sync_neighbours):
+        self.bgp_driver._steering_method = constants.STEER_TABLE
+
+        self.bgp_driver.sync()
+
+        # the neighbours are reconciled, stale ones included, and the per
+        # destination rules are not needed
+        mock_sync_neighbours.assert_called_once_with(
+            {'172.24.4.5/32': {'table': 200, 'dev': 'br-ex', 'lladdr': None},
+             '172.24.4.10/32': {'table': 200, 'dev': 'br-ex',
+                                'lladdr': None}},
+            ['br-ex'], delete=True)
+        self.m_add_ip_rules_batch.assert_not_called()
+        self.m_delete_ip_rules.assert_called_once_with(
+            self.m_get_ovn_ip_rules.return_value)
+
+    def test_sync_nothing_to_change(self):
+        self.m_get_exposed_ips.return_value = ['172.24.4.5', '172.24.4.10']
+        self.m_get_ovn_ip_rules.return_value = {
+            '172.24.4.5/32': {'table': 200, 'family': linux_net.AF_INET},
+            '172.24.4.10/32': {'table': 200, 'family': linux_net.AF_INET}}
+
+        self.bgp_driver.sync()
+
+        self.m_add_ips_to_dev_batch.assert_not_called()
+        self.m_delete_exposed_ips.assert_not_called()
+        self.m_delete_ip_rules.assert_not_called()
+
+    def test_sync_condition_not_acked(self):
+        self.sb_idl.wait_for_port_binding_condition.return_value = False
+
+        self.bgp_driver.sync()
+
+        # what is missing is still added, but nothing is withdrawn
+        self.m_add_ips_to_dev_batch.assert_called_once_with(
+            constants.OVN_BGP_NIC, ['172.24.4.10'])
+        self.m_delete_exposed_ips.assert_not_called()
+        self.m_delete_ip_rules.assert_not_called()
+        self.m_sync_bridge_routes.assert_called_once_with(
+            {'br-ex': 200}, self.bgp_driver.ovn_routing_tables_routes,
+            delete=False)
@@ -10,4 +10,66 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+from unittest import mock
+
+from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import frr
+from networking_bgp_ovn.tests import base as test_base
+
+RUNNING_CONFIG = '''
+router bgp 64999
+ address-family ipv4 unicast
+  redistribute kernel
+ exit-address-family
+exit
+!
+router bgp 64999 vrf bgp_vrf
+ bgp router-id 172.30.1.1
+ !
+ address-family ipv4 unicast
+  redistribute {}
+ exit-address-family
+exit
+!
+'''
+
+
+class TestVrfLeak(test_base.TestCase):
+
+    def setUp(self):
+        super(TestVrfLeak, self).setUp()
+        self.m_command = mock.patch.object(frr, '_run_vtysh_command').start()
+        mock.patch.object(frr, '_run_vtysh_config').start()
+        self.m_open = mock.patch.object(frr, 'open', mock.mock_open(),
+                                        create=True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _vrf_leak(self, exposing_method):
+        frr.vrf_leak('bgp_vrf', 64999, '172.30.1.1',
+                     exposing_method=exposing_method)
+        return self.m_open().write.call_args[0][0]
+
+    def test_vrf_leak(self):
+        self.m_command.return_value = RUNNING_CONFIG.format('connected')
+
+        config = self._vrf_leak(constants.EXPOSE_ADDRESS)
+
+        self.assertIn('redistribute connected', config)
+        self.assertNotIn('no redistribute', config)
+
+    def test_vrf_leak_method_changed(self):
+        self.m_command.return_value = RUNNING_CONFIG.format('kernel')
+
+        config = self._vrf_leak(constants.EXPOSE_ADDRESS)
+
+        self.assertEqual(2, config.count('no redistribute kernel'))
+        self.assertEqual(2, config.count('    redistribute connected'))
+
+    def test_vrf_leak_not_configured(self):
+        self.m_command.return_value = ''
+
+        config = self._vrf_leak(constants.EXPOSE_ROUTE)
+
+        self.assertIn('redistribute kernel', config)
+        self.assertNotIn('no redistribute', config)
@@ -10,4 +10,593 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+import threading
+from unittest import mock
+
+from oslo_config import cfg
+
+from networking_bgp_ovn import constants
+from networking_bgp_ovn.drivers.openstack.utils import ovn as ovn_utils
+from networking_bgp_ovn.tests import base as test_base
+
+
+def _fake_port(uuid, logical_port, datapath, port_type=''):
+    return mock.Mock(uuid=uuid, logical_port=logical_port,
+                     datapath=mock.Mock(uuid=datapath), type=port_type,
+                     chassis=[], nat_addresses=[])
+
+
+class TestPortBindingIndex(test_base.TestCase):
+
+    def setUp(self):
+        super(TestPortBindingIndex, self).setUp()
+        self.index = ovn_utils.PortBindingIndex()
+        self.rows = {}
+
+    def _notify(self, event, row):
+        if event == 'delete':
+            self.rows.pop(row.uuid, None)
+        else:
+            self.rows[row.uuid] = row
+        self.index.update(event, row)
+
+    def test_get_by_name(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        self._notify('create', port)
+
+        self.assertEqual(port, self.index.get_by_name(self.rows, 'port-1'))
+        self.assertIsNone(self.index.get_by_name(self.rows, 'port-2'))
+
+    def test_get_by_datapath(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        localnet = _fake_port('uuid-2', 'provnet-1', 'dp-1', 'localnet')
+        other = _fake_port('uuid-3', 'port-3', 'dp-2')
+        for row in (port, localnet, other):
+            self._notify('create', row)
+
+        self.assertCountEqual(
+            [port, localnet], self.index.get_by_datapath(self.rows, 'dp-1'))
+        self.assertEqual(
+            [localnet],
+            self.index.get_by_datapath(self.rows, localnet.datapath,
+                                       'localnet'))
+        self.assertEqual(
+            [], self.index.get_by_datapath(self.rows, 'dp-2', 'localnet'))
+
+    def test_update_moves_row(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        self._notify('create', port)
+        port.datapath = mock.Mock(uuid='dp-2')
+        port.type = 'virtual'
+        self._notify('update', port)
+
+        self.assertEqual([], self.index.get_by_datapath(self.rows, 'dp-1'))
+        self.assertEqual(
+            [port], self.index.get_by_datapath(self.rows, 'dp-2', 'virtual'))
+
+    def test_delete(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        self._notify('create', port)
+        self._notify('delete', port)
+
+        self.assertIsNone(self.index.get_by_name(self.rows, 'port-1'))
+        self.assertEqual([], self.index.get_by_datapath(self.rows, 'dp-1'))
+
+    def test_rows_missing_from_table_are_skipped(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        self._notify('create', port)
+        # e.g., row deleted while the connection was down
+        del self.rows['uuid-1']
+
+        self.assertIsNone(self.index.get_by_name(self.rows, 'port-1'))
+        self.assertEqual([], self.index.get_by_datapath(self.rows, 'dp-1'))
+
+    def test_get_nat_address(self):
+        patch = _fake_port('uuid-1', 'provnet-patch', 'dp-1', 'patch')
+        patch.nat_addresses = [
+            'fa:16:3e:00:00:01 172.24.4.10 is_chassis_resident("cr-lrp-1")',
+            'fa:16:3e:00:00:02 172.24.4.20 is_chassis_resident("vm-port")']
+        self._notify('create', patch)
+
+        self.assertEqual(
+            ('172.24.4.20', patch.datapath),
+            self.index.get_nat_address(self.rows, 'vm-port'))
+        self.assertEqual(
+            ('172.24.4.10', patch.datapath),
+            self.index.get_nat_address(self.rows, 'cr-lrp-1'))
+
+        patch.nat_addresses = patch.nat_addresses[:1]
+        self._notify('update', patch)
+        self.assertEqual(
+            (None, None), self.index.get_nat_address(self.rows, 'vm-port'))
+
+    def test_parse_nat_address(self):
+        self.assertEqual(
+            ('fa:16:3e:00:00:01', ['172.24.4.10', '2001:db8::10'], 'port'),
+            ovn_utils.parse_nat_address(
+                'fa:16:3e:00:00:01 172.24.4.10 2001:db8::10 '
+                'is_chassis_resident("port")'))
+        self.assertEqual(
+            ('fa:16:3e:00:00:01', ['172.24.4.10'], None),
+            ovn_utils.parse_nat_address('fa:16:3e:00:00:01 172.24.4.10'))
+
+    def test_get_local_ports(self):
+        self.index.chassis = 'local-chassis'
+        local_chassis = mock.Mock()
+        local_chassis.name = 'local-chassis'
+        remote_chassis = mock.Mock()
+        remote_chassis.name = 'remote-chassis'
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        port.chassis = [local_chassis]
+        remote_port = _fake_port('uuid-2', 'port-2', 'dp-1')
+        remote_port.chassis = [remote_chassis]
+        unbound_port = _fake_port('uuid-3', 'port-3', 'dp-1')
+        for row in (port, remote_port, unbound_port):
+            self._notify('create', row)
+
+        self.assertEqual([port], self.index.get_local_ports(self.rows))
+
+        port.chassis = []
+        remote_port.chassis = [local_chassis]
+        self._notify('update', port)
+        self._notify('update', remote_port)
+        self.assertEqual([remote_port], self.index.get_local_ports(self.rows))
+
+    def test_rebuild_local_ports(self):
+        self.index.chassis = 'local-chassis'
+        local_chassis = mock.Mock()
+        local_chassis.name = 'local-chassis'
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        self._notify('create', port)
+        # the chassis reference got resolved after the notification
+        port.chassis = [local_chassis]
+
+        self.index.rebuild(self.rows)
+
+        self.assertEqual([port], self.index.get_local_ports(self.rows))
+
+    def test_rebuild_drops_rows_never_notified_as_deleted(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        stale = _fake_port('uuid-2', 'port-2', 'dp-1')
+        self._notify('create', port)
+        self._notify('create', stale)
+        # full dump after reconnecting, the stale row is just gone
+        del self.rows['uuid-2']
+        self.rows['uuid-2-new'] = _fake_port('uuid-2-new', 'port-2', 'dp-2')
+
+        self.index.rebuild(self.rows)
+
+        self.assertEqual('uuid-2-new',
+                         self.index.get_by_name(self.rows, 'port-2').uuid)
+        self.assertEqual([port],
+                         self.index.get_by_datapath(self.rows, 'dp-1'))
+        self.assertNotIn('uuid-2', self.index._keys)
+
+    def test_localnet_generation(self):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+        localnet = _fake_port('uuid-2', 'provnet-1', 'dp-1', 'localnet')
+        self._notify('create', port)
+        self.assertEqual(0, self.index.localnet_generation)
+
+        self._notify('create', localnet)
+        self.assertEqual(1, self.index.localnet_generation)
+        self.assertEqual([localnet],
+                         self.index.get_by_type(self.rows, 'localnet'))
+
+        self._notify('delete', localnet)
+        self.assertEqual(2, self.index.localnet_generation)
+        self.assertEqual([], self.index.get_by_type(self.rows, 'localnet'))
+
+
+class TestPortAddresses(test_base.TestCase):
+
+    def setUp(self):
+        super(TestPortAddresses, self).setUp()
+        self.addCleanup(ovn_utils.forget_row_addresses, 'uuid-1')
+
+    def test_parse_port_addresses(self):
+        addresses = ovn_utils.parse_port_addresses(
+            'fa:16:3e:00:00:01 10.0.0.1/24 fd00::1/64')
+
+        self.assertEqual('fa:16:3e:00:00:01', addresses.mac)
+        self.assertEqual(('10.0.0.1/24', 'fd00::1/64'), addresses.ips)
+        self.assertEqual(('10.0.0.1',), addresses.ipv4)
+        self.assertEqual(('fd00::1',), addresses.ipv6)
+        self.assertEqual((24, 64), addresses.prefixlens)
+        self.assertTrue(addresses.is_single_or_dual_stack())
+
+    def test_parse_port_addresses_no_ips(self):
+        addresses = ovn_utils.parse_port_addresses('fa:16:3e:00:00:01')
+
+        self.assertEqual((), addresses.ips)
+        self.assertFalse(addresses.is_single_or_dual_stack())
+
+    def test_get_port_addresses_cached(self):
+        row = mock.Mock(uuid='uuid-1', mac=['fa:16:3e:00:00:01 10.0.0.1'])
+        with mock.patch.object(ovn_utils, 'parse_port_addresses',
+                               wraps=ovn_utils.parse_port_addresses) as parse:
+            first = ovn_utils.get_port_addresses(row)
+            self.assertIs(first, ovn_utils.get_port_addresses(row))
+            self.assertEqual(1, parse.call_count)
+
+            row.mac = ['fa:16:3e:00:00:01 10.0.0.2']
+            self.assertEqual(('10.0.0.2',),
+                             ovn_utils.get_port_addresses(row).ips)
+            self.assertEqual(2, parse.call_count)
+
+    def test_get_port_addresses_no_mac(self):
+        row = mock.Mock(uuid='uuid-1', mac=[])
+        self.assertRaises(IndexError, ovn_utils.get_port_addresses, row)
+
+    def test_get_nat_addresses(self):
+        row = mock.Mock(uuid='uuid-1', nat_addresses=[
+            'fa:16:3e:00:00:01 172.24.4.10 is_chassis_resident("port-1")'])
+
+        self.assertEqual(
+            (ovn_utils.NatAddress('fa:16:3e:00:00:01', ('172.24.4.10',),
+                                  'port-1'),),
+            ovn_utils.get_nat_addresses(row))
+
+
+class TestSpreadRemotes(test_base.TestCase):
+
+    remotes = ['tcp:10.0.0.1:6642', 'tcp:10.0.0.2:6642', 'tcp:10.0.0.3:6642']
+
+    def test_spread_remotes_stable_per_chassis(self):
+        self.assertEqual(
+            ovn_utils.spread_remotes(self.remotes, 'chassis-1'),
+            ovn_utils.spread_remotes(list(reversed(self.remotes)),
+                                     'chassis-1'))
+
+    def test_spread_remotes_across_chassis(self):
+        first_remotes = set(
+            ovn_utils.spread_remotes(self.remotes, 'chassis-%d' % i)[0]
+            for i in range(30))
+        self.assertEqual(set(self.remotes), first_remotes)
+
+    def test_spread_remotes_local_first(self):
+        remotes = self.remotes + ['unix:/run/ovn/ovnsb_db.sock',
+                                  'ssl:[::1]:6642']
+        ordered = ovn_utils.spread_remotes(remotes, 'chassis-1')
+
+        self.assertCountEqual(['unix:/run/ovn/ovnsb_db.sock',
+                               'ssl:[::1]:6642'], ordered[:2])
+        self.assertCountEqual(self.remotes, ordered[2:])
+
+
+class TestOvsdbSbOvnIdl(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvsdbSbOvnIdl, self).setUp()
+        self.sb_idl = ovn_utils.OvsdbSbOvnIdl(mock.Mock())
+        self.index = ovn_utils.PortBindingIndex()
+        self.rows = {}
+        self.sb_idl.ovsdb_connection.idl.port_binding_index = self.index
+        self.sb_idl.ovsdb_connection.idl.tables = {
+            'Port_Binding': mock.Mock(rows=self.rows)}
+
+    def _add_localnet(self, uuid, datapath, network_name, tag):
+        row = _fake_port(uuid, 'provnet-' + uuid, datapath, 'localnet')
+        row.options = {'network_name': network_name}
+        row.tag = tag
+        self.rows[uuid] = row
+        self.index.update('create', row)
+        return row
+
+    def test_get_network_name_and_tag(self):
+        self._add_localnet('uuid-1', 'dp-1', 'public', [])
+        self._add_localnet('uuid-2', 'dp-2', 'vlan-net', [100])
+
+        self.assertEqual(
+            ('public', []),
+            self.sb_idl.get_network_name_and_tag('dp-1', ['public']))
+        self.assertEqual(
+            (None, None),
+            self.sb_idl.get_network_name_and_tag('dp-1', ['other']))
+        self.assertEqual(
+            [100], self.sb_idl.get_network_vlan_tag_by_network_name(
+                'vlan-net'))
+
+    def test_localnet_cache_rebuilt_on_change(self):
+        self._add_localnet('uuid-1', 'dp-1', 'public', [])
+        self.assertIsNone(
+            self.sb_idl.get_network_vlan_tag_by_network_name('vlan-net'))
+
+        self._add_localnet('uuid-2', 'dp-2', 'vlan-net', [100])
+
+        self.assertEqual(
+            [100], self.sb_idl.get_network_vlan_tag_by_network_name(
+                'vlan-net'))
+
+    def test_wait_for_port_binding_condition(self):
+        idl = self.sb_idl.ovsdb_connection.idl
+
+        self.assertEqual(idl.wait_for_port_binding_condition.return_value,
+                         self.sb_idl.wait_for_port_binding_condition(30))
+        idl.wait_for_port_binding_condition.assert_called_once_with(30)
+
+
+class TestOvnSbIdlConditionalMonitoring(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvnSbIdlConditionalMonitoring, self).setUp()
+        self.idl = ovn_utils.OvnSbIdl.__new__(ovn_utils.OvnSbIdl)
+        self.idl.port_binding_index = ovn_utils.PortBindingIndex('chassis-1')
+        self.idl._conditional_monitoring = True
+        self.idl._chassis_uuid = None
+        self.idl._tenant_datapaths = set()
+        self.idl._port_binding_cond_seqno = 0
+        self.idl._port_binding_condition_acked = threading.Event()
+        self.idl._port_binding_rows_loaded = False
+        self.idl.cond_seqno = 0
+        self.rows = {}
+        self.table = mock.Mock(rows=self.rows, condition=[])
+        self.table.name = 'Port_Binding'
+        self.idl.tables = {'Port_Binding': self.table}
+        self.idl.cond_change = mock.Mock(return_value=1)
+        mock.patch.object(ovn_utils.OvnIdl, 'notify').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _notify(self, row, event='create'):
+        row._table = self.table
+        self.rows[row.uuid] = row
+        self.idl.notify(event, row)
+
+    def test_tenant_datapaths_added_to_condition(self):
+        cr_lrp = _fake_port('uuid-1', 'cr-lrp-1', 'router-1',
+                            'chassisredirect')
+        cr_lrp.chassis = [mock.Mock()]
+        cr_lrp.chassis[0].name = 'chassis-1'
+        lrp = _fake_port('uuid-2', 'lrp-1', 'router-1', 'patch')
+        lrp.options = {'peer': 'lrp-1-peer'}
+        peer = _fake_port('uuid-3', 'lrp-1-peer', 'tenant-1', 'patch')
+        self._notify(lrp)
+        self._notify(peer)
+        self.idl.cond_change.reset_mock()
+
+        self._notify(cr_lrp)
+
+        self.assertEqual({'tenant-1'}, self.idl._tenant_datapaths)
+        condition = self.idl.cond_change.call_args[0][1]
+        self.assertIn(['datapath', '==', ['uuid', 'tenant-1']], condition)
+        self.assertIn(['type', '==', 'chassisredirect'], condition)
+
+    def test_provider_datapaths_not_added_to_condition(self):
+        cr_lrp = _fake_port('uuid-1', 'cr-lrp-1', 'router-1',
+                            'chassisredirect')
+        cr_lrp.chassis = [mock.Mock()]
+        cr_lrp.chassis[0].name = 'chassis-1'
+        lrp = _fake_port('uuid-2', 'lrp-1', 'router-1', 'patch')
+        lrp.options = {'peer': 'lrp-1-peer'}
+        peer = _fake_port('uuid-3', 'lrp-1-peer', 'provider-1', 'patch')
+        localnet = _fake_port('uuid-4', 'provnet-1', 'provider-1',
+                              'localnet')
+        for row in (lrp, peer, localnet, cr_lrp):
+            self._notify(row)
+
+        self.assertEqual(set(), self.idl._tenant_datapaths)
+
+    def test_condition_not_acked_before_chassis(self):
+        self.assertFalse(self.idl.is_port_binding_condition_acked())
+
+    def test_condition_acked_after_server_reply(self):
+        self.idl._chassis_uuid = 'chassis-uuid'
+        self.idl._update_port_binding_condition()
+        self.assertFalse(self.idl.is_port_binding_condition_acked())
+
+        self.idl.cond_seqno = 1
+        self.assertTrue(self.idl.is_port_binding_condition_acked())
+
+    def test_condition_acked_without_conditional_monitoring(self):
+        self.idl._conditional_monitoring = False
+        self.assertTrue(self.idl.is_port_binding_condition_acked())
+
+    @mock.patch.object(ovn_utils.OvnIdl, 'run', return_value=True)
+    def test_wait_for_port_binding_condition(self, mock_run):
+        self.idl._chassis_uuid = 'chassis-uuid'
+        self.idl._update_port_binding_condition()
+        acked = []
+        waiter = threading.Thread(target=lambda: acked.append(
+            self.idl.wait_for_port_binding_condition(30)))
+        waiter.start()
+
+        self.assertTrue(self.idl.run())
+        self.assertFalse(self.idl.wait_for_port_binding_condition(0))
+        # the server reply woke the waiter up, with no polling
+        self.idl.cond_seqno = 1
+        self.idl.run()
+        waiter.join(5)
+
+        self.assertEqual([True], acked)
+
+    def test_wait_for_port_binding_condition_timeout(self):
+        self.assertFalse(self.idl.wait_for_port_binding_condition(0.01))
+
+    @mock.patch.object(ovn_utils.OvnIdl, 'run')
+    def test_create_events_held_until_condition_acked(self, mock_run):
+        port = _fake_port('uuid-1', 'port-1', 'dp-1')
+
+        self._notify(port)
+        self.idl._chassis_uuid = 'chassis-uuid'
+        self.idl.run()
+        # the sync exposes the rows it got before the ack, and the
+        # changes are notified from then on
+        ovn_utils.OvnIdl.notify.assert_not_called()
+        self.assertEqual([port], self.idl.port_binding_index.get_by_datapath(
+            self.rows, 'dp-1'))
+
+        self._notify(port, event='update')
+        self._notify(_fake_port('uuid-2', 'port-2', 'dp-1'))
+
+        self.assertEqual(2, ovn_utils.OvnIdl.notify.call_count)
+
+
+class _AddressesEvent(object):
+    """Parses the addresses of the row when matched and when run."""
+
+    priority = 10
+    ONETIME = False
+
+    def matches(self, event, row, updates=None):
+        return bool(ovn_utils.get_port_addresses(row))
+
+    def run(self, event, row, updates=None):
+        ovn_utils.get_port_addresses(row)
+
+
+class TestOvnSbIdlNotify(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvnSbIdlNotify, self).setUp()
+        self.idl = ovn_utils.OvnSbIdl.__new__(ovn_utils.OvnSbIdl)
+        self.idl.port_binding_index = ovn_utils.PortBindingIndex('chassis-1')
+        self.idl._conditional_monitoring = False
+        self.idl._port_binding_rows_loaded = True
+        self.idl.is_lock_contended = False
+        self.idl.notify_handler = ovn_utils.OvnDbNotifyHandler(mock.Mock())
+        self.addCleanup(self.idl.notify_handler.shutdown)
+        self.idl.notify_handler.watch_event(_AddressesEvent())
+        self.table = mock.Mock()
+        self.table.name = 'Port_Binding'
+        self.addCleanup(ovn_utils.forget_row_addresses, 'uuid-1')
+
+    def test_notify_delete_forgets_addresses(self):
+        row = _fake_port('uuid-1', 'port-1', 'dp-1')
+        row.mac = ['fa:16:3e:00:00:01 10.0.0.1']
+        row._table = self.table
+        self.idl.notify('create', row)
+        self.idl.notify_handler.notifications.join()
+        self.assertIn(('uuid-1', 'mac'), ovn_utils._ADDRESSES_CACHE)
+
+        self.idl.notify('delete', row)
+        self.idl.notify_handler.notifications.join()
+
+        # the deletion events parsed the addresses again, before and
+        # after being dispatched
+        self.assertNotIn(('uuid-1', 'mac'), ovn_utils._ADDRESSES_CACHE)
+
+
+class TestOvnSbIdlColumns(test_base.TestCase):
+
+    @mock.patch.object(ovn_utils.OvnIdl, '__init__', return_value=None)
+    @mock.patch.object(ovn_utils.OvnSbIdl, '_get_ovsdb_helper')
+    def test_register_columns(self, mock_helper, mock_init):
+        helper = mock_helper.return_value
+        tables = ('Port_Binding', 'Chassis', 'Datapath_Binding',
+                  'Chassis_Private')
+        ovn_utils.OvnSbIdl('tcp:127.0.0.1:6642', tables=tables)
+
+        helper.register_table.assert_not_called()
+        helper.register_columns.assert_has_calls(
+            [mock.call(table, constants.OVN_SB_TABLE_COLUMNS[table])
+             for table in tables])
+
+    def test_condition_columns_registered(self):
+        idl = ovn_utils.OvnSbIdl.__new__(ovn_utils.OvnSbIdl)
+        idl._chassis_uuid = 'chassis-uuid'
+        idl._tenant_datapaths = {'dp-1'}
+        columns = set(column for column, _, _ in
+                      idl._get_port_binding_condition())
+        self.assertTrue(columns.issubset(
+            constants.OVN_SB_TABLE_COLUMNS['Port_Binding']))
+
+
+class TestOvnSbIdlRemotes(test_base.TestCase):
+
+    remotes = 'tcp:10.0.0.1:6642,tcp:10.0.0.2:6642,unix:/run/ovnsb_db.sock'
+
+    def setUp(self):
+        super(TestOvnSbIdlRemotes, self).setUp()
+        mock.patch.object(ovn_utils.OvnSbIdl, '_get_ovsdb_helper').start()
+
+        def _init(idl, *args, **kwargs):
+            idl.tables = {'Chassis': mock.Mock(),
+                          'Port_Binding': mock.Mock()}
+
+        self.mock_init = mock.patch.object(
+            ovn_utils.OvnIdl, '__init__', side_effect=_init,
+            autospec=True).start()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(cfg.CONF.clear_override, 'ovn_sb_leader_only')
+
+    def test_leader_only(self):
+        ovn_utils.OvnSbIdl(self.remotes, chassis='chassis-1')
+
+        self.mock_init.assert_called_once_with(
+            mock.ANY, None, self.remotes, mock.ANY)
+
+    def test_not_leader_only(self):
+        cfg.CONF.set_override('ovn_sb_leader_only', False)
+
+        ovn_utils.OvnSbIdl(self.remotes, chassis='chassis-1')
+
+        # the remotes are given in order, not set on the session
+        self.mock_init.assert_called_once_with(
+            mock.ANY, None, ','.join(ovn_utils.spread_remotes(
+                self.remotes.split(','), 'chassis-1')),
+            mock.ANY, leader_only=False)
+
+
+class TestOvnSbIdlStart(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvnSbIdlStart, self).setUp()
+        self.idl = ovn_utils.OvnSbIdl.__new__(ovn_utils.OvnSbIdl)
+        self.idl._init_args = ('tcp:127.0.0.1:6642', 'chassis-1', None,
+                               None)
+        self.idl._cached_schema = True
+        self.idl._events = None
+        self.idl.close = mock.Mock()
+        self.m_conn = mock.patch.object(ovn_utils.connection,
+                                        'Connection').start()
+        self.m_backend = mock.patch.object(ovn_utils,
+                                           'OvsdbSbOvnIdl').start()
+        self.m_validate = mock.patch.object(
+            ovn_utils.ovsdb_schema, 'validate_cached_schema',
+            return_value=True).start()
+        self.rebuild_patch = mock.patch.object(ovn_utils.OvnSbIdl,
+                                               '_rebuild')
+        self.m_rebuild = self.rebuild_patch.start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_start(self):
+        self.assertEqual(self.m_backend.return_value, self.idl.start())
+        self.m_rebuild.assert_not_called()
+
+    def test_start_schema_mismatch(self):
+        self.m_validate.return_value = False
+
+        self.assertEqual(self.m_rebuild.return_value, self.idl.start())
+        self.m_conn.return_value.stop.assert_called_once_with()
+
+    def test_start_connection_failure(self):
+        self.m_backend.side_effect = Exception
+
+        self.assertEqual(self.m_rebuild.return_value, self.idl.start())
+        self.idl.close.assert_called_once_with()
+
+    def test_start_connection_failure_fetched_schema(self):
+        self.idl._cached_schema = False
+        self.m_backend.side_effect = Exception
+
+        self.assertRaises(Exception, self.idl.start)
+        self.m_rebuild.assert_not_called()
+        self.m_validate.assert_not_called()
+
+    @mock.patch.object(ovn_utils.OvnSbIdl, 'start')
+    @mock.patch.object(ovn_utils.OvnSbIdl, '__init__', return_value=None)
+    def test_rebuild(self, m_init, m_start):
+        self.rebuild_patch.stop()
+
+        self.assertEqual(m_start.return_value, self.idl._rebuild())
+        m_init.assert_called_once_with('tcp:127.0.0.1:6642', 'chassis-1',
+                                       None, None, fetch_schema=True)
+
+    @mock.patch.object(ovn_utils.ovsdb_schema, 'fetch_schema_helper')
+    @mock.patch.object(ovn_utils.ovsdb_schema, 'get_cached_schema_helper',
+                       return_value=None)
+    def test_get_ovsdb_helper_not_cached(self, m_cached, m_fetch):
+        self.assertEqual(m_fetch.return_value,
+                         self.idl._get_ovsdb_helper('tcp:127.0.0.1:6642'))
+        self.assertFalse(self.idl._cached_schema)
@@ -10,4 +10,65 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+
+from unittest import mock
+
+from networking_bgp_ovn.drivers.openstack.utils import ovs
+from networking_bgp_ovn.tests import base as test_base
+
+
+class TestOvsIdl(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvsIdl, self).setUp()
+        self.ovs_idl = ovs.OvsIdl()
+        self.m_idl = mock.patch.object(ovs.idl, 'Idl').start()
+        mock.patch.object(ovs.connection, 'Connection').start()
+        self.m_backend = mock.patch.object(ovs, 'OvsdbIdl').start()
+        self.m_cached = mock.patch.object(
+            ovs.ovsdb_schema, 'get_cached_schema_helper').start()
+        self.m_fetch = mock.patch.object(
+            ovs.ovsdb_schema, 'fetch_schema_helper').start()
+        self.m_validate = mock.patch.object(
+            ovs.ovsdb_schema, 'validate_cached_schema',
+            return_value=True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_start_cached_schema(self):
+        self.ovs_idl.start('unix:/run/openvswitch/db.sock')
+
+        self.m_fetch.assert_not_called()
+        self.assertEqual(1, self.m_backend.call_count)
+
+    def test_start_not_cached(self):
+        self.m_cached.return_value = None
+
+        self.ovs_idl.start('unix:/run/openvswitch/db.sock')
+
+        self.m_fetch.assert_called_once_with(
+            'unix:/run/openvswitch/db.sock', 'Open_vSwitch')
+        self.m_validate.assert_not_called()
+
+    def test_start_schema_mismatch(self):
+        self.m_validate.return_value = False
+        backends = [mock.Mock(), mock.Mock()]
+        self.m_backend.side_effect = backends
+
+        self.ovs_idl.start('unix:/run/openvswitch/db.sock')
+
+        backends[0].ovsdb_connection.stop.assert_called_once_with()
+        self.assertEqual(backends[1], self.ovs_idl.idl_ovs)
+        self.m_idl.assert_called_with('unix:/run/openvswitch/db.sock',
+                                      self.m_fetch.return_value)
+
+    def test_start_connection_failure(self):
+        backend = mock.Mock()
+        self.m_backend.side_effect = [Exception, backend]
+
+        self.ovs_idl.start('unix:/run/openvswitch/db.sock')
+
+        self.m_idl.return_value.close.assert_called_once_with()
+        self.assertEqual(backend, self.ovs_idl.idl_ovs)
+        self.m_fetch.assert_called_once_with(
+            'unix:/run/openvswitch/db.sock', 'Open_vSwitch')
@@ -0,0 +1,87 @@
+# Copyright 2021 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import tempfile
+from unittest import mock
+
+from oslo_config import cfg
+
+from networking_bgp_ovn.drivers.openstack.utils import ovsdb_schema
+from networking_bgp_ovn.tests import base as test_base
+
+CONF = cfg.CONF
+
+SCHEMA = {'name': 'OVN_Southbound', 'version': '20.17.0', 'cksum': '1 2',
+          'tables': {}}
+
+
+class TestOvsdbSchemaCache(test_base.TestCase):
+
+    def setUp(self):
+        super(TestOvsdbSchemaCache, self).setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        CONF.set_override('ovsdb_schema_cache_dir', cache_dir.name)
+        self.addCleanup(CONF.clear_override, 'ovsdb_schema_cache_dir')
+
+    def _server_idl(self, schema):
+        database = mock.Mock(schema=[json.dumps(schema)])
+        database.name = schema['name']
+        return mock.Mock(server_tables={
+            'Database': mock.Mock(rows={'uuid': database})})
+
+    @mock.patch.object(ovsdb_schema.idlutils, 'fetch_schema_json')
+    def test_fetch_schema_helper_cache_disabled(self, mock_fetch):
+        CONF.set_override('ovsdb_schema_cache_dir', None)
+        mock_fetch.return_value = SCHEMA
+
+        ovsdb_schema.fetch_schema_helper('tcp:127.0.0.1:6642',
+                                         'OVN_Southbound')
+
+        self.assertIsNone(ovsdb_schema.load_cached_schema('OVN_Southbound'))
+        self.assertIsNone(
+            ovsdb_schema.get_cached_schema_helper('OVN_Southbound'))
+
+    def test_validate_cached_schema(self):
+        ovsdb_schema.store_cached_schema('OVN_Southbound', SCHEMA)
+
+        self.assertTrue(ovsdb_schema.validate_cached_schema(
+            self._server_idl(SCHEMA), 'OVN_Southbound'))
+
+    def test_validate_cached_schema_mismatch(self):
+        ovsdb_schema.store_cached_schema('OVN_Southbound', SCHEMA)
+        new_schema = dict(SCHEMA, version='20.21.0', cksum='3 4')
+
+        self.assertFalse(ovsdb_schema.validate_cached_schema(
+            self._server_idl(new_schema), 'OVN_Southbound'))
+        self.assertEqual(new_schema,
+                         ovsdb_schema.load_cached_schema('OVN_Southbound'))
+
+    @mock.patch.object(ovsdb_schema.idlutils, 'create_schema_helper')
+    @mock.patch.object(ovsdb_schema.idlutils, 'fetch_schema_json')
+    def test_fetch_schema_helper(self, mock_fetch, mock_create):
+        ovsdb_schema.store_cached_schema('OVN_Southbound', SCHEMA)
+        new_schema = dict(SCHEMA, version='20.21.0', cksum='3 4')
+        mock_fetch.return_value = new_schema
+
+        ovsdb_schema.fetch_schema_helper('tcp:127.0.0.1:6642',
+                                         'OVN_Southbound')
+
+        mock_create.assert_called_once_with(new_schema)
+        self.assertEqual(new_schema,
+                         ovsdb_schema.load_cached_schema('OVN_Southbound'))
+
+    def test_get_cached_schema_helper_not_cached(self):
+        self.assertIsNone(
+            ovsdb_schema.get_cached_schema_helper('OVN_Southbound'))
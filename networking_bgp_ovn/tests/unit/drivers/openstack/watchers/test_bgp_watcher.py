@@ -0,0 +1,74 @@
+# Copyright 2021 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from networking_bgp_ovn.drivers.openstack.watchers import bgp_watcher
+from networking_bgp_ovn.tests import base as test_base
+
+
+class _FakeRow(object):
+
+    def __init__(self, table, **columns):
+        self._table = mock.Mock(columns={})
+        self._table.name = table
+        for column, value in columns.items():
+            setattr(self, column, value)
+
+
+class TestChassisCreateEvent(test_base.TestCase):
+
+    def setUp(self):
+        super(TestChassisCreateEvent, self).setUp()
+        self.agent = mock.Mock(chassis='chassis-1')
+        self.event = bgp_watcher.ChassisCreateEvent(self.agent)
+        self.chassis = _FakeRow('Chassis', name='chassis-1')
+
+    def _notify(self, event, row, old=None):
+        # what the IDL notify handler does for each row change
+        if self.event.matches(event, row, old):
+            self.event.run(event, row, old)
+
+    def test_first_connection(self):
+        self._notify(self.event.ROW_CREATE, self.chassis)
+
+        self.agent.sync.assert_not_called()
+
+    def test_reconnect_resumed(self):
+        self._notify(self.event.ROW_CREATE, self.chassis)
+
+        # monitor_cond_since resumes from the last transaction, so only
+        # the changes missed meanwhile are notified
+        old = _FakeRow('Chassis', name='chassis-1', hostname='old')
+        self._notify(self.event.ROW_UPDATE, self.chassis, old)
+        self._notify(self.event.ROW_CREATE,
+                     _FakeRow('Port_Binding', logical_port='port-1'))
+
+        self.agent.sync.assert_not_called()
+
+    def test_reconnect_full_dump(self):
+        self._notify(self.event.ROW_CREATE, self.chassis)
+
+        # the whole database is sent again, the chassis row included
+        self._notify(self.event.ROW_CREATE, self.chassis)
+
+        self.agent.sync.assert_called_once_with()
+
+    def test_other_chassis_created(self):
+        self._notify(self.event.ROW_CREATE, self.chassis)
+
+        self._notify(self.event.ROW_CREATE,
+                     _FakeRow('Chassis', name='chassis-2'))
+
+        self.agent.sync.assert_not_called()
@@ -10,4 +10,1617 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+
+import ipaddress
+import os
+from socket import AF_INET
+from socket import AF_INET6
+import tempfile
+import threading
+from unittest import mock
+
+from networking_bgp_ovn.tests import base as test_base
+from networking_bgp_ovn.utils import linux_net
+
+
+class TestNetlinkContext(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNetlinkContext, self).setUp()
+        self.context = linux_net.NetlinkContext()
+        self.mock_iproute = mock.patch.object(linux_net.pyroute2,
+                                              'IPRoute').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_iproute_reused(self):
+        with self.context.iproute() as iproute:
+            pass
+        with self.context.iproute() as iproute2:
+            pass
+
+        self.mock_iproute.assert_called_once_with()
+        self.assertIs(iproute, iproute2)
+        iproute.close.assert_not_called()
+
+    def test_iproute_kept_after_lookup_error(self):
+        def _lookup():
+            with self.context.iproute():
+                raise KeyError('eth0')
+
+        self.assertRaises(KeyError, _lookup)
+        with self.context.iproute():
+            pass
+
+        self.mock_iproute.assert_called_once_with()
+
+    def test_iproute_reopened_after_unexpected_error(self):
+        def _fail():
+            with self.context.iproute():
+                raise RuntimeError()
+
+        self.assertRaises(RuntimeError, _fail)
+        self.mock_iproute.return_value.close.assert_called_once_with()
+        with self.context.iproute():
+            pass
+
+        self.assertEqual(2, self.mock_iproute.call_count)
+
+    @mock.patch.object(linux_net, 'RtnlSocket')
+    def test_close(self, mock_rtnl):
+        with self.context.iproute():
+            with self.context.rtnl():
+                pass
+
+        self.context.close()
+
+        self.mock_iproute.return_value.close.assert_called_once_with()
+        mock_rtnl.return_value.close.assert_called_once_with()
+
+
+def _nlmsg(msg, msg_type, seq):
+    msg['header']['type'] = msg_type
+    msg['header']['sequence_number'] = seq
+    msg.encode()
+    return bytes(msg.data)
+
+
+def _nlmsg_error(msg_type, seq, code):
+    # the ACKs (code 0) and errors are -errno, followed by the request
+    # header
+    return (linux_net._NLMSG_HEADER.pack(36, msg_type, 0, seq, 0) +
+            linux_net._NLMSG_ERROR_CODE.pack(-code) +
+            linux_net._NLMSG_HEADER.pack(16, 0, 0, seq, 0))
+
+
+class TestRtnlSocket(test_base.TestCase):
+
+    def setUp(self):
+        super(TestRtnlSocket, self).setUp()
+        self.mock_socket = mock.patch.object(linux_net.socket,
+                                             'socket').start()
+        self.addCleanup(mock.patch.stopall)
+        self.rtnl_socket = linux_net.RtnlSocket()
+        self.sock = self.mock_socket.return_value
+
+    def test_init(self):
+        self.sock.setsockopt.assert_called_once_with(
+            linux_net._SOL_NETLINK, linux_net._NETLINK_GET_STRICT_CHK, 1)
+        self.sock.bind.assert_called_once_with((0, 0))
+
+    def test_request(self):
+        # the leftovers of a previous request are skipped
+        self.sock.recv.side_effect = [
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 7, 0),
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 1, 0)]
+        msg = linux_net.rtmsg.rtmsg()
+
+        self.rtnl_socket.request(msg, linux_net.rtnl.RTM_NEWROUTE,
+                                 linux_net.netlink.NLM_F_CREATE)
+
+        self.assertEqual(2, self.sock.recv.call_count)
+        self.sock.sendall.assert_called_once_with(mock.ANY)
+        sent = self.sock.sendall.call_args[0][0]
+        self.assertEqual(
+            (len(sent), linux_net.rtnl.RTM_NEWROUTE,
+             linux_net.netlink.NLM_F_REQUEST | linux_net.netlink.NLM_F_ACK |
+             linux_net.netlink.NLM_F_CREATE, 1, 0),
+            linux_net._NLMSG_HEADER.unpack_from(sent))
+
+    def _request(self, dst):
+        msg = linux_net.rtmsg.rtmsg()
+        msg['family'] = AF_INET
+        msg['attrs'] = [('RTA_DST', dst)]
+        return linux_net._encode(msg, linux_net.rtnl.RTM_DELROUTE)
+
+    def test_batch(self):
+        # all the requests are sent before reading their ACKs, which are
+        # matched by sequence number
+        self.sock.recv.side_effect = [
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 2,
+                         linux_net.errno.ESRCH) +
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 3, 0),
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 1, 0)]
+        requests = [self._request('10.0.0.{}'.format(i)) for i in (1, 2, 3)]
+
+        errors = self.rtnl_socket.batch(requests)
+
+        self.assertEqual([0, linux_net.errno.ESRCH, 0], errors)
+        self.sock.sendall.assert_called_once_with(mock.ANY)
+        sent = self.sock.sendall.call_args[0][0]
+        self.assertEqual(sum(len(request) for request in requests),
+                         len(sent))
+        offset = 0
+        for seq, request in enumerate(requests, 1):
+            length, _type, flags, sent_seq, _pid = (
+                linux_net._NLMSG_HEADER.unpack_from(sent, offset))
+            self.assertEqual(seq, sent_seq)
+            self.assertTrue(flags & linux_net.netlink.NLM_F_ACK)
+            self.assertEqual(request[linux_net._NLMSG_HEADER.size:],
+                             sent[offset + linux_net._NLMSG_HEADER.size:
+                                  offset + length])
+            offset += length
+
+    def test_batch_chunks(self):
+        self.rtnl_socket._BATCH_SIZE = 2
+        self.sock.recv.side_effect = [
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 1, 0) +
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 2, 0),
+            _nlmsg_error(linux_net.netlink.NLMSG_ERROR, 3,
+                         linux_net.errno.ESRCH)]
+
+        errors = self.rtnl_socket.batch(
+            [self._request('10.0.0.{}'.format(i)) for i in (1, 2, 3)])
+
+        self.assertEqual([0, 0, linux_net.errno.ESRCH], errors)
+        self.assertEqual(2, self.sock.sendall.call_count)
+
+    def test_request_error(self):
+        self.sock.recv.return_value = _nlmsg_error(
+            linux_net.netlink.NLMSG_ERROR, 1, linux_net.errno.ESRCH)
+
+        e = self.assertRaises(
+            linux_net.pyroute2.netlink.exceptions.NetlinkError,
+            self.rtnl_socket.request, linux_net.rtmsg.rtmsg(),
+            linux_net.rtnl.RTM_DELROUTE)
+        self.assertEqual(linux_net.errno.ESRCH, e.code)
+
+    def _neighbour_msg(self, dst, seq):
+        msg = linux_net.ndmsg.ndmsg()
+        msg['family'] = AF_INET6
+        msg['attrs'] = [('NDA_DST', dst)]
+        return _nlmsg(msg, linux_net.rtnl.RTM_NEWNEIGH, seq)
+
+    def test_dump(self):
+        self.sock.recv.side_effect = [
+            self._neighbour_msg('fd00::1', 1) + self._neighbour_msg(
+                'fd00::2', 1),
+            self._neighbour_msg('fd00::3', 1) + _nlmsg_error(
+                linux_net.netlink.NLMSG_DONE, 1, 0)]
+
+        replies = self.rtnl_socket.dump(linux_net.ndmsg.ndmsg(),
+                                        linux_net.rtnl.RTM_GETNEIGH)
+
+        self.assertEqual(['fd00::1', 'fd00::2', 'fd00::3'],
+                         [reply.get_attr('NDA_DST') for reply in replies])
+        self.assertEqual({'RTM_NEWNEIGH'},
+                         {reply['event'] for reply in replies})
+
+    def test_dump_error(self):
+        # the kernel sends the errors of a dump with its end
+        self.sock.recv.return_value = _nlmsg_error(
+            linux_net.netlink.NLMSG_DONE, 1, linux_net.errno.EINVAL)
+
+        self.assertRaises(linux_net.pyroute2.netlink.exceptions.NetlinkError,
+                          self.rtnl_socket.dump, linux_net.ndmsg.ndmsg(),
+                          linux_net.rtnl.RTM_GETNEIGH)
+
+    def test_nexthop_route_msg(self):
+        # a route message decoded first compiles the rtmsg attributes
+        # table
+        msg = linux_net.rtmsg.rtmsg()
+        msg['attrs'] = [('RTA_TABLE', 200)]
+        linux_net.rtmsg.rtmsg(
+            _nlmsg(msg, linux_net.rtnl.RTM_NEWROUTE, 1)).decode()
+        msg = linux_net._get_nexthop_route_msg(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200}, 5)
+
+        reply = linux_net._NexthopRouteMsg(
+            _nlmsg(msg, linux_net.rtnl.RTM_NEWROUTE, 1))
+        reply.decode()
+
+        self.assertEqual(5, reply.get_attr('RTA_NH_ID'))
+
+
+class TestRtnlSocketKernel(test_base.TestCase):
+    """The dumps and requests through a real rtnetlink socket."""
+
+    def setUp(self):
+        super(TestRtnlSocketKernel, self).setUp()
+        try:
+            self.rtnl_socket = linux_net.RtnlSocket()
+        except OSError as e:
+            self.skipTest("rtnetlink is not available: {}".format(e))
+        self.addCleanup(self.rtnl_socket.close)
+
+    def test_dump_links(self):
+        for kind in linux_net._LINK_KINDS:
+            for link in linux_net._dump_links(self.rtnl_socket, kind):
+                self.assertEqual('RTM_NEWLINK', link['event'])
+                self.assertEqual(kind, linux_net._get_link_kind(link))
+
+    def test_dump_addresses(self):
+        # the loopback device
+        for address in linux_net._dump_addresses(self.rtnl_socket, 1):
+            self.assertEqual('RTM_NEWADDR', address['event'])
+            self.assertEqual(1, address['index'])
+
+    def test_dump_routes(self):
+        for route in linux_net._dump_routes(self.rtnl_socket,
+                                            linux_net.ROUTE_PROTO):
+            self.assertEqual(linux_net.ROUTE_PROTO, route['proto'])
+
+    def test_dump_rules(self):
+        # there are always the main, local and default tables rules
+        rules = linux_net._dump_rules(self.rtnl_socket)
+
+        self.assertTrue(rules)
+        self.assertEqual({'RTM_NEWRULE'}, {rule['event'] for rule in rules})
+
+    def test_batch(self):
+        # neither there (or not allowed), and the socket is still usable
+        # after the errors
+        requests = [linux_net._encode(
+            linux_net._get_nexthop_route_msg(
+                {'dst': dst, 'dst_len': 24, 'table': 25299}),
+            linux_net.rtnl.RTM_DELROUTE)
+            for dst in ('192.0.2.0', '198.51.100.0')]
+
+        errors = self.rtnl_socket.batch(requests)
+
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all(errors))
+        self.assertTrue(linux_net._dump_rules(self.rtnl_socket))
+
+    def test_request_error(self):
+        # not there (or not allowed)
+        msg = linux_net._get_nexthop_route_msg(
+            {'dst': '192.0.2.0', 'dst_len': 24, 'table': 25299})
+
+        self.assertRaises(linux_net.pyroute2.netlink.exceptions.NetlinkError,
+                          self.rtnl_socket.request, msg,
+                          linux_net.rtnl.RTM_DELROUTE)
+        # the socket is still usable
+        self.assertTrue(linux_net._dump_rules(self.rtnl_socket))
+
+
+class FakeMsg(dict):
+
+    def __init__(self, event, attrs=None, **fields):
+        super(FakeMsg, self).__init__(fields, event=event)
+        self.attrs = attrs or {}
+
+    def get_attr(self, name):
+        return self.attrs.get(name)
+
+
+def _link_msg(index, ifname, event='RTM_NEWLINK', flags=1, master=None,
+              kind='openvswitch', info_data=None):
+    link_info = FakeMsg(None, {'IFLA_INFO_KIND': kind,
+                               'IFLA_INFO_DATA': info_data and FakeMsg(
+                                   None, info_data)})
+    return FakeMsg(event, {'IFLA_IFNAME': ifname, 'IFLA_MASTER': master,
+                           'IFLA_LINKINFO': link_info},
+                   index=index, flags=flags)
+
+
+def _route_msg(dst, table, oif, event='RTM_NEWROUTE', family=AF_INET,
+               dst_len=32, proto=linux_net.ROUTE_PROTO, scope=253,
+               rt_type=1):
+    return FakeMsg(event, {'RTA_TABLE': table, 'RTA_DST': dst,
+                           'RTA_OIF': oif},
+                   family=family, table=table, dst_len=dst_len, proto=proto,
+                   scope=scope, type=rt_type)
+
+
+class TestKernelState(test_base.TestCase):
+
+    def setUp(self):
+        super(TestKernelState, self).setUp()
+        self.state = linux_net.KernelState()
+        self.state.apply(_link_msg(7, 'br-ex'))
+
+    def test_links(self):
+        self.assertEqual(['br-ex'], self.state.get_interfaces())
+        self.assertEqual(7, self.state.get_link_index('br-ex'))
+        self.assertEqual('up', self.state.get_link('br-ex')['state'])
+
+        self.state.apply(_link_msg(7, 'br-ex', event='RTM_DELLINK'))
+
+        self.assertRaises(KeyError, self.state.get_link_index, 'br-ex')
+        self.assertIsNone(self.state.get_link('br-ex'))
+
+    def test_links_of_other_kinds_ignored(self):
+        permanent = linux_net.ndmsg.states['permanent']
+        self.state.apply(_link_msg(20, 'tap0', kind='tun'))
+        self.state.apply(FakeMsg('RTM_NEWADDR', {'IFA_ADDRESS': '10.0.0.1'},
+                                 index=20, prefixlen=32))
+        self.state.apply(FakeMsg('RTM_NEWNEIGH', {'NDA_DST': '10.0.0.2'},
+                                 ifindex=20, state=permanent))
+
+        self.assertEqual(['br-ex'], self.state.get_interfaces())
+        self.assertNotIn(20, self.state._addresses)
+        self.assertIsNone(self.state.get_neighbour(20, '10.0.0.2'))
+
+    def test_link_renamed(self):
+        self.state.apply(_link_msg(7, 'br-ex2'))
+
+        self.assertEqual(7, self.state.get_link_index('br-ex2'))
+        self.assertEqual('br-ex2', self.state.get_link_name(7))
+        self.assertRaises(KeyError, self.state.get_link_index, 'br-ex')
+
+    def test_link_recreated(self):
+        self.state.apply(_link_msg(7, 'br-ex', event='RTM_DELLINK'))
+        self.state.apply(_link_msg(12, 'br-ex'))
+
+        self.assertEqual(12, self.state.get_link_index('br-ex'))
+        self.assertRaises(KeyError, self.state.get_link_name, 7)
+
+    def test_addresses(self):
+        msg = FakeMsg('RTM_NEWADDR', {'IFA_ADDRESS': '10.0.0.1'},
+                      index=7, prefixlen=32)
+        self.state.apply(msg)
+
+        self.assertTrue(self.state.has_address('br-ex', '10.0.0.1', 32))
+        self.assertEqual([('10.0.0.1', 32)],
+                         self.state.get_addresses('br-ex'))
+
+        msg['event'] = 'RTM_DELADDR'
+        self.state.apply(msg)
+
+        self.assertEqual([], self.state.get_addresses('br-ex'))
+
+    def test_host_addresses_on_network(self):
+        for address, prefixlen in (('10.0.0.1', 32), ('10.0.1.1', 32),
+                                   ('10.0.0.254', 24)):
+            self.state.apply(FakeMsg('RTM_NEWADDR', {'IFA_ADDRESS': address},
+                                     index=7, prefixlen=prefixlen))
+        network = ipaddress.ip_network('10.0.0.0/24')
+
+        self.assertEqual(['10.0.0.1'],
+                         self.state.get_host_addresses_on_network(
+                             'br-ex', network))
+
+        self.state.del_address('br-ex', '10.0.0.1', 32)
+
+        self.assertEqual([], self.state.get_host_addresses_on_network(
+            'br-ex', network))
+        self.assertEqual([], self.state.get_host_addresses_on_network(
+            'ovn', network))
+
+    def test_rules(self):
+        priority = linux_net.RULE_PRIORITY
+        self.state.apply(FakeMsg('RTM_NEWRULE', {'FRA_DST': '10.0.0.1',
+                                                 'FRA_TABLE': 200,
+                                                 'FRA_PRIORITY': priority},
+                                 family=AF_INET, dst_len=32, table=200))
+        # the rules with other priorities are mirrored too, e.g. the ones
+        # from previous versions, but not the ones to the main table
+        self.state.apply(FakeMsg('RTM_NEWRULE', {'FRA_DST': '10.0.0.2',
+                                                 'FRA_TABLE': 200,
+                                                 'FRA_PRIORITY': 32765},
+                                 family=AF_INET, dst_len=32, table=200))
+        self.state.apply(FakeMsg('RTM_NEWRULE', {'FRA_DST': '10.0.0.3',
+                                                 'FRA_TABLE': 254,
+                                                 'FRA_PRIORITY': priority},
+                                 family=AF_INET, dst_len=32, table=254))
+
+        self.assertTrue(self.state.has_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200}))
+        self.assertFalse(self.state.has_rule(
+            {'dst': '10.0.0.2', 'dst_len': 32, 'table': 200}))
+        self.assertEqual({32765}, self.state.get_rule_priorities(
+            {'dst': '10.0.0.2', 'dst_len': 32, 'table': 200}))
+        self.assertEqual(
+            [{'family': AF_INET, 'dst': '10.0.0.1', 'dst_len': 32,
+              'table': 200, 'priority': priority},
+             {'family': AF_INET, 'dst': '10.0.0.2', 'dst_len': 32,
+              'table': 200, 'priority': 32765}],
+            sorted(self.state.get_rules([200, 254]),
+                   key=lambda rule: rule['dst']))
+
+        self.state.apply(FakeMsg('RTM_DELRULE', {'FRA_DST': '10.0.0.2',
+                                                 'FRA_TABLE': 200,
+                                                 'FRA_PRIORITY': 32765},
+                                 family=AF_INET, dst_len=32, table=200))
+
+        self.assertEqual(set(), self.state.get_rule_priorities(
+            {'dst': '10.0.0.2', 'dst_len': 32, 'table': 200}))
+
+    def test_table_rules(self):
+        self.state.apply(FakeMsg('RTM_NEWRULE', {
+            'FRA_TABLE': 200, 'FRA_PRIORITY': linux_net.RULE_PRIORITY},
+            family=AF_INET6, dst_len=0, src_len=0, table=200))
+        self.state.apply(FakeMsg('RTM_NEWRULE', {'FRA_TABLE': 201,
+                                                 'FRA_IIFNAME': 'br-ex',
+                                                 'FRA_PRIORITY': 100},
+                                 family=AF_INET, dst_len=0, src_len=0,
+                                 table=201))
+
+        self.assertTrue(self.state.has_rule(
+            {'table': 200, 'family': AF_INET6}))
+        self.assertFalse(self.state.has_rule({'table': 201}))
+        with mock.patch.object(linux_net, 'get_kernel_state',
+                               return_value=self.state):
+            self.assertEqual({}, linux_net.get_ovn_ip_rules([200]))
+
+    def test_routes(self):
+        self.state.apply(_route_msg('10.0.0.1', 200, 7))
+        self.state.apply(_route_msg(None, 200, 7, dst_len=0))
+        self.state.apply(_route_msg('10.0.0.2', 254, 7))
+        # only the routes the agent added are mirrored, not the ones
+        # added by hand (with the boot protocol) or by other daemons
+        self.state.apply(_route_msg('10.0.0.3', 200, 7, proto=186))
+        self.state.apply(_route_msg('10.0.0.4', 200, 7, proto=3))
+
+        self.assertTrue(self.state.has_route(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200, 'oif': 7,
+             'proto': linux_net.ROUTE_PROTO, 'scope': 253}))
+        self.assertTrue(self.state.has_route(
+            {'dst': 'default', 'table': 200, 'oif': 7}))
+        self.assertFalse(self.state.has_route(
+            {'dst': '10.0.0.3', 'dst_len': 32, 'table': 200, 'oif': 7}))
+        self.assertFalse(self.state.has_route(
+            {'dst': '10.0.0.4', 'dst_len': 32, 'table': 200, 'oif': 7}))
+        self.assertEqual(2, len(self.state.get_routes([200, 254])))
+
+        self.state.apply(_route_msg('10.0.0.1', 200, 7,
+                                    event='RTM_DELROUTE'))
+
+        self.assertEqual([''], sorted(
+            r['dst'] for r in self.state.get_routes([200])))
+
+    def test_link_down_drops_ipv4_routes(self):
+        self.state.apply(_route_msg('10.0.0.1', 200, 7))
+        self.state.apply(_route_msg('fd00::1', 200, 7, family=AF_INET6,
+                                    dst_len=128))
+
+        self.state.apply(_link_msg(7, 'br-ex', flags=0))
+
+        self.assertEqual(['fd00::1'], [r['dst'] for r in
+                                       self.state.get_routes([200])])
+
+    def test_neighbours(self):
+        permanent = linux_net.ndmsg.states['permanent']
+        msg = FakeMsg('RTM_NEWNEIGH', {'NDA_DST': '10.0.0.1',
+                                       'NDA_LLADDR': 'fa:16:3e:00:00:01'},
+                      ifindex=7, state=permanent)
+        self.state.apply(msg)
+
+        self.assertEqual('fa:16:3e:00:00:01',
+                         self.state.get_neighbour(7, '10.0.0.1'))
+
+        msg['event'] = 'RTM_DELNEIGH'
+        self.state.apply(msg)
+
+        self.assertIsNone(self.state.get_neighbour(7, '10.0.0.1'))
+
+    @mock.patch.object(linux_net, 'get_rtnl')
+    @mock.patch.object(linux_net.pyroute2, 'IPRoute')
+    def test_start(self, mock_iproute, mock_get_rtnl):
+        dumps = {
+            linux_net.rtnl.RTM_GETLINK: {
+                'openvswitch': [_link_msg(8, 'br-vlan')],
+                'vrf': [_link_msg(10, 'vrf-1001', kind='vrf',
+                                  info_data={'IFLA_VRF_TABLE': 1001})]},
+            linux_net.rtnl.RTM_GETADDR: {
+                8: [FakeMsg('RTM_NEWADDR', {'IFA_ADDRESS': '10.0.0.5'},
+                            index=8, prefixlen=32)]},
+            linux_net.rtnl.RTM_GETRULE: [
+                FakeMsg('RTM_NEWRULE',
+                        {'FRA_TABLE': 200, 'FRA_DST': '10.0.0.1',
+                         'FRA_PRIORITY': linux_net.RULE_PRIORITY},
+                        family=AF_INET, table=200, dst_len=32)],
+            linux_net.rtnl.RTM_GETROUTE: {
+                linux_net.ROUTE_PROTO: [
+                    _route_msg('10.0.0.1', 200, 8),
+                    _route_msg('10.0.0.2', 1001, 10)],
+                3: [_route_msg('10.0.0.3', 1001, 10, proto=3)]},
+            linux_net.rtnl.RTM_GETNEIGH: {}}
+
+        def _dump(msg, msg_type):
+            dump = dumps[msg_type]
+            if msg_type == linux_net.rtnl.RTM_GETRULE:
+                return dump
+            if msg_type == linux_net.rtnl.RTM_GETLINK:
+                link_info = dict(msg['attrs'])['IFLA_LINKINFO']
+                key = dict(link_info['attrs'])['IFLA_INFO_KIND']
+            elif msg_type == linux_net.rtnl.RTM_GETROUTE:
+                key = msg['proto']
+            elif msg_type == linux_net.rtnl.RTM_GETNEIGH:
+                key = msg.get_attr('NDA_IFINDEX')
+            else:
+                key = msg['index']
+            return dump.get(key, [])
+
+        rtnl_socket = mock.Mock()
+        rtnl_socket.dump.side_effect = _dump
+        mock_get_rtnl.return_value.__enter__ = mock.Mock(
+            return_value=rtnl_socket)
+        mock_get_rtnl.return_value.__exit__ = mock.Mock(return_value=False)
+        listener = mock_iproute.return_value
+        listener.get.side_effect = [[_link_msg(9, 'br-ex.10')],
+                                    RuntimeError()]
+        self.addCleanup(self.state.stop)
+
+        with mock.patch.object(linux_net.threading, 'Thread') as m_thread:
+            self.state.start()
+            self.state.start()
+            target = m_thread.call_args[1]['target']
+            args = m_thread.call_args[1]['args']
+
+        listener.bind.assert_called_once_with(groups=linux_net._RTNL_GROUPS)
+        self.assertEqual(['br-vlan', 'vrf-1001'],
+                         sorted(self.state.get_interfaces()))
+        self.assertTrue(self.state.has_address('br-vlan', '10.0.0.5', 32))
+        self.assertTrue(self.state.has_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200}))
+        self.assertEqual(1, len(self.state.get_routes([200])))
+        self.assertEqual(1, len(self.state.get_routes([1001])))
+        # only the routes with the agent protocol are dumped
+        protos = [
+            call[0][0]['proto']
+            for call in rtnl_socket.dump.call_args_list
+            if call[0][1] == linux_net.rtnl.RTM_GETROUTE]
+        self.assertEqual([linux_net.ROUTE_PROTO], protos)
+        # the addresses and neighbours are dumped per mirrored link
+        self.assertEqual(2, len([
+            call for call in rtnl_socket.dump.call_args_list
+            if call[0][1] == linux_net.rtnl.RTM_GETADDR]))
+
+        # a listener error reloads the state, so stop it to leave the loop
+        dumps[linux_net.rtnl.RTM_GETRULE] = []
+        rtnl_socket.dump.side_effect = (
+            lambda *args, **kwargs: self.state._close() or [])
+        target(*args)
+
+        listener.close.assert_called_once_with()
+        self.assertEqual([], self.state.get_interfaces())
+
+    @mock.patch.object(linux_net, 'get_rtnl')
+    @mock.patch.object(linux_net.pyroute2, 'IPRoute')
+    def test_start_dumps_without_lock(self, mock_iproute, mock_get_rtnl):
+        self.state.apply(_link_msg(8, 'br-vlan'))
+        locked = []
+        thread_class = threading.Thread
+
+        def _try_lock():
+            acquired = self.state._lock.acquire(blocking=False)
+            locked.append(not acquired)
+            if acquired:
+                self.state._lock.release()
+
+        def _enter(*args):
+            # the dump takes the shared netlink lock, which could be held
+            # by a thread waiting for the mirror lock
+            thread = thread_class(target=_try_lock)
+            thread.start()
+            thread.join()
+            return mock.Mock(dump=mock.Mock(return_value=[]))
+
+        mock_get_rtnl.return_value.__enter__ = mock.Mock(side_effect=_enter)
+        mock_get_rtnl.return_value.__exit__ = mock.Mock(return_value=False)
+        self.addCleanup(self.state.stop)
+
+        with mock.patch.object(linux_net.threading, 'Thread'):
+            self.state.start()
+
+        self.assertEqual([False], locked)
+        # the dumped state replaced the previous one
+        self.assertEqual([], self.state.get_interfaces())
+
+
+class FakeIPBatch(object):
+    """An IPBatch whose requests go to an IPRoute mock.
+
+    The compiled message of a request carries in its header the code of
+    the NetlinkError raised by the mock, if any, which the fake rtnetlink
+    socket batch returns.
+    """
+
+    def __init__(self, iproute):
+        self.iproute = iproute
+        self.batch = b''
+
+    def __getattr__(self, method):
+        def _request(**kwargs):
+            code = 0
+            try:
+                getattr(self.iproute, method)(**kwargs)
+            except linux_net.pyroute2.netlink.exceptions.NetlinkError as e:
+                code = e.code
+            self.batch = linux_net._NLMSG_HEADER.pack(16, 0, 0, 0, code)
+        return _request
+
+    def reset(self):
+        self.batch = b''
+
+
+def _patch_netlink(iproute):
+    """Send the netlink requests to an IPRoute mock."""
+    get_ipbatch = mock.patch.object(linux_net, 'get_ipbatch').start()
+    get_ipbatch.return_value.__enter__ = mock.Mock(
+        return_value=FakeIPBatch(iproute))
+    get_ipbatch.return_value.__exit__ = mock.Mock(return_value=False)
+    get_rtnl = mock.patch.object(linux_net, 'get_rtnl').start()
+    get_rtnl.return_value.__enter__ = mock.Mock(
+        return_value=get_rtnl.return_value)
+    get_rtnl.return_value.__exit__ = mock.Mock(return_value=False)
+    get_rtnl.return_value.dump.return_value = []
+    get_rtnl.return_value.batch.side_effect = lambda requests: [
+        linux_net._NLMSG_HEADER.unpack(request)[4] for request in requests]
+    return get_rtnl.return_value
+
+
+class TestNetlinkBatch(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNetlinkBatch, self).setUp()
+        self.iproute = mock.Mock()
+        self.get_iproute = mock.patch.object(linux_net,
+                                             'get_iproute').start()
+        self.get_iproute.return_value.__enter__ = mock.Mock(
+            return_value=self.iproute)
+        self.get_iproute.return_value.__exit__ = mock.Mock(
+            return_value=False)
+        self.rtnl = _patch_netlink(self.iproute)
+        self.kernel_state = linux_net.KernelState()
+        self.kernel_state.apply(_link_msg(7, 'ovn'))
+        self.kernel_state.apply(_link_msg(8, 'br-ex.10'))
+        self.get_kernel_state = mock.patch.object(
+            linux_net, 'get_kernel_state',
+            return_value=self.kernel_state).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _netlink_error(self, code):
+        return linux_net.pyroute2.netlink.exceptions.NetlinkError(code)
+
+    def test_compile_request(self):
+        ipbatch = linux_net.pyroute2.IPBatch()
+        self.addCleanup(ipbatch.close)
+
+        request = linux_net._compile_request(
+            ipbatch, 'route', {'command': 'del', 'dst': '10.0.0.1',
+                               'dst_len': 32, 'table': 200,
+                               'family': AF_INET})
+
+        _length, msg_type, flags, _seq, _pid = (
+            linux_net._NLMSG_HEADER.unpack_from(request))
+        self.assertEqual(linux_net.rtnl.RTM_DELROUTE, msg_type)
+        # no create flags on the deletes, whatever the pyroute2 version
+        self.assertEqual(linux_net.netlink.NLM_F_REQUEST, flags)
+        self.assertEqual(b'', bytes(ipbatch.batch))
+
+    def test_add_ips_to_dev_batch(self):
+        self.kernel_state.add_address('ovn', '10.0.0.3', 32)
+        self.iproute.addr.side_effect = [
+            self._netlink_error(linux_net.errno.EEXIST),
+            self._netlink_error(linux_net.errno.EINVAL),
+            None]
+
+        errors = linux_net.add_ips_to_dev_batch(
+            'ovn', ['10.0.0.1', '10.0.0.2', '10.0.0.3', 'fd00::1'])
+
+        self.assertEqual(['10.0.0.2'], [ip for ip, _ in errors])
+        self.iproute.addr.assert_called_with(
+            command='add', index=7, address='fd00::1', mask=128,
+            family=linux_net.AF_INET6)
+        self.assertEqual(3, self.iproute.addr.call_count)
+        self.assertEqual(['10.0.0.1', '10.0.0.3', 'fd00::1'],
+                         sorted(linux_net.get_exposed_ips('ovn')))
+
+    def test_add_ip_rules_batch_skips_existing(self):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200})
+
+        errors = linux_net.add_ip_rules_batch(['10.0.0.1', '10.0.0.2'], 200)
+
+        self.assertEqual([], errors)
+        self.iproute.rule.assert_called_once_with(
+            command='add', dst='10.0.0.2', dst_len=32, table=200,
+            priority=linux_net.RULE_PRIORITY)
+        self.assertEqual({'10.0.0.1/32', '10.0.0.2/32'},
+                         set(linux_net.get_ovn_ip_rules([200])))
+
+    def test_add_ip_routes_batch(self):
+        routes = linux_net.RouteRegistry()
+        self.iproute.route.side_effect = [
+            None, self._netlink_error(linux_net.errno.ENETUNREACH)]
+
+        errors = linux_net.add_ip_routes_batch(
+            routes, ['10.0.0.1', '10.0.0.2'], 200, 'br-ex', vlan=10)
+
+        self.assertEqual(['10.0.0.2'], [ip for ip, _ in errors])
+        self.assertEqual(
+            [{'dst': '10.0.0.1', 'dst_len': 32, 'oif': 8, 'table': 200,
+              'proto': linux_net.ROUTE_PROTO, 'scope': 253}],
+            routes.get_routes('br-ex'))
+        self.assertEqual({'br-ex.10'}, routes.get_vlan_devices())
+        self.assertEqual(['10.0.0.1'], [
+            r['dst'] for r in linux_net.get_routes_on_tables([200])])
+
+    def test_del_ips_from_dev_batch(self):
+        self.kernel_state.add_address('ovn', '10.0.0.1', 32)
+        self.kernel_state.add_address('ovn', '10.0.0.2', 32)
+        self.iproute.addr.side_effect = [
+            None, self._netlink_error(linux_net.errno.EADDRNOTAVAIL)]
+
+        errors = linux_net.del_ips_from_dev_batch(
+            'ovn', ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+        self.assertEqual([], errors)
+        self.assertEqual(2, self.iproute.addr.call_count)
+        self.assertEqual([], linux_net.get_exposed_ips('ovn'))
+
+    @mock.patch.object(linux_net, 'delete_exposed_ips')
+    def test_sync_exposed_ips(self, mock_delete):
+        self.kernel_state.add_address('ovn', '10.0.0.1', 32)
+        self.kernel_state.add_address('ovn', '10.0.0.2', 32)
+
+        drift = linux_net.sync_exposed_ips('ovn', {'10.0.0.2', '10.0.0.3'})
+
+        self.assertEqual((1, 1), drift)
+        self.iproute.addr.assert_called_once_with(
+            command='add', index=7, address='10.0.0.3', mask=32,
+            family=linux_net.AF_INET)
+        mock_delete.assert_called_once_with(['10.0.0.1'], 'ovn')
+
+    @mock.patch.object(linux_net, 'delete_exposed_ips')
+    def test_sync_exposed_ips_no_delete(self, mock_delete):
+        self.kernel_state.add_address('ovn', '10.0.0.1', 32)
+
+        drift = linux_net.sync_exposed_ips('ovn', {'10.0.0.3'}, delete=False)
+
+        self.assertEqual((1, 0), drift)
+        self.iproute.addr.assert_called_once_with(
+            command='add', index=7, address='10.0.0.3', mask=32,
+            family=linux_net.AF_INET)
+        mock_delete.assert_not_called()
+
+    def test_kernel_state_not_started_under_netlink_lock(self):
+        # starting the mirror takes the shared netlink lock after its own
+        held = []
+        self.get_iproute.return_value.__enter__.side_effect = (
+            lambda *args: held.append(True) or self.iproute)
+        self.get_iproute.return_value.__exit__.side_effect = (
+            lambda *args: held.pop() and False)
+        self.get_kernel_state.side_effect = (
+            lambda: self.assertEqual([], held) or self.kernel_state)
+
+        linux_net.add_ip_neighbours_batch(['10.0.0.1'], 'br-ex.10',
+                                          'fa:16:3e:00:00:01')
+        linux_net.del_ip_neighbours_batch(['10.0.0.1'], 'br-ex.10')
+
+        self.assertEqual(2, self.iproute.neigh.call_count)
+        self.assertIsNone(self.kernel_state.get_neighbour(8, '10.0.0.1'))
+
+    def test_sync_ip_neighbours(self):
+        self.kernel_state.add_neighbour(8, '10.0.0.1', 'fa:16:3e:00:00:01')
+        # stale, e.g. of a router gateway port no longer there
+        self.kernel_state.add_neighbour(8, '10.0.0.2', 'fa:16:3e:00:00:02')
+        # on a device that is not synced
+        self.kernel_state.add_neighbour(7, '10.0.0.9', 'fa:16:3e:00:00:09')
+        ip_rules = {
+            '10.0.0.1/32': {'table': 200, 'dev': 'br-ex.10',
+                            'lladdr': 'fa:16:3e:00:00:01'},
+            '10.0.0.3/32': {'table': 200, 'dev': 'br-ex.10',
+                            'lladdr': 'fa:16:3e:00:00:01'},
+            '10.0.0.4/32': {'table': 200, 'dev': 'br-ex.10',
+                            'lladdr': None}}
+
+        drift = linux_net.sync_ip_neighbours(ip_rules, ['br-ex.10'])
+
+        self.assertEqual((1, 1), drift)
+        self.assertEqual(
+            [mock.call(command='set', dst='10.0.0.3', ifindex=8,
+                       state=linux_net.ndmsg.states['permanent'],
+                       lladdr='fa:16:3e:00:00:01', family=AF_INET),
+             mock.call(command='del', dst='10.0.0.2', ifindex=8,
+                       state=linux_net.ndmsg.states['permanent'],
+                       family=AF_INET)],
+            self.iproute.neigh.call_args_list)
+        self.assertEqual({'10.0.0.1': 'fa:16:3e:00:00:01',
+                          '10.0.0.3': 'fa:16:3e:00:00:01'},
+                         self.kernel_state.get_neighbours(8))
+        self.assertEqual({'10.0.0.9': 'fa:16:3e:00:00:09'},
+                         self.kernel_state.get_neighbours(7))
+
+    def test_sync_ip_neighbours_no_delete(self):
+        self.kernel_state.add_neighbour(8, '10.0.0.2', 'fa:16:3e:00:00:02')
+
+        drift = linux_net.sync_ip_neighbours({}, ['br-ex.10'], delete=False)
+
+        self.assertEqual((0, 0), drift)
+        self.iproute.neigh.assert_not_called()
+
+    def test_add_exposed_routes_batch(self):
+        self.kernel_state.add_route(linux_net._get_route('10.0.0.1', 10, 7))
+        # the local route of an address on the device is not exposed
+        self.kernel_state.apply(_route_msg('10.0.0.9', 10, 7, proto=2,
+                                           scope=254, rt_type=2))
+
+        errors = linux_net.add_exposed_routes_batch(
+            'ovn', ['10.0.0.1', 'fd00::1'], 10)
+
+        self.assertEqual([], errors)
+        self.iproute.route.assert_called_once_with(
+            command='add', dst='fd00::1', dst_len=128, oif=7, table=10,
+            proto=linux_net.ROUTE_PROTO, family=linux_net.AF_INET6)
+        self.assertEqual(['10.0.0.1', 'fd00::1'],
+                         sorted(linux_net.get_exposed_routes('ovn', 10)))
+        self.assertEqual(['fd00::1'], linux_net.get_exposed_routes_on_network(
+            'ovn', 10, ipaddress.ip_network('fd00::/64')))
+
+    def test_sync_exposed_routes(self):
+        self.kernel_state.add_route(linux_net._get_route('10.0.0.1', 10, 7))
+        self.kernel_state.add_route(linux_net._get_route('10.0.0.2', 10, 7))
+
+        drift = linux_net.sync_exposed_routes(
+            'ovn', {'10.0.0.2', '10.0.0.3'}, 10)
+
+        self.assertEqual((1, 1), drift)
+        self.iproute.route.assert_has_calls([
+            mock.call(command='add', dst='10.0.0.3', dst_len=32, oif=7,
+                      table=10, proto=linux_net.ROUTE_PROTO, scope=253),
+            mock.call(command='del', dst='10.0.0.1', dst_len=32, oif=7,
+                      table=10, proto=linux_net.ROUTE_PROTO, scope=253)])
+        self.assertEqual([], linux_net.get_exposed_routes_on_network(
+            'ovn', 10, ipaddress.ip_network('10.0.0.1/32')))
+
+    def test_ip_neighbours_batch(self):
+        self.kernel_state.add_neighbour(8, '10.0.0.1', 'fa:16:3e:00:00:01')
+
+        linux_net.add_ip_neighbours_batch(['10.0.0.1', 'fd00::1'],
+                                          'br-ex.10', 'fa:16:3e:00:00:01')
+        linux_net.del_ip_neighbours_batch(['10.0.0.1/32', '10.0.0.2'],
+                                          'br-ex.10')
+
+        self.iproute.neigh.assert_has_calls([
+            mock.call(command='set', dst='fd00::1', ifindex=8,
+                      lladdr='fa:16:3e:00:00:01', family=AF_INET6,
+                      state=linux_net.ndmsg.states['permanent']),
+            mock.call(command='del', dst='10.0.0.1', ifindex=8,
+                      family=AF_INET,
+                      state=linux_net.ndmsg.states['permanent'])])
+        self.assertEqual(2, self.iproute.neigh.call_count)
+        self.assertIsNone(self.kernel_state.get_neighbour(8, '10.0.0.1'))
+
+    def test_table_rules(self):
+        self.kernel_state.add_rule({'table': 200, 'family': AF_INET})
+
+        linux_net.ensure_table_rules(200)
+
+        self.iproute.rule.assert_called_once_with(
+            command='add', table=200, family=AF_INET6,
+            priority=linux_net.RULE_PRIORITY)
+        self.iproute.rule.reset_mock()
+
+        linux_net.delete_table_rules(200)
+
+        self.assertEqual(2, self.iproute.rule.call_count)
+        self.assertFalse(self.kernel_state.has_rule({'table': 200}))
+
+    @mock.patch.object(linux_net._RT_TABLES, 'ensure', return_value=200)
+    def test_ensure_routing_table_for_bridge(self, mock_ensure):
+        self.kernel_state.apply(_link_msg(6, 'br-ex'))
+        self.kernel_state.apply(_route_msg(None, 200, 6, dst_len=0))
+        routing_tables = {}
+
+        linux_net.ensure_routing_table_for_bridge(routing_tables, 'br-ex')
+
+        # only the missing IPv6 default route is added
+        self.iproute.route.assert_called_once_with(
+            command='add', dst='default', oif=6, table=200,
+            family=AF_INET6, proto=linux_net.ROUTE_PROTO)
+        self.assertEqual(2, len(self.kernel_state.get_routes([200])))
+
+    @mock.patch.object(linux_net._RT_TABLES, 'ensure', return_value=200)
+    def test_ensure_routing_table_for_bridge_legacy_routes(self,
+                                                           mock_ensure):
+        self.kernel_state.apply(_link_msg(6, 'br-ex'))
+        # the routes of previous versions have the boot protocol
+        self.rtnl.dump.return_value = [
+            _route_msg(None, 200, 6, dst_len=0, proto=3),
+            _route_msg('10.0.0.1', 200, 8, proto=3)]
+        routing_tables = {}
+
+        extra_routes = linux_net.ensure_routing_table_for_bridge(
+            routing_tables, 'br-ex')
+
+        msg, msg_type = self.rtnl.dump.call_args[0]
+        self.assertEqual(linux_net.rtnl.RTM_GETROUTE, msg_type)
+        self.assertEqual(3, msg['proto'])
+        self.assertEqual(200, msg.get_attr('RTA_TABLE'))
+        self.iproute.route.assert_has_calls([
+            mock.call(command='replace', family=AF_INET, table=200,
+                      dst_len=0, proto=linux_net.ROUTE_PROTO, scope=253,
+                      type=1, oif=6),
+            mock.call(command='replace', family=AF_INET, table=200,
+                      dst_len=32, proto=linux_net.ROUTE_PROTO, scope=253,
+                      type=1, dst='10.0.0.1', oif=8),
+            mock.call(command='add', dst='default', oif=6, table=200,
+                      family=AF_INET6, proto=linux_net.ROUTE_PROTO)])
+        # so they are reconciled as the rest
+        self.assertEqual(['10.0.0.1'],
+                         [route['dst'] for route in extra_routes])
+        self.assertEqual(3, len(self.kernel_state.get_routes([200])))
+
+    def test_del_ip_route(self):
+        routes = linux_net.RouteRegistry()
+        linux_net.add_ip_route(routes, 'fd00::10', 200, 'br-ex', vlan=10,
+                               mask=64, via='fd01::1')
+        added = self.iproute.route.call_args[1]
+
+        linux_net.del_ip_route(routes, 'fd00::10', 200, 'br-ex', vlan=10,
+                               mask=64, via='fd01::1')
+
+        # the same route that was added
+        self.iproute.route.assert_called_with(
+            command='del', family=AF_INET6, table=200, dst='fd00::',
+            dst_len=64, oif=8, gateway='fd01::1',
+            scope=linux_net.rtnl.rt_scope['nowhere'])
+        self.assertEqual('fd00::', added['dst'])
+        self.assertEqual(0, len(routes))
+        self.assertEqual([], self.kernel_state.get_routes([200]))
+
+    def test_delete_ip_routes(self):
+        self.kernel_state.apply(_route_msg('10.0.0.1', 200, 8))
+        self.kernel_state.apply(_route_msg('10.0.0.2', 200, 8))
+        routes = self.kernel_state.get_routes([200])
+        self.iproute.route.side_effect = [
+            None, self._netlink_error(linux_net.errno.ESRCH)]
+
+        errors = linux_net.delete_ip_routes(
+            routes + [dict(routes[0], dst='10.0.0.3')])
+
+        self.assertEqual([], errors)
+        # any scope and protocol, as the mirror has them from the kernel
+        self.iproute.route.assert_any_call(
+            command='del', family=AF_INET, table=200, dst='10.0.0.1',
+            dst_len=32, oif=8, scope=linux_net.rtnl.rt_scope['nowhere'])
+        self.assertEqual(2, self.iproute.route.call_count)
+        self.assertEqual([], self.kernel_state.get_routes([200]))
+
+    def test_delete_ip_rules(self):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200})
+
+        linux_net.delete_ip_rules({
+            '10.0.0.1/32': {'table': 200, 'family': AF_INET},
+            '10.0.0.2/32': {'table': 200, 'family': AF_INET}})
+
+        self.iproute.rule.assert_called_once_with(
+            command='del', dst='10.0.0.1', dst_len=32, table=200,
+            family=AF_INET, priority=linux_net.RULE_PRIORITY)
+        self.assertFalse(self.kernel_state.has_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200}))
+
+    def test_ensure_device(self):
+        self.kernel_state.apply(_link_msg(9, 'bgp-nic', flags=0,
+                                          kind='dummy'))
+        self.iproute.link.return_value = []
+
+        linux_net.ensure_dummy_device('bgp-nic')
+        linux_net.ensure_vrf('bgp-vrf', 10)
+
+        self.iproute.link.assert_has_calls([
+            mock.call('set', index=9, state='up'),
+            mock.call('get', ifname='bgp-nic'),
+            mock.call('add', ifname='bgp-vrf', state='up', kind='vrf',
+                      vrf_table=10),
+            mock.call('get', ifname='bgp-vrf')])
+
+    def test_set_master_for_device(self):
+        self.iproute.link.return_value = []
+
+        linux_net.set_master_for_device('br-ex.10', 'ovn')
+
+        self.iproute.link.assert_any_call('set', ifname='br-ex.10',
+                                          master=7)
+
+    def test_delete_device(self):
+        self.iproute.link.side_effect = self._netlink_error(
+            linux_net.errno.ENODEV)
+
+        linux_net.delete_device('br-ex.10')
+        linux_net.delete_device('br-ex.20')
+
+        self.iproute.link.assert_called_once_with('del', ifname='br-ex.10')
+        self.assertIsNone(self.kernel_state.get_link('br-ex.10'))
+
+    def test_del_ip_rule_already_deleted(self):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200})
+        self.iproute.rule.side_effect = self._netlink_error(
+            linux_net.errno.ENOENT)
+
+        linux_net.del_ip_rule('10.0.0.1', 200)
+
+        self.iproute.rule.assert_called_once_with(
+            command='del', dst='10.0.0.1', dst_len=32, table=200,
+            priority=linux_net.RULE_PRIORITY)
+        self.assertFalse(self.kernel_state.has_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200}))
+
+    @mock.patch.object(linux_net, 'delete_ip_routes')
+    @mock.patch.object(linux_net._RT_TABLES, 'ensure', return_value=200)
+    def test_ensure_routing_table_for_bridge_table_steering(
+            self, mock_ensure, mock_delete):
+        self.kernel_state.apply(_link_msg(6, 'br-ex'))
+        self.kernel_state.apply(_route_msg(None, 200, 6, dst_len=0))
+        self.kernel_state.apply(_route_msg('10.0.0.1', 200, 8))
+        routing_tables = {}
+
+        extra_routes = linux_net.ensure_routing_table_for_bridge(
+            routing_tables, 'br-ex', table_steering=True)
+
+        self.assertEqual({'br-ex': 200}, routing_tables)
+        self.assertEqual(['10.0.0.1'], [r['dst'] for r in extra_routes])
+        self.assertEqual([''], [r['dst']
+                                for r in mock_delete.call_args[0][0]])
+        self.assertEqual(2, self.iproute.rule.call_count)
+
+    @mock.patch.object(linux_net, 'delete_ip_rules')
+    def test_sync_ip_rules(self, mock_delete):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200})
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.2', 'dst_len': 32, 'table': 200})
+
+        drift = linux_net.sync_ip_rules(
+            {'10.0.0.2/32': {'table': 200, 'dev': 'br-ex.10'},
+             '10.0.0.3/32': {'table': 200, 'dev': 'br-ex.10',
+                             'lladdr': 'fa:16:3e:00:00:01'}}, [200])
+
+        self.assertEqual((1, 1), drift)
+        self.iproute.rule.assert_called_once_with(
+            command='add', dst='10.0.0.3', dst_len=32, table=200,
+            priority=linux_net.RULE_PRIORITY)
+        self.iproute.neigh.assert_called_once_with(
+            command='set', dst='10.0.0.3', lladdr='fa:16:3e:00:00:01',
+            family=linux_net.AF_INET, ifindex=8,
+            state=linux_net.ndmsg.states['permanent'])
+        mock_delete.assert_called_once_with(
+            {'10.0.0.1/32': {'table': 200, 'family': linux_net.AF_INET,
+                             'priorities': {linux_net.RULE_PRIORITY}}})
+
+    def test_sync_ip_rules_legacy(self):
+        # rules from previous versions, with kernel assigned priorities
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200,
+             'priority': 32765})
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.2', 'dst_len': 32, 'table': 200,
+             'priority': 32764})
+
+        drift = linux_net.sync_ip_rules(
+            {'10.0.0.2/32': {'table': 200, 'dev': 'br-ex.10'}}, [200])
+
+        self.assertEqual((1, 2), drift)
+        # the desired one is replaced, and the extra one deleted
+        self.iproute.rule.assert_has_calls([
+            mock.call(command='add', dst='10.0.0.2', dst_len=32, table=200,
+                      priority=linux_net.RULE_PRIORITY),
+            mock.call(command='del', dst='10.0.0.2', dst_len=32, table=200,
+                      priority=32764),
+            mock.call(command='del', dst='10.0.0.1', dst_len=32, table=200,
+                      family=AF_INET, priority=32765)])
+        self.assertEqual(3, self.iproute.rule.call_count)
+        self.assertEqual(
+            [{'family': AF_INET, 'dst': '10.0.0.2', 'dst_len': 32,
+              'table': 200, 'priority': linux_net.RULE_PRIORITY}],
+            self.kernel_state.get_rules([200]))
+
+    def test_add_ip_rules_batch_replaces_legacy(self):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200,
+             'priority': 32765})
+        linux_net.add_ip_rules_batch(['10.0.0.1'], 200)
+        self.iproute.rule.reset_mock()
+
+        # not duplicated again once replaced
+        linux_net.add_ip_rules_batch(['10.0.0.1'], 200)
+
+        self.iproute.rule.assert_not_called()
+        self.assertEqual({linux_net.RULE_PRIORITY},
+                         self.kernel_state.get_rule_priorities(
+                             {'dst': '10.0.0.1', 'dst_len': 32,
+                              'table': 200}))
+
+    @mock.patch.object(linux_net, 'delete_ip_rules')
+    def test_sync_ip_rules_no_delete(self, mock_delete):
+        self.kernel_state.add_rule(
+            {'dst': '10.0.0.1', 'dst_len': 32, 'table': 200})
+
+        drift = linux_net.sync_ip_rules({}, [200], delete=False)
+
+        self.assertEqual((0, 0), drift)
+        mock_delete.assert_not_called()
+
+    @mock.patch.object(linux_net, 'delete_ip_routes')
+    def test_sync_bridge_routes(self, mock_delete):
+        self.kernel_state.apply(_link_msg(6, 'br-ex'))
+        # the default route through the bridge is kept
+        self.kernel_state.apply(_route_msg(None, 200, 6, dst_len=0))
+        self.kernel_state.apply(_route_msg('10.0.0.1', 200, 8))
+        self.kernel_state.apply(_route_msg('10.0.0.2', 200, 8))
+        routes = linux_net.RouteRegistry()
+        for ip in ('10.0.0.2', '10.0.0.3'):
+            routes.add('br-ex', linux_net.get_bridge_route(
+                ip, 200, 'br-ex', vlan=10), vlan=10)
+
+        drift = linux_net.sync_bridge_routes({'br-ex': 200}, routes)
+
+        self.assertEqual((1, 1), drift)
+        self.iproute.route.assert_called_once_with(
+            command='add', dst='10.0.0.3', dst_len=32, oif=8, table=200,
+            proto=linux_net.ROUTE_PROTO, scope=253)
+        self.assertEqual(['10.0.0.1'],
+                         [r['dst'] for r in mock_delete.call_args[0][0]])
+
+    @mock.patch.object(linux_net, 'delete_ip_routes')
+    def test_sync_bridge_routes_no_delete(self, mock_delete):
+        self.kernel_state.apply(_link_msg(6, 'br-ex'))
+        self.kernel_state.apply(_route_msg('10.0.0.1', 200, 8))
+        routes = linux_net.RouteRegistry()
+
+        drift = linux_net.sync_bridge_routes({'br-ex': 200}, routes,
+                                             delete=False)
+
+        self.assertEqual((0, 0), drift)
+        mock_delete.assert_not_called()
+
+
+class TestPrefixTrie(test_base.TestCase):
+
+    def setUp(self):
+        super(TestPrefixTrie, self).setUp()
+        self.trie = linux_net.PrefixTrie()
+        for address in ('10.0.0.1', '10.0.0.70', '10.0.1.1', '192.168.0.1',
+                        'fd00::1', 'fd00::1:1', 'fd01::1'):
+            self.trie.add(address)
+
+    def _get_addresses(self, network):
+        return sorted(self.trie.get_addresses(ipaddress.ip_network(network)))
+
+    def test_get_addresses(self):
+        self.assertEqual(7, len(self.trie))
+        self.assertEqual(['10.0.0.1', '10.0.0.70', '10.0.1.1'],
+                         self._get_addresses('10.0.0.0/16'))
+        self.assertEqual(['10.0.0.1', '10.0.0.70'],
+                         self._get_addresses('10.0.0.0/24'))
+        self.assertEqual(['10.0.0.70'], self._get_addresses('10.0.0.64/26'))
+        self.assertEqual(['10.0.0.1'], self._get_addresses('10.0.0.1/32'))
+        self.assertEqual([], self._get_addresses('10.0.0.2/32'))
+        self.assertEqual([], self._get_addresses('172.16.0.0/12'))
+        self.assertEqual(4, len(self._get_addresses('0.0.0.0/0')))
+
+    def test_get_addresses_ipv6(self):
+        self.assertEqual(['fd00::1', 'fd00::1:1'],
+                         self._get_addresses('fd00::/64'))
+        self.assertEqual(['fd00::1'], self._get_addresses('fd00::/112'))
+        self.assertEqual(['fd00::1', 'fd00::1:1', 'fd01::1'],
+                         self._get_addresses('fd00::/15'))
+
+    def test_remove(self):
+        self.trie.remove('10.0.0.70')
+        self.trie.remove('10.0.0.70')
+        self.trie.remove('10.9.0.1')
+
+        self.assertEqual(6, len(self.trie))
+        self.assertEqual(['10.0.0.1'], self._get_addresses('10.0.0.0/24'))
+
+        self.trie.remove('192.168.0.1')
+
+        # the emptied branches are pruned
+        self.assertNotIn(192, self.trie._roots[4])
+
+
+class TestRouteRegistry(test_base.TestCase):
+
+    def setUp(self):
+        super(TestRouteRegistry, self).setUp()
+        self.registry = linux_net.RouteRegistry()
+        self.cr_lrp_route = {'dst': '172.24.4.10', 'dst_len': 32, 'oif': 8,
+                             'table': 200, 'proto': 3, 'scope': 253}
+        self.subnet_route = {'dst': '10.0.0.0', 'dst_len': 24, 'oif': 8,
+                             'table': 200, 'proto': 3, 'scope': 0,
+                             'gateway': '172.24.4.10'}
+
+    def test_add(self):
+        self.registry.add('br-ex', self.cr_lrp_route, vlan=10)
+        self.registry.add('br-ex', dict(self.cr_lrp_route))
+
+        self.assertEqual(1, len(self.registry))
+        self.assertIn(self.cr_lrp_route, self.registry)
+        self.assertTrue(self.registry.has_dst('br-ex', '172.24.4.10', 32))
+        self.assertEqual({'br-ex.10'}, self.registry.get_vlan_devices())
+
+    def test_key(self):
+        self.registry.add('br-ex', self.subnet_route)
+
+        # kernel routes carry every attribute, only the key ones matter
+        self.assertIn(dict(self.subnet_route, family=linux_net.AF_INET,
+                           oif=9, proto=4), self.registry)
+        self.assertNotIn(dict(self.subnet_route, gateway='172.24.4.11'),
+                         self.registry)
+        self.assertNotIn(dict(self.subnet_route, table=201), self.registry)
+
+    def test_remove(self):
+        self.registry.add('br-ex', self.cr_lrp_route)
+        self.registry.add('br-ex', self.subnet_route)
+
+        self.assertTrue(self.registry.remove(self.cr_lrp_route))
+        self.assertFalse(self.registry.remove(self.cr_lrp_route))
+        self.assertFalse(self.registry.has_dst('br-ex', '172.24.4.10', 32))
+        self.assertEqual([self.subnet_route],
+                         self.registry.get_routes('br-ex'))
+
+    def test_get_stale(self):
+        self.registry.add('br-ex', self.cr_lrp_route)
+        stale_route = dict(self.cr_lrp_route, dst='172.24.4.11')
+
+        self.assertEqual([stale_route], self.registry.get_stale(
+            [dict(self.cr_lrp_route), stale_route]))
+
+
+def _nexthop_msg(nexthop_id, oif, gateway=None, family=AF_INET):
+    msg = linux_net._NexthopMsg()
+    msg['family'] = family
+    msg['attrs'] = [('NHA_ID', nexthop_id), ('NHA_OIF', oif)]
+    if gateway:
+        msg['attrs'].append(('NHA_GATEWAY', gateway))
+    return msg
+
+
+class TestNexthops(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNexthops, self).setUp()
+        self.rtnl = mock.Mock()
+        self.rtnl.dump.return_value = []
+        self.rtnl.batch.side_effect = lambda requests: [0] * len(requests)
+        get_rtnl = mock.patch.object(linux_net, 'get_rtnl').start()
+        get_rtnl.return_value.__enter__ = mock.Mock(return_value=self.rtnl)
+        get_rtnl.return_value.__exit__ = mock.Mock(return_value=False)
+        self.kernel_state = linux_net.KernelState()
+        self.kernel_state.apply(_link_msg(8, 'br-ex.10'))
+        self.kernel_state.apply(_link_msg(9, 'br-vlan'))
+        mock.patch.object(linux_net, 'get_kernel_state',
+                          return_value=self.kernel_state).start()
+        self.addCleanup(mock.patch.stopall)
+        self.nexthops = linux_net.Nexthops()
+
+    def _get_requests(self, msg_type):
+        msgs = [call[0][0] for call in self.rtnl.request.call_args_list
+                if call[0][1] == msg_type]
+        for call in self.rtnl.batch.call_args_list:
+            for request in call[0][0]:
+                if linux_net._NLMSG_HEADER.unpack_from(request)[1] != (
+                        msg_type):
+                    continue
+                msg = (linux_net._NexthopMsg(request)
+                       if msg_type == linux_net.RTM_DELNEXTHOP else
+                       linux_net._NexthopRouteMsg(request))
+                msg.decode()
+                msg['attrs'] = [tuple(attr) for attr in msg['attrs']]
+                msgs.append(msg)
+        return msgs
+
+    def test_ensure(self):
+        nexthop_id = self.nexthops.ensure('cr-lrp-1', 8,
+                                          gateway='172.24.4.10')
+
+        self.assertTrue(linux_net.NEXTHOP_ID_BASE <= nexthop_id <
+                        linux_net.NEXTHOP_ID_BASE + linux_net.NEXTHOP_IDS)
+        self.rtnl.dump.assert_called_once_with(
+            mock.ANY, linux_net.RTM_GETNEXTHOP)
+        self.rtnl.request.assert_called_with(
+            mock.ANY, linux_net.RTM_NEWNEXTHOP,
+            linux_net.netlink.NLM_F_CREATE | linux_net.netlink.NLM_F_REPLACE)
+        msg = self.rtnl.request.call_args[0][0]
+        self.assertEqual(linux_net.RTNH_F_ONLINK, msg['flags'])
+        self.assertEqual(linux_net.ROUTE_PROTO, msg['protocol'])
+        self.assertEqual([('NHA_ID', nexthop_id), ('NHA_OIF', 8),
+                          ('NHA_GATEWAY', '172.24.4.10')], msg['attrs'])
+        self.rtnl.request.reset_mock()
+
+        self.assertEqual(nexthop_id, self.nexthops.ensure(
+            'cr-lrp-1', 8, gateway='172.24.4.10'))
+        self.rtnl.request.assert_not_called()
+
+    def test_ensure_owners(self):
+        ipv4_id = self.nexthops.ensure('cr-lrp-1', 8, gateway='172.24.4.10')
+        ipv6_id = self.nexthops.ensure('cr-lrp-1', 8, gateway='2001:db8::10',
+                                       family=AF_INET6)
+        other_id = self.nexthops.ensure('cr-lrp-2', 8, gateway='172.24.4.10')
+
+        self.assertEqual(3, len({ipv4_id, ipv6_id, other_id}))
+        msg = self._get_requests(linux_net.RTM_NEWNEXTHOP)[1]
+        self.assertEqual(AF_INET6, msg['family'])
+
+    def test_ensure_replaces_in_place(self):
+        nexthop_id = self.nexthops.ensure('cr-lrp-1', 8,
+                                          gateway='172.24.4.10')
+
+        # e.g. the cr-lrp moved to another provider network
+        self.assertEqual(nexthop_id, self.nexthops.ensure(
+            'cr-lrp-1', 9, gateway='172.24.4.10'))
+        msgs = self._get_requests(linux_net.RTM_NEWNEXTHOP)
+        self.assertEqual(2, len(msgs))
+        self.assertEqual([('NHA_ID', nexthop_id), ('NHA_OIF', 9),
+                          ('NHA_GATEWAY', '172.24.4.10')], msgs[1]['attrs'])
+
+    def test_ensure_adopts_loaded(self):
+        loaded_id = linux_net.NEXTHOP_ID_BASE + 2
+        self.rtnl.dump.return_value = [
+            _nexthop_msg(5, 8),
+            _nexthop_msg(loaded_id, 8, gateway='172.24.4.10')]
+
+        self.assertEqual(loaded_id, self.nexthops.ensure(
+            'cr-lrp-1', 8, gateway='172.24.4.10'))
+        self.assertEqual([], self._get_requests(linux_net.RTM_NEWNEXTHOP))
+        # the nexthops out of the agent range are left alone
+        self.assertEqual(linux_net.NEXTHOP_ID_BASE,
+                         self.nexthops.ensure((200, 8), 8))
+
+    def test_sync(self):
+        used_id = self.nexthops.ensure((200, 8), 8)
+        extra_id = self.nexthops.ensure('cr-lrp-1', 8,
+                                        gateway='172.24.4.10')
+
+        self.assertEqual(1, self.nexthops.sync({used_id}))
+        msgs = self._get_requests(linux_net.RTM_DELNEXTHOP)
+        self.assertEqual([[('NHA_ID', extra_id)]],
+                         [msg['attrs'] for msg in msgs])
+        self.assertEqual(0, self.nexthops.sync({used_id}))
+
+    def test_add_ip_routes_batch(self):
+        routes = linux_net.RouteRegistry(nexthops=self.nexthops)
+
+        errors = linux_net.add_ip_routes_batch(
+            routes, ['10.0.0.1', '10.0.0.2'], 200, 'br-ex', vlan=10)
+
+        self.assertEqual([], errors)
+        nexthop_id = self.nexthops.ensure((200, 8), 8)
+        msgs = self._get_requests(linux_net.rtnl.RTM_NEWROUTE)
+        self.assertEqual(
+            [[('RTA_TABLE', 200), ('RTA_DST', '10.0.0.1'),
+              ('RTA_NH_ID', nexthop_id)],
+             [('RTA_TABLE', 200), ('RTA_DST', '10.0.0.2'),
+              ('RTA_NH_ID', nexthop_id)]],
+            [msg['attrs'] for msg in msgs])
+        self.assertEqual(2, len(routes))
+        self.assertEqual(2, len(self.kernel_state.get_routes([200])))
+
+    def test_add_ip_route_owner(self):
+        routes = linux_net.RouteRegistry(nexthops=self.nexthops)
+
+        linux_net.add_ip_route(routes, '10.0.0.0', 200, 'br-ex', vlan=10,
+                               mask=24, via='172.24.4.10', owner='cr-lrp-1')
+
+        nexthop_id = self.nexthops.ensure('cr-lrp-1', 8,
+                                          gateway='172.24.4.10')
+        msg = self._get_requests(linux_net.rtnl.RTM_NEWROUTE)[0]
+        self.assertEqual(nexthop_id, msg.get_attr('RTA_NH_ID'))
+        self.assertEqual('cr-lrp-1',
+                         routes.get_owner(routes.get_routes()[0]))
+
+    def test_add_ip_routes_batch_error(self):
+        routes = linux_net.RouteRegistry(nexthops=self.nexthops)
+        self.nexthops.ensure((200, 8), 8)
+
+        self.rtnl.batch.side_effect = lambda requests: (
+            [linux_net.errno.EINVAL] * len(requests))
+
+        errors = linux_net.add_ip_routes_batch(
+            routes, ['10.0.0.1'], 200, 'br-ex', vlan=10)
+
+        self.assertEqual(['10.0.0.1'], [ip for ip, _ in errors])
+        self.assertEqual(0, len(routes))
+        # the nexthops are reloaded on the next use
+        self.rtnl.dump.reset_mock()
+        self.nexthops.ensure((200, 8), 8)
+        self.rtnl.dump.assert_called_once_with(mock.ANY,
+                                               linux_net.RTM_GETNEXTHOP)
+
+    def test_del_ip_route(self):
+        routes = linux_net.RouteRegistry(nexthops=self.nexthops)
+        linux_net.add_ip_route(routes, '10.0.0.1', 200, 'br-ex', vlan=10)
+        self.rtnl.batch.reset_mock()
+
+        linux_net.del_ip_route(routes, '10.0.0.1', 200, 'br-ex', vlan=10)
+
+        msg = self._get_requests(linux_net.rtnl.RTM_DELROUTE)[0]
+        # only matched by destination and table
+        self.assertEqual([('RTA_TABLE', 200), ('RTA_DST', '10.0.0.1')],
+                         msg['attrs'])
+        self.assertEqual(32, msg['dst_len'])
+        self.assertEqual(0, len(routes))
+        self.assertEqual([], self.kernel_state.get_routes([200]))
+
+
+class TestKernelFlags(test_base.TestCase):
+
+    def test__get_kernel_flag_path(self):
+        self.assertEqual(
+            '/proc/sys/net/ipv4/conf/br-ex.100/proxy_arp',
+            linux_net._get_kernel_flag_path(
+                'net.ipv4.conf.br-ex/100.proxy_arp'))
+
+    @mock.patch.object(linux_net.processutils, 'execute')
+    def test__set_kernel_flag_already_set(self, mock_execute):
+        mock_open = mock.mock_open(read_data='1\n')
+        with mock.patch('builtins.open', mock_open):
+            linux_net._set_kernel_flag('net.ipv4.conf.br-ex.proxy_arp', 1)
+
+        mock_open.assert_called_once_with(
+            '/proc/sys/net/ipv4/conf/br-ex/proxy_arp')
+        mock_open.return_value.write.assert_not_called()
+        mock_execute.assert_not_called()
+
+    @mock.patch.object(linux_net.processutils, 'execute')
+    def test__set_kernel_flag(self, mock_execute):
+        mock_open = mock.mock_open(read_data='0\n')
+        with mock.patch('builtins.open', mock_open):
+            linux_net._set_kernel_flag('net.ipv4.conf.br-ex.proxy_arp', 1)
+
+        mock_open.assert_called_with(
+            '/proc/sys/net/ipv4/conf/br-ex/proxy_arp', 'w')
+        mock_open.return_value.write.assert_called_once_with('1')
+        mock_execute.assert_not_called()
+
+    @mock.patch.object(linux_net.processutils, 'execute')
+    def test__set_kernel_flag_not_privileged(self, mock_execute):
+        mock_open = mock.mock_open(read_data='0\n')
+        mock_open.side_effect = [mock_open.return_value, PermissionError()]
+        with mock.patch('builtins.open', mock_open):
+            linux_net._set_kernel_flag('net.ipv4.conf.br-ex.proxy_arp', 1)
+
+        mock_execute.assert_called_once_with(
+            'sysctl', '-w', 'net.ipv4.conf.br-ex.proxy_arp=1',
+            run_as_root=True)
+
+
+class TestNdpProxyAndUnreachable(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNdpProxyAndUnreachable, self).setUp()
+        self.iproute = mock.Mock()
+        get_iproute = mock.patch.object(linux_net, 'get_iproute').start()
+        get_iproute.return_value.__enter__ = mock.Mock(
+            return_value=self.iproute)
+        get_iproute.return_value.__exit__ = mock.Mock(return_value=False)
+        self.rtnl = _patch_netlink(self.iproute)
+        self.kernel_state = linux_net.KernelState()
+        self.kernel_state.apply(_link_msg(7, 'br-ex'))
+        mock.patch.object(linux_net, 'get_kernel_state',
+                          return_value=self.kernel_state).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _proxy_entry(self, ip, ifindex=7):
+        return FakeMsg('RTM_NEWNEIGH', {'NDA_DST': ip}, ifindex=ifindex)
+
+    def test_get_ndp_proxies(self):
+        self.rtnl.dump.return_value = [
+            self._proxy_entry('fd00::'), self._proxy_entry('fd01::')]
+
+        self.assertEqual(['fd00::', 'fd01::'],
+                         linux_net.get_ndp_proxies('br-ex'))
+        msg, msg_type = self.rtnl.dump.call_args[0]
+        self.assertEqual(linux_net.rtnl.RTM_GETNEIGH, msg_type)
+        self.assertEqual(linux_net.ndmsg.NTF_PROXY, msg['flags'])
+        self.assertEqual(AF_INET6, msg['family'])
+        # the entries of the other devices are filtered out by the kernel
+        self.assertEqual(7, msg.get_attr('NDA_IFINDEX'))
+
+    def test_add_ndp_proxy(self):
+        linux_net.add_ndp_proxy('fd00::10/64', 'br-ex')
+
+        self.iproute.neigh.assert_called_once_with(
+            command='add', dst='fd00::', ifindex=7, family=AF_INET6,
+            flags=linux_net.ndmsg.NTF_PROXY)
+
+    def test_del_ndp_proxy_already_deleted(self):
+        self.iproute.neigh.side_effect = (
+            linux_net.pyroute2.netlink.exceptions.NetlinkError(
+                linux_net.errno.ENOENT))
+
+        self.assertEqual([], linux_net.del_ndp_proxy('fd00::10/64', 'br-ex'))
+
+    def test_sync_ndp_proxies(self):
+        self.rtnl.dump.return_value = [
+            self._proxy_entry('fd00::'), self._proxy_entry('fd02::')]
+
+        drift = linux_net.sync_ndp_proxies(['fd00::10/64', 'fd01::10/64'],
+                                           'br-ex')
+
+        self.assertEqual((1, 1), drift)
+        self.iproute.neigh.assert_has_calls([
+            mock.call(command='add', dst='fd01::', ifindex=7,
+                      family=AF_INET6, flags=linux_net.ndmsg.NTF_PROXY),
+            mock.call(command='del', dst='fd02::', ifindex=7,
+                      family=AF_INET6, flags=linux_net.ndmsg.NTF_PROXY)])
+
+    def test_add_unreachable_route(self):
+        self.kernel_state.apply(_link_msg(
+            9, 'vrf-1001', kind='vrf', info_data={'IFLA_VRF_TABLE': 1001}))
+        # the IPv4 route is already there
+        self.kernel_state.apply(_route_msg(None, 1001, None, dst_len=0,
+                                           rt_type=7))
+
+        linux_net.add_unreachable_route('vrf-1001')
+        linux_net.add_unreachable_route('vrf-1001')
+
+        self.iproute.route.assert_called_once_with(
+            command='add', family=AF_INET6, table=1001, dst_len=0, type=7,
+            priority=linux_net.UNREACHABLE_ROUTE_METRIC,
+            proto=linux_net.ROUTE_PROTO)
+
+
+class TestRoutingTables(test_base.TestCase):
+
+    def setUp(self):
+        super(TestRoutingTables, self).setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'rt_tables')
+        with open(self.path, 'w') as f:
+            f.write('# reserved values\n255\tlocal\n254\tmain\n'
+                    '200 br-ex  # comment\n')
+        self.rt_tables = linux_net.RoutingTables(self.path)
+
+    def test_get(self):
+        self.assertEqual(200, self.rt_tables.get('br-ex'))
+        self.assertEqual(254, self.rt_tables.get('main'))
+        self.assertIsNone(self.rt_tables.get('br-vlan'))
+
+    def test_get_reloads_modified_file(self):
+        self.assertIsNone(self.rt_tables.get('br-vlan'))
+        with open(self.path, 'a') as f:
+            f.write('201 br-vlan\n')
+
+        self.assertEqual(201, self.rt_tables.get('br-vlan'))
+
+    @mock.patch.object(linux_net, 'open', create=True,
+                       side_effect=open)
+    def test_get_cached(self, mock_open):
+        for _ in range(3):
+            self.rt_tables.get('br-ex')
+
+        mock_open.assert_called_once_with(self.path)
+
+    def test_ensure(self):
+        number = self.rt_tables.ensure('br-vlan')
+
+        self.assertEqual(number, self.rt_tables.ensure('br-vlan'))
+        # the number is deterministic and persisted
+        self.assertEqual(number,
+                         linux_net.RoutingTables(self.path).get('br-vlan'))
+        with open(self.path) as f:
+            content = f.read()
+        self.assertTrue(content.startswith('# reserved values\n'))
+        self.assertTrue(content.endswith('{} br-vlan\n'.format(number)))
+
+    def test_ensure_probes_used_numbers(self):
+        number = self.rt_tables._allocate('br-vlan')
+        with open(self.path, 'a') as f:
+            f.write('{} other\n'.format(number))
+
+        self.assertEqual(number % 252 + 1, self.rt_tables.ensure('br-vlan'))
+
+    def test_ensure_full(self):
+        with open(self.path, 'w') as f:
+            f.writelines('{} table{}\n'.format(i, i) for i in range(1, 253))
+
+        self.assertIsNone(self.rt_tables.ensure('br-vlan'))
@@ -12,15 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import contextlib
+import errno
+import fcntl
 import ipaddress
+import os
 import pyroute2
-import random
-import re
+import socket
+import struct
 import sys
-
+import tempfile
+import threading
+import zlib
+
+from pyroute2 import netlink
+from pyroute2.netlink import rtnl
+from pyroute2.netlink.rtnl import fibmsg
+from pyroute2.netlink.rtnl import ifaddrmsg
+from pyroute2.netlink.rtnl import ifinfmsg
 from pyroute2.netlink.rtnl import ndmsg
+from pyroute2.netlink.rtnl import rtmsg
 from socket import AF_INET
 from socket import AF_INET6
+from socket import AF_NETLINK
+from socket import AF_UNSPEC
 
 from oslo_concurrency import processutils
 from oslo_log import log as logging
@@ -30,77 +46,878 @@ from networking_bgp_ovn import constants
 LOG = logging.getLogger(__name__)
 
 
+# netlink socket options, not in the socket module
+_SOL_NETLINK = 270
+_NETLINK_GET_STRICT_CHK = 12
+_NETLINK_ROUTE = 0
+_NLMSG_HEADER = struct.Struct('IHHII')
+_NLMSG_ERROR_CODE = struct.Struct('i')
+
+
+def _encode(msg, msg_type, msg_flags=0, seq=0):
+    """Return msg (a pyroute2 message) encoded as a request."""
+    msg['header']['type'] = msg_type
+    msg['header']['flags'] = netlink.NLM_F_REQUEST | msg_flags
+    msg['header']['sequence_number'] = seq
+    msg['header']['pid'] = 0
+    msg.encode()
+    return bytes(msg.data)
+
+
+class RtnlSocket(object):
+    """Plain rtnetlink socket the dumps and requests are sent through.
+
+    Only the pyroute2 message classes are used, to encode the requests
+    and decode the replies, so this does not depend on how each pyroute2
+    version sends the messages and reads their replies. Strict checking
+    is enabled, so the kernel applies the filters of the dump requests
+    (e.g. the kind of the links or the protocol of the routes) and only
+    the matching entries are sent over.
+
+    The requests are sent in batches: all the messages of a batch at
+    once, and then their ACKs are read and matched by sequence number,
+    so there is no round trip per request.
+    """
+
+    _BUFFER_SIZE = 1 << 20
+    # requests sent at once, so their ACKs fit in the receive buffer
+    _BATCH_SIZE = 64
+
+    def __init__(self):
+        self._socket = socket.socket(AF_NETLINK, socket.SOCK_RAW,
+                                     _NETLINK_ROUTE)
+        try:
+            self._socket.setsockopt(_SOL_NETLINK, _NETLINK_GET_STRICT_CHK,
+                                    1)
+            self._socket.bind((0, 0))
+        except Exception:
+            self._socket.close()
+            raise
+        self._seq = 0
+
+    def _next_seq(self):
+        self._seq = self._seq % 0xffffffff + 1
+        return self._seq
+
+    def _recv(self, seqs):
+        """Yield (seq, type, data) of the replies to seqs, as read."""
+        while True:
+            data = self._socket.recv(self._BUFFER_SIZE)
+            offset = 0
+            while offset + _NLMSG_HEADER.size <= len(data):
+                length, msg_type, _flags, seq, _pid = (
+                    _NLMSG_HEADER.unpack_from(data, offset))
+                if length < _NLMSG_HEADER.size:
+                    break
+                # leftovers of an interrupted request are skipped
+                if seq in seqs:
+                    yield seq, msg_type, data[offset:offset + length]
+                offset += (length + 3) & ~3
+
+    @staticmethod
+    def _error_code(data):
+        # the errors are sent as -errno, right after the header
+        if len(data) < _NLMSG_HEADER.size + _NLMSG_ERROR_CODE.size:
+            return 0
+        return -_NLMSG_ERROR_CODE.unpack_from(data, _NLMSG_HEADER.size)[0]
+
+    def batch(self, requests):
+        """Send the requests, encoded messages, and return their errors.
+
+        The error of each request is returned in order, 0 if it was
+        applied. A failing request does not abort the rest.
+        """
+        errors = []
+        for start in range(0, len(requests), self._BATCH_SIZE):
+            errors.extend(self._send_batch(
+                requests[start:start + self._BATCH_SIZE]))
+        return errors
+
+    def _send_batch(self, requests):
+        buf = bytearray()
+        seqs = {}
+        for index, request in enumerate(requests):
+            length, msg_type, flags, _seq, _pid = (
+                _NLMSG_HEADER.unpack_from(request))
+            seq = self._next_seq()
+            seqs[seq] = index
+            buf += _NLMSG_HEADER.pack(length, msg_type,
+                                      flags | netlink.NLM_F_ACK, seq, 0)
+            buf += request[_NLMSG_HEADER.size:length]
+            buf += bytes(-length % 4)
+        self._socket.sendall(buf)
+        errors = [None] * len(requests)
+        pending = len(requests)
+        for seq, msg_type, data in self._recv(seqs):
+            index = seqs[seq]
+            if msg_type != netlink.NLMSG_ERROR or errors[index] is not None:
+                continue
+            errors[index] = self._error_code(data)
+            pending -= 1
+            if not pending:
+                return errors
+
+    def request(self, msg, msg_type, msg_flags=0):
+        """Send a request and wait for its ACK.
+
+        Raises a NetlinkError if the kernel rejected it.
+        """
+        code = self.batch([_encode(msg, msg_type, msg_flags)])[0]
+        if code:
+            raise pyroute2.netlink.exceptions.NetlinkError(
+                code, os.strerror(code))
+
+    def dump(self, msg, msg_type):
+        """Send a dump request and return its replies.
+
+        The replies are decoded with the class of msg, and get the name
+        of their type as event, as the IPRoute ones.
+        """
+        seq = self._next_seq()
+        self._socket.sendall(_encode(msg, msg_type, netlink.NLM_F_DUMP, seq))
+        replies = []
+        for _seq, reply_type, data in self._recv((seq,)):
+            if reply_type in (netlink.NLMSG_DONE, netlink.NLMSG_ERROR):
+                # the dump errors come with its end
+                code = self._error_code(data)
+                if code:
+                    raise pyroute2.netlink.exceptions.NetlinkError(
+                        code, os.strerror(code))
+                return replies
+            reply = type(msg)(data)
+            reply.decode()
+            reply['event'] = rtnl.RTM_VALUES.get(reply_type)
+            replies.append(reply)
+
+    def close(self):
+        self._socket.close()
+
+
+class NetlinkContext(object):
+    """Long-lived netlink handles shared by all the helpers.
+
+    The requests are built with an IPBatch (or by the helpers, for the
+    messages pyroute2 does not know) and sent in batches through an
+    RtnlSocket, which also does the dumps, while the links are handled
+    through an IPRoute. They are kept for the agent lifetime instead of
+    opened per call, and the kernel state is read from the KernelState
+    mirror, so no NDB (with its worker threads and full dumps of the
+    kernel state) is ever started. Access is serialized
+    with a reentrant lock, and the handles are dropped after an
+    unexpected error so the next user gets new ones.
+    """
+
+    # errors the helpers use as regular control flow, or rejected
+    # requests, which leave the handles usable
+    _EXPECTED_ERRORS = (KeyError, ValueError, IndexError,
+                        pyroute2.netlink.exceptions.NetlinkError)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handles = {}
+
+    @contextlib.contextmanager
+    def _get(self, name, factory):
+        with self._lock:
+            handle = self._handles.get(name)
+            if handle is None:
+                handle = self._handles[name] = factory()
+            try:
+                yield handle
+            except self._EXPECTED_ERRORS:
+                raise
+            except Exception:
+                LOG.warning("Unexpected error using the shared netlink %s, "
+                            "it will be reopened", name)
+                self._close(name)
+                raise
+
+    def iproute(self):
+        return self._get('iproute', pyroute2.IPRoute)
+
+    def rtnl(self):
+        return self._get('rtnl', RtnlSocket)
+
+    def ipbatch(self):
+        return self._get('ipbatch', pyroute2.IPBatch)
+
+    def _close(self, name):
+        handle = self._handles.pop(name, None)
+        if handle is None:
+            return
+        try:
+            handle.close()
+        except Exception as e:
+            LOG.debug("Error closing netlink %s: %s", name, e)
+
+    def close(self):
+        with self._lock:
+            for name in list(self._handles):
+                self._close(name)
+
+
+_NETLINK = NetlinkContext()
+
+
+def get_iproute():
+    return _NETLINK.iproute()
+
+
+def get_rtnl():
+    return _NETLINK.rtnl()
+
+
+def get_ipbatch():
+    return _NETLINK.ipbatch()
+
+
+# kernel tables the agent never reads, their routes and rules are not
+# mirrored: unspec, default, main and local
+_IGNORED_TABLES = (0, 253, 254, 255)
+_IFF_UP = 1
+RT_TABLES_FILE = '/etc/iproute2/rt_tables'
+# the highest metric, so the routes learnt through BGP take precedence
+UNREACHABLE_ROUTE_METRIC = 4278198272
+# ids of the nexthop objects managed by the agent
+NEXTHOP_ID_BASE = 0x0b900000
+NEXTHOP_IDS = 0x10000
+# nexthop objects netlink messages (linux >= 5.3) and flags
+RTM_NEWNEXTHOP = 104
+RTM_DELNEXTHOP = 105
+RTM_GETNEXTHOP = 106
+RTNH_F_ONLINK = 4
+_RT_TABLE_COMPAT = 252
+# the routes the agent adds are tagged with a protocol of their own, and
+# its rules with a priority of their own, to tell them from the rest (any
+# rule to its tables is still its own, e.g. the ones from previous
+# versions, which left the priority to the kernel)
+ROUTE_PROTO = 90
+RULE_PRIORITY = 32000
+# the routes added by previous versions have the boot protocol, as the
+# ones added by hand, so they are only re-tagged on the bridge tables
+_LEGACY_ROUTE_PROTO = rtnl.rt_proto['boot']
+# kinds of the links the agent creates or uses, the rest (e.g., the VM
+# taps) are not mirrored
+_LINK_KINDS = ('openvswitch', 'vrf', 'vlan', 'dummy', 'bridge', 'vxlan')
+_RTNL_GROUPS = (rtnl.RTMGRP_LINK | rtnl.RTMGRP_NEIGH |
+                rtnl.RTMGRP_IPV4_IFADDR | rtnl.RTMGRP_IPV6_IFADDR |
+                rtnl.RTMGRP_IPV4_ROUTE | rtnl.RTMGRP_IPV6_ROUTE |
+                rtnl.RTMGRP_IPV4_RULE | rtnl.RTMGRP_IPV6_RULE)
+
+
+def _rule_key(rule):
+    return (rule.get('family', AF_INET), rule.get('dst'),
+            int(rule.get('dst_len') or 0), int(rule['table']))
+
+
+def _rule_priority(rule):
+    priority = rule.get('priority')
+    return RULE_PRIORITY if priority is None else int(priority)
+
+
+def _route_key(route):
+    dst = route.get('dst') or ''
+    if dst == 'default':
+        dst = ''
+    return (route.get('family', AF_INET), int(route['table']), dst,
+            int(route.get('dst_len') or 0), route.get('oif'),
+            route.get('gateway'))
+
+
+def _get_link_kind(msg):
+    link_info = msg.get_attr('IFLA_LINKINFO')
+    return link_info.get_attr('IFLA_INFO_KIND') if link_info else None
+
+
+def _dump_links(rtnl_socket, kind):
+    msg = ifinfmsg.ifinfmsg()
+    msg['family'] = AF_UNSPEC
+    msg['attrs'] = [('IFLA_LINKINFO', {'attrs': [('IFLA_INFO_KIND', kind)]})]
+    # the kernel only filters by the kinds of the modules loaded, and
+    # sends all the links otherwise
+    return [link for link in rtnl_socket.dump(msg, rtnl.RTM_GETLINK)
+            if _get_link_kind(link) == kind]
+
+
+def _dump_addresses(rtnl_socket, index):
+    msg = ifaddrmsg.ifaddrmsg()
+    msg['family'] = AF_UNSPEC
+    msg['index'] = index
+    return rtnl_socket.dump(msg, rtnl.RTM_GETADDR)
+
+
+def _dump_rules(rtnl_socket):
+    # the kernel does not filter the rule dumps
+    msg = fibmsg.fibmsg()
+    msg['family'] = AF_UNSPEC
+    return rtnl_socket.dump(msg, rtnl.RTM_GETRULE)
+
+
+def _dump_routes(rtnl_socket, proto, family=AF_UNSPEC, table=None):
+    msg = rtmsg.rtmsg()
+    msg['family'] = family
+    msg['proto'] = proto
+    if table is not None:
+        msg['attrs'] = [('RTA_TABLE', table)]
+    return rtnl_socket.dump(msg, rtnl.RTM_GETROUTE)
+
+
+def _dump_neighbours(rtnl_socket, index, family=AF_UNSPEC, flags=0):
+    msg = ndmsg.ndmsg()
+    msg['family'] = family
+    msg['flags'] = flags
+    msg['attrs'] = [('NDA_IFINDEX', index)]
+    return rtnl_socket.dump(msg, rtnl.RTM_GETNEIGH)
+
+
+class PrefixTrie(object):
+    """Host addresses indexed by their bytes, IPv4 and IPv6 alike.
+
+    Each level of the trie is keyed by one byte of the address, so the
+    addresses within a network are the ones below the node of its prefix
+    and finding them does not need to go through all the others.
+    """
+
+    def __init__(self):
+        self._roots = {4: {}, 6: {}}
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, address):
+        ip = ipaddress.ip_address(address)
+        node = self._roots[ip.version]
+        for key in ip.packed[:-1]:
+            node = node.setdefault(key, {})
+        if ip.packed[-1] not in node:
+            self._len += 1
+        node[ip.packed[-1]] = address
+
+    def remove(self, address):
+        ip = ipaddress.ip_address(address)
+        path = []
+        node = self._roots[ip.version]
+        for key in ip.packed[:-1]:
+            path.append((node, key))
+            node = node.get(key)
+            if node is None:
+                return
+        if node.pop(ip.packed[-1], None) is None:
+            return
+        self._len -= 1
+        # drop the branches left empty
+        while path and not node:
+            node, key = path.pop()
+            del node[key]
+
+    def get_addresses(self, network):
+        """Return the addresses within network (an ipaddress network)."""
+        packed = network.network_address.packed
+        full_bytes, bits = divmod(network.prefixlen, 8)
+        node = self._roots[network.version]
+        for key in packed[:full_bytes]:
+            node = node.get(key)
+            if node is None:
+                return []
+        if full_bytes == len(packed):  # host network
+            return [node]
+        depth = full_bytes + 1
+        if bits:
+            mask = (0xff << (8 - bits)) & 0xff
+            nodes = [child for key, child in node.items()
+                     if key & mask == packed[full_bytes]]
+        else:
+            nodes = list(node.values())
+        # every leaf is as deep as the address is long
+        while depth < len(packed):
+            nodes = [child for node in nodes for child in node.values()]
+            depth += 1
+        return nodes
+
+
+class KernelState(object):
+    """In-process mirror of the kernel networking state the agent uses.
+
+    The links, addresses, rules, routes and permanent neighbours are
+    loaded with one dump and then kept current from the RTNL multicast
+    notifications, so reads and existence checks are local lookups
+    instead of kernel dumps. Only the routes the agent added, told by
+    their protocol, the rules to the tables other than the main, local
+    and default ones, which the agent owns if they are to its tables,
+    and the links of the kinds the agent uses (and their addresses and
+    neighbours) are mirrored.
+
+    The helpers also record their own changes right away, so a check
+    done just after a change does not depend on the notification having
+    been processed already.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # serializes start, which dumps the kernel state without holding
+        # _lock as the dump takes the shared netlink lock
+        self._start_lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self._links = {}
+        self._link_names = {}
+        self._addresses = {}
+        self._host_addresses = {}  # {index: PrefixTrie}
+        self._rules = {}  # {key: set(priorities)}
+        self._routes = {}
+        self._host_routes = {}  # {(table, oif): PrefixTrie}
+        self._neighbours = {}
+
+    def start(self):
+        with self._start_lock:
+            if self._socket is not None:
+                return
+            # the listener needs its own socket, as the multicast messages
+            # would get mixed with the replies on the shared one
+            sock = pyroute2.IPRoute()
+            try:
+                sock.bind(groups=_RTNL_GROUPS)
+                # bound before dumping, so no change is lost in between
+                self._dump()
+            except Exception:
+                sock.close()
+                raise
+            with self._lock:
+                self._socket = sock
+            self._thread = threading.Thread(target=self._listen,
+                                            args=(sock,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._start_lock, self._lock:
+            self._close()
+            self._reset()
+
+    def _close(self):
+        sock, self._socket = self._socket, None
+        if sock is None:
+            return
+        try:
+            sock.close()
+        except Exception as e:
+            LOG.debug("Error closing the netlink listener: %s", e)
+
+    def _dump(self):
+        # the dumps are filtered in the kernel, so only the links of the
+        # kinds the agent uses and their addresses and neighbours, and
+        # the routes the agent added, are sent over
+        with get_rtnl() as rtnl_socket:
+            links = []
+            for kind in _LINK_KINDS:
+                links.extend(_dump_links(rtnl_socket, kind))
+            indexes = [link['index'] for link in links]
+            addresses = []
+            neighbours = []
+            for index in indexes:
+                addresses.extend(_dump_addresses(rtnl_socket, index))
+                neighbours.extend(_dump_neighbours(rtnl_socket, index))
+            rules = _dump_rules(rtnl_socket)
+            routes = _dump_routes(rtnl_socket, ROUTE_PROTO)
+        # loaded apart and swapped in, so _lock is never held while
+        # waiting for the shared netlink lock
+        state = KernelState()
+        for msg in links + addresses + rules + routes + neighbours:
+            state.apply(msg)
+        with self._lock:
+            self._links = state._links
+            self._link_names = state._link_names
+            self._addresses = state._addresses
+            self._host_addresses = state._host_addresses
+            self._rules = state._rules
+            self._routes = state._routes
+            self._host_routes = state._host_routes
+            self._neighbours = state._neighbours
+
+    def _listen(self, sock):
+        while True:
+            try:
+                msgs = sock.get()
+            except Exception as e:
+                if self._socket is not sock:
+                    return  # stopped
+                # most likely the socket buffer overflowed and messages
+                # were lost, so the mirror has to be loaded again
+                LOG.warning("Error reading netlink notifications, "
+                            "reloading the kernel state: %s", e)
+                try:
+                    self._dump()
+                except Exception as e:
+                    LOG.error("Unable to reload the kernel state: %s", e)
+                    with self._lock:
+                        if self._socket is sock:
+                            self._close()
+                    return
+                continue
+            with self._lock:
+                if self._socket is not sock:
+                    return
+                for msg in msgs:
+                    self.apply(msg)
+
+    def apply(self, msg):
+        """Update the mirror with an RTNL message."""
+        event = msg.get('event', '')
+        handler = getattr(self, '_on_{}'.format(event[7:].lower()), None)
+        if handler is None:
+            return
+        with self._lock:
+            handler(msg, event.startswith('RTM_NEW'))
+
+    def _on_link(self, msg, new):
+        index = msg['index']
+        link_info = msg.get_attr('IFLA_LINKINFO') if new else None
+        kind = link_info.get_attr('IFLA_INFO_KIND') if link_info else None
+        if new and kind not in _LINK_KINDS:
+            return
+        old = self._links.pop(index, None)
+        if old:
+            self._link_names.pop(old['ifname'], None)
+        if not new:
+            self._addresses.pop(index, None)
+            self._host_addresses.pop(index, None)
+            self._forget_link_routes(index, (AF_INET, AF_INET6))
+            for key in [k for k in self._neighbours if k[0] == index]:
+                del self._neighbours[key]
+            return
+        link = {'index': index,
+                'ifname': msg.get_attr('IFLA_IFNAME'),
+                'master': msg.get_attr('IFLA_MASTER'),
+                'address': msg.get_attr('IFLA_ADDRESS'),
+                'state': 'up' if msg['flags'] & _IFF_UP else 'down',
+                'kind': kind,
+                'vrf_table': None}
+        info_data = link_info.get_attr('IFLA_INFO_DATA')
+        if kind == 'vrf' and info_data:
+            link['vrf_table'] = info_data.get_attr('IFLA_VRF_TABLE')
+        self._links[index] = link
+        self._link_names[link['ifname']] = index
+        if link['state'] != 'up':
+            # the kernel flushes the IPv4 routes of a device set down
+            # without notifying about each of them
+            self._forget_link_routes(index, (AF_INET,))
+
+    def _forget_link_routes(self, index, families):
+        for key in [k for k in self._routes
+                    if k[4] == index and k[0] in families]:
+            self._update_route(self._routes[key], False)
+
+    def _on_addr(self, msg, new):
+        if msg['index'] not in self._links:
+            return
+        address = (msg.get_attr('IFA_LOCAL') or
+                   msg.get_attr('IFA_ADDRESS'))
+        self._update_address(msg['index'], address, msg['prefixlen'], new)
+
+    def _update_address(self, index, address, prefixlen, new):
+        addresses = self._addresses.setdefault(index, set())
+        if new:
+            addresses.add((address, prefixlen))
+        else:
+            addresses.discard((address, prefixlen))
+        if prefixlen != _get_host_prefixlen(address):
+            return
+        host_addresses = self._host_addresses.setdefault(index, PrefixTrie())
+        if new:
+            host_addresses.add(address)
+        else:
+            host_addresses.remove(address)
+
+    def _on_rule(self, msg, new):
+        table = msg.get_attr('FRA_TABLE') or msg['table']
+        if table in _IGNORED_TABLES:
+            return
+        self._update_rule({'family': msg['family'],
+                           'dst': msg.get_attr('FRA_DST'),
+                           'dst_len': msg['dst_len'],
+                           'table': table,
+                           'priority': msg.get_attr('FRA_PRIORITY') or 0},
+                          new)
+
+    def _update_rule(self, rule, new):
+        key = _rule_key(rule)
+        if new:
+            self._rules.setdefault(key, set()).add(_rule_priority(rule))
+            return
+        priorities = self._rules.get(key)
+        if priorities is None:
+            return
+        priorities.discard(_rule_priority(rule))
+        if not priorities:
+            del self._rules[key]
+
+    def _on_route(self, msg, new):
+        table = msg.get_attr('RTA_TABLE') or msg['table']
+        if table in _IGNORED_TABLES or msg['proto'] != ROUTE_PROTO:
+            return
+        self._update_route({'family': msg['family'],
+                            'table': table,
+                            'dst': msg.get_attr('RTA_DST') or '',
+                            'dst_len': msg['dst_len'],
+                            'oif': msg.get_attr('RTA_OIF'),
+                            'gateway': msg.get_attr('RTA_GATEWAY'),
+                            'proto': msg['proto'],
+                            'scope': msg['scope'],
+                            'type': msg['type']}, new)
+
+    def _update_route(self, route, new):
+        key = _route_key(route)
+        family, table, dst, dst_len, oif, gateway = key
+        rt_type = route.get('type', rtnl.rt_type['unicast'])
+        # the local routes of the addresses on VRF devices are left out
+        if (rt_type == rtnl.rt_type['unicast'] and dst and not gateway and
+                dst_len == _get_host_prefixlen(dst)):
+            host_routes = self._host_routes.setdefault((table, oif),
+                                                       PrefixTrie())
+            if new:
+                host_routes.add(dst)
+            else:
+                host_routes.remove(dst)
+        if not new:
+            self._routes.pop(key, None)
+            return
+        self._routes[key] = {'family': family, 'table': table, 'dst': dst,
+                             'dst_len': dst_len, 'oif': oif,
+                             'gateway': gateway,
+                             'proto': route.get('proto'),
+                             'scope': route.get('scope'),
+                             'type': rt_type}
+
+    def _on_neigh(self, msg, new):
+        if (msg['state'] != ndmsg.states['permanent'] or
+                msg['ifindex'] not in self._links):
+            return
+        self._update_neighbour(msg['ifindex'], msg.get_attr('NDA_DST'),
+                               msg.get_attr('NDA_LLADDR'), new)
+
+    def _update_neighbour(self, ifindex, dst, lladdr, new):
+        if new:
+            self._neighbours[(ifindex, dst)] = lladdr
+        else:
+            self._neighbours.pop((ifindex, dst), None)
+
+    # lookups
+
+    def get_interfaces(self):
+        with self._lock:
+            return list(self._link_names)
+
+    def get_link(self, ifname):
+        with self._lock:
+            return self._links.get(self._link_names.get(ifname))
+
+    def get_link_index(self, ifname):
+        """Return the ifindex of ifname, raising KeyError if missing."""
+        with self._lock:
+            return self._link_names[ifname]
+
+    def get_link_name(self, index):
+        """Return the name of the ifindex, raising KeyError if missing."""
+        with self._lock:
+            return self._links[index]['ifname']
+
+    def get_addresses(self, ifname):
+        """Return the (address, prefixlen) tuples set on ifname."""
+        with self._lock:
+            return list(self._addresses.get(self.get_link_index(ifname), ()))
+
+    def get_host_addresses_on_network(self, ifname, network):
+        """Return the /32 and /128 addresses of ifname within network."""
+        with self._lock:
+            host_addresses = self._host_addresses.get(
+                self._link_names.get(ifname))
+            if not host_addresses:
+                return []
+            return host_addresses.get_addresses(network)
+
+    def has_address(self, ifname, address, prefixlen):
+        with self._lock:
+            return (address, prefixlen) in self._addresses.get(
+                self._link_names.get(ifname), ())
+
+    def get_rules(self, tables):
+        with self._lock:
+            return [{'family': family, 'dst': dst, 'dst_len': dst_len,
+                     'table': table, 'priority': priority}
+                    for (family, dst, dst_len, table), priorities
+                    in self._rules.items() if table in tables
+                    for priority in priorities]
+
+    def has_rule(self, rule):
+        """Return if rule is there with its priority (RULE_PRIORITY by
+        default).
+        """
+        with self._lock:
+            return _rule_priority(rule) in self._rules.get(_rule_key(rule),
+                                                           ())
+
+    def get_rule_priorities(self, rule):
+        """Return the priorities rule is there with, whatever its own."""
+        with self._lock:
+            return set(self._rules.get(_rule_key(rule), ()))
+
+    def get_routes(self, tables):
+        with self._lock:
+            return [dict(route) for route in self._routes.values()
+                    if route['table'] in tables]
+
+    def get_host_routes_on_network(self, table, oif, network):
+        """Return the /32 and /128 routes through oif within network."""
+        with self._lock:
+            host_routes = self._host_routes.get((table, oif))
+            if not host_routes:
+                return []
+            return host_routes.get_addresses(network)
+
+    def has_route(self, route):
+        with self._lock:
+            return _route_key(route) in self._routes
+
+    def get_neighbour(self, ifindex, dst):
+        with self._lock:
+            return self._neighbours.get((ifindex, dst))
+
+    def get_neighbours(self, ifindex):
+        """Return the permanent neighbours on ifindex as {dst: lladdr}."""
+        with self._lock:
+            return {dst: lladdr
+                    for (index, dst), lladdr in self._neighbours.items()
+                    if index == ifindex}
+
+    # changes done by the helpers
+
+    def refresh_link(self, ifname):
+        with get_iproute() as iproute:
+            msgs = iproute.link('get', ifname=ifname)
+        with self._lock:
+            for msg in msgs:
+                self.apply(msg)
+
+    def del_link(self, ifname):
+        with self._lock:
+            index = self._link_names.get(ifname)
+            if index is not None:
+                self._on_link({'index': index}, False)
+
+    def add_address(self, ifname, address, prefixlen):
+        with self._lock:
+            self._update_address(self.get_link_index(ifname), address,
+                                 prefixlen, True)
+
+    def del_address(self, ifname, address, prefixlen):
+        with self._lock:
+            self._update_address(self.get_link_index(ifname), address,
+                                 prefixlen, False)
+
+    def add_rule(self, rule):
+        with self._lock:
+            self._update_rule(rule, True)
+
+    def del_rule(self, rule):
+        with self._lock:
+            self._update_rule(rule, False)
+
+    def add_route(self, route):
+        with self._lock:
+            self._update_route(route, True)
+
+    def del_route(self, route):
+        with self._lock:
+            self._update_route(route, False)
+
+    def add_neighbour(self, ifindex, dst, lladdr):
+        with self._lock:
+            self._update_neighbour(ifindex, dst, lladdr, True)
+
+    def del_neighbour(self, ifindex, dst):
+        with self._lock:
+            self._update_neighbour(ifindex, dst, None, False)
+
+
+_KERNEL_STATE = KernelState()
+
+
+def get_kernel_state():
+    _KERNEL_STATE.start()
+    return _KERNEL_STATE
+
+
+def close_netlink_context():
+    _KERNEL_STATE.stop()
+    _NETLINK.close()
+
+
 def get_ip_version(ip):
     return ipaddress.ip_address(ip.split('/')[0]).version
 
 
 def get_interfaces(filter_out=[]):
-    with pyroute2.NDB() as ndb:
-        return [iface.ifname for iface in ndb.interfaces
-                if iface.ifname not in filter_out]
+    return [ifname for ifname in get_kernel_state().get_interfaces()
+            if ifname not in filter_out]
 
 
 def get_interface_index(nic):
-    with pyroute2.NDB() as ndb:
-        return ndb.interfaces[nic]['index']
+    return get_kernel_state().get_link_index(nic)
+
+
+def get_interface_name(index):
+    return get_kernel_state().get_link_name(index)
+
+
+def get_interface_address(nic):
+    link = get_kernel_state().get_link(nic)
+    if link is None:
+        raise KeyError(nic)
+    return link['address']
+
+
+def _ensure_device(ifname, **kwargs):
+    device = get_kernel_state().get_link(ifname)
+    if device and device['state'] == 'up':
+        return
+    with get_iproute() as iproute:
+        if device:
+            iproute.link('set', index=device['index'], state='up')
+        else:
+            iproute.link('add', ifname=ifname, state='up', **kwargs)
+    get_kernel_state().refresh_link(ifname)
 
 
 def ensure_vrf(vrf_name, vrf_table):
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[vrf_name] as vrf:
-                if vrf['state'] != "up":
-                    vrf['state'] = 'up'
-        except KeyError:
-            ndb.interfaces.create(
-                kind="vrf", ifname=vrf_name, vrf_table=int(vrf_table)).set(
-                    'state', 'up').commit()
+    _ensure_device(vrf_name, kind="vrf", vrf_table=int(vrf_table))
 
 
 def ensure_bridge(bridge_name):
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[bridge_name] as bridge:
-                if bridge['state'] != "up":
-                    bridge['state'] = 'up'
-        except KeyError:
-            ndb.interfaces.create(
-                kind="bridge", ifname=bridge_name, br_stp_state=0).set(
-                    'state', 'up').commit()
+    _ensure_device(bridge_name, kind="bridge", br_stp_state=0)
 
 
 def ensure_vxlan(vxlan_name, vni, lo_ip):
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[vxlan_name] as vxlan:
-                if vxlan['state'] != "up":
-                    vxlan['state'] = 'up'
-        except KeyError:
-            # FIXME: Perhaps we need to set neigh_suppress on
-            ndb.interfaces.create(
-                kind="vxlan", ifname=vxlan_name, vxlan_id=int(vni),
-                vxlan_port=4789, vxlan_local=lo_ip, vxlan_learning=False).set(
-                    'state', 'up').commit()
+    # FIXME: Perhaps we need to set neigh_suppress on
+    _ensure_device(vxlan_name, kind="vxlan", vxlan_id=int(vni),
+                   vxlan_port=4789, vxlan_local=lo_ip, vxlan_learning=False)
 
 
 def set_master_for_device(device, master):
-    with pyroute2.NDB() as ndb:
-        # Check if already associated to the master, and associate it if not
-        if (ndb.interfaces[device].get('master') !=
-                ndb.interfaces[master]['index']):
-            with ndb.interfaces[device] as iface:
-                iface.set('master', ndb.interfaces[master]['index'])
+    kernel_state = get_kernel_state()
+    master_index = kernel_state.get_link_index(master)
+    # Check if already associated to the master, and associate it if not
+    if (kernel_state.get_link(device) or {}).get('master') != master_index:
+        with get_iproute() as iproute:
+            iproute.link('set', ifname=device, master=master_index)
+        kernel_state.refresh_link(device)
 
 
 def ensure_dummy_device(device):
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[device] as iface:
-                if iface['state'] != "up":
-                    iface['state'] = 'up'
-        except KeyError:
-            ndb.interfaces.create(
-                kind="dummy", ifname=device).set('state', 'up').commit()
+    _ensure_device(device, kind="dummy")
 
 
 def ensure_ovn_device(ovn_ifname, vrf_name):
@@ -109,131 +926,273 @@ def ensure_ovn_device(ovn_ifname, vrf_name):
 
 
 def delete_device(device):
+    kernel_state = get_kernel_state()
+    if not kernel_state.get_link(device):
+        LOG.debug("Interfaces {} already deleted.".format(device))
+        return
     try:
-        with pyroute2.NDB() as ndb:
-            ndb.interfaces[device].remove().commit()
-    except KeyError:
+        with get_iproute() as iproute:
+            iproute.link('del', ifname=device)
+    except pyroute2.netlink.exceptions.NetlinkError as e:
+        if e.code != errno.ENODEV:
+            raise
         LOG.debug("Interfaces {} already deleted.".format(device))
+    kernel_state.del_link(device)
 
 
-def ensure_routing_table_for_bridge(ovn_routing_tables, bridge):
-    # check a routing table with the bridge name exists on
-    # /etc/iproute2/rt_tables
-    regex = r'^[0-9]*[\s]*{}$'.format(bridge)
-    matching_table = [line.replace('\t', ' ')
-                      for line in open('/etc/iproute2/rt_tables')
-                      if re.findall(regex, line)]
-    if matching_table:
-        table_info = matching_table[0].strip().split()
-        ovn_routing_tables[table_info[1]] = int(table_info[0])
-        LOG.debug("Found routing table for {} with: {}".format(bridge,
-                  table_info))
-    # if not configured, add random number for the table
-    else:
-        LOG.debug(("Routing table for bridge {} not configured "
-                   "at /etc/iproute2/rt_tables").format(bridge))
-        regex = r'^[0-9]+[\s]*'
-        existing_routes = [int(line.replace('\t', ' ').split(' ')[0])
-                           for line in open('/etc/iproute2/rt_tables')
-                           if re.findall(regex, line)]
-        # pick a number between 1 and 252
-        try:
-            table_number = random.choice(
-                [x for x in range(1, 253) if x not in existing_routes])
-        except IndexError:
-            LOG.error(("No more routing tables available for bridge {} "
-                       "at /etc/iproute2/rt_tables").format(bridge))
-            sys.exit()
+class RoutingTables(object):
+    """Cached view of the rt_tables file.
 
-        with open('/etc/iproute2/rt_tables', 'a') as rt_tables:
-            rt_tables.write('{} {}\n'.format(table_number, bridge))
+    The file is only parsed again when a stat call shows it changed
+    (inode, mtime or size). The numbers for new tables are derived from a
+    hash of their names, probing for the next free one on collisions, so
+    a table gets the same number on every node and across restarts.
+    Updates are written to a temporary file that replaces the original
+    one while holding a lock on its directory.
+    """
+
+    # 0 (unspec) and 253-255 (default, main, local) are reserved
+    _FIRST_TABLE = 1
+    _LAST_TABLE = 252
+
+    def __init__(self, path=RT_TABLES_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._tables = {}
+
+    def _load(self, force=False):
+        try:
+            stat = os.stat(self._path)
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = ()
+        if version == self._version and not force:
+            return
+        tables = {}
+        if version:
+            with open(self._path) as f:
+                for line in f:
+                    fields = line.split('#', 1)[0].split()
+                    if len(fields) != 2:
+                        continue
+                    try:
+                        tables[fields[1]] = int(fields[0], 0)
+                    except ValueError:
+                        continue
+        self._tables = tables
+        self._version = version
+
+    def get(self, name):
+        with self._lock:
+            self._load()
+            return self._tables.get(name)
+
+    def _allocate(self, name):
+        used = set(self._tables.values())
+        size = self._LAST_TABLE - self._FIRST_TABLE + 1
+        start = zlib.crc32(name.encode()) % size
+        for i in range(size):
+            number = self._FIRST_TABLE + (start + i) % size
+            if number not in used:
+                return number
+        return None
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        directory = os.path.dirname(self._path)
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
 
-        ovn_routing_tables[bridge] = int(table_number)
-        LOG.debug("Added routing table for {} with number: {}".format(bridge,
-                  table_number))
+    def _write(self, line):
+        try:
+            with open(self._path) as f:
+                content = f.read()
+            mode = os.stat(self._path).st_mode & 0o777
+        except FileNotFoundError:
+            content, mode = '', 0o644
+        if content and not content.endswith('\n'):
+            content += '\n'
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(self._path), delete=False) as f:
+            f.write(content + line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(f.name, mode)
+        os.replace(f.name, self._path)
+
+    def ensure(self, name):
+        """Return the table number for name, adding it if not there yet.
+
+        Returns None if there are no free table numbers left.
+        """
+        with self._lock:
+            self._load()
+            if name in self._tables:
+                return self._tables[name]
+            with self._file_lock():
+                # another process may have updated the file meanwhile
+                self._load(force=True)
+                if name in self._tables:
+                    return self._tables[name]
+                number = self._allocate(name)
+                if number is None:
+                    return None
+                self._write('{} {}\n'.format(number, name))
+                LOG.debug("Added routing table for {} with number: "
+                          "{}".format(name, number))
+                self._load(force=True)
+                return number
+
+
+_RT_TABLES = RoutingTables()
+
+
+def ensure_routing_table_for_bridge(ovn_routing_tables, bridge,
+                                    table_steering=False):
+    """Ensure the routing table of the bridge and how traffic reaches it.
+
+    By default, the traffic is sent to the table by per destination ip
+    rules, and the table has a default route through the bridge. With
+    table_steering, a single rule per family sends all the traffic to the
+    table instead, so it cannot have a default route: only the routes to
+    the exposed destinations are there and the rest of the traffic falls
+    through to the next rules.
+    """
+    # check a routing table with the bridge name exists on
+    # /etc/iproute2/rt_tables, and add it if not
+    table_number = _RT_TABLES.ensure(bridge)
+    if table_number is None:
+        LOG.error(("No more routing tables available for bridge {} "
+                   "at {}").format(bridge, RT_TABLES_FILE))
+        sys.exit()
+    ovn_routing_tables[bridge] = table_number
 
     # add default route on that table if it does not exist
     extra_routes = []
-
-    with pyroute2.NDB() as ndb:
-        table_route_dsts = set([r.dst for r in ndb.routes.summary().filter(
-                                table=ovn_routing_tables[bridge])])
-        if not table_route_dsts:
-            ndb.routes.create(dst='default',
-                              oif=ndb.interfaces[bridge]['index'],
-                              table=ovn_routing_tables[bridge],
-                              scope=253,
-                              proto=3).commit()
-            ndb.routes.create(dst='default',
-                              oif=ndb.interfaces[bridge]['index'],
-                              table=ovn_routing_tables[bridge],
-                              family=AF_INET6,
-                              proto=3).commit()
+    table = ovn_routing_tables[bridge]
+    _retag_legacy_routes(bridge, table)
+    kernel_state = get_kernel_state()
+    oif = kernel_state.get_link_index(bridge)
+    current_default_routes = []
+    for route in kernel_state.get_routes([table]):
+        if not route['dst'] and route['oif'] == oif:
+            current_default_routes.append(route)
         else:
-            route_missing = True
-            route6_missing = True
-            for dst in table_route_dsts:
-                if not dst:  # default route
-                    try:
-                        route = ndb.routes[
-                            {'table': ovn_routing_tables[bridge],
-                             'dst': '',
-                             'family': AF_INET}]
-                        if (bridge ==
-                                ndb.interfaces[{'index': route['oif']}][
-                                    'ifname']):
-                            route_missing = False
-                        else:
-                            extra_routes.append(route)
-                    except KeyError:
-                        pass  # no ipv4 default rule
-                    try:
-                        route_6 = ndb.routes[
-                            {'table': ovn_routing_tables[bridge],
-                             'dst': '',
-                             'family': AF_INET6}]
-                        if (bridge ==
-                                ndb.interfaces[{'index': route_6['oif']}][
-                                    'ifname']):
-                            route6_missing = False
-                        else:
-                            extra_routes.append(route_6)
-                    except KeyError:
-                        pass  # no ipv6 default rule
-                else:
-                    extra_routes.append(
-                        ndb.routes[{'table': ovn_routing_tables[bridge],
-                                    'dst': dst}]
-                    )
-
-            if route_missing:
-                ndb.routes.create(dst='default',
-                                  oif=ndb.interfaces[bridge]['index'],
-                                  table=ovn_routing_tables[bridge],
-                                  scope=253,
-                                  proto=3).commit()
-            if route6_missing:
-                ndb.routes.create(dst='default',
-                                  oif=ndb.interfaces[bridge]['index'],
-                                  table=ovn_routing_tables[bridge],
-                                  family=AF_INET6,
-                                  proto=3).commit()
+            extra_routes.append(route)
+
+    default_routes = [
+        {'dst': 'default', 'oif': oif, 'table': table, 'scope': 253,
+         'family': AF_INET, 'proto': ROUTE_PROTO},
+        {'dst': 'default', 'oif': oif, 'table': table, 'family': AF_INET6,
+         'proto': ROUTE_PROTO}]
+    if table_steering:
+        # the default routes go first, or all the traffic would be sent
+        # through the bridge meanwhile
+        delete_ip_routes(current_default_routes)
+        ensure_table_rules(table)
+        return extra_routes
+    delete_table_rules(table)
+    default_route_families = set(route['family']
+                                 for route in current_default_routes)
+    requests = [(bridge, 'route', dict(route, command='add'))
+                for route in default_routes
+                if route.get('family', AF_INET) not in default_route_families]
+    if requests:
+        def _applied(method, kwargs):
+            route = dict(kwargs)
+            del route['command']
+            kernel_state.add_route(route)
+
+        _netlink_batch(requests,
+                       ignored_errors=(errno.EEXIST,), applied=_applied)
     return extra_routes
 
 
+def _retag_legacy_routes(bridge, table):
+    """Tag the routes previous versions added to table as the agent's.
+
+    They are replaced by the same routes with the agent protocol, so they
+    are reconciled as any other, and there are none left afterwards.
+    """
+    with get_rtnl() as rtnl_socket:
+        legacy_routes = _dump_routes(rtnl_socket, _LEGACY_ROUTE_PROTO,
+                                     table=table)
+    requests = []
+    for msg in legacy_routes:
+        route = {'family': msg['family'], 'table': table,
+                 'dst_len': msg['dst_len'], 'proto': ROUTE_PROTO,
+                 'scope': msg['scope'], 'type': msg['type']}
+        for key, attr in (('dst', 'RTA_DST'), ('oif', 'RTA_OIF'),
+                          ('gateway', 'RTA_GATEWAY'),
+                          ('priority', 'RTA_PRIORITY')):
+            value = msg.get_attr(attr)
+            if value is not None:
+                route[key] = value
+        LOG.debug("Tagging the route {} of a previous version".format(
+            route))
+        requests.append((bridge, 'route', dict(route, command='replace')))
+    if not requests:
+        return
+    kernel_state = get_kernel_state()
+
+    def _applied(method, kwargs):
+        route = dict(kwargs)
+        del route['command']
+        kernel_state.add_route(route)
+
+    _netlink_batch(requests, applied=_applied)
+
+
+def _get_table_rules(table):
+    return [{'table': table, 'family': family, 'priority': RULE_PRIORITY}
+            for family in (AF_INET, AF_INET6)]
+
+
+def ensure_table_rules(table):
+    """Ensure a rule sending all the IPv4 and IPv6 traffic to table."""
+    kernel_state = get_kernel_state()
+    requests = [(table, 'rule', dict(rule, command='add'))
+                for rule in _get_table_rules(table)
+                if not kernel_state.has_rule(rule)]
+    if not requests:
+        return
+
+    def _applied(method, kwargs):
+        rule = dict(kwargs)
+        del rule['command']
+        kernel_state.add_rule(rule)
+
+    _netlink_batch(requests, applied=_applied)
+
+
+def delete_table_rules(table):
+    kernel_state = get_kernel_state()
+    requests = [(table, 'rule', dict(rule, command='del'))
+                for rule in _get_table_rules(table)
+                if kernel_state.has_rule(rule)]
+    if not requests:
+        return
+
+    def _applied(method, kwargs):
+        rule = dict(kwargs)
+        del rule['command']
+        kernel_state.del_rule(rule)
+
+    _netlink_batch(requests, ignored_errors=(errno.ENOENT,),
+                   applied=_applied)
+
+
 def ensure_vlan_device_for_network(bridge, vlan_tag):
     vlan_device_name = '{}.{}'.format(bridge, vlan_tag)
 
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[vlan_device_name] as iface:
-                if iface['state'] != "up":
-                    iface['state'] = 'up'
-        except KeyError:
-            ndb.interfaces.create(
-                kind="vlan", ifname=vlan_device_name, vlan_id=vlan_tag,
-                link=ndb.interfaces[bridge]['index']).set('state',
-                                                          'up').commit()
+    _ensure_device(vlan_device_name, kind="vlan", vlan_id=vlan_tag,
+                   link=get_kernel_state().get_link_index(bridge))
 
     ipv4_flag = "net.ipv4.conf.{}/{}.proxy_arp".format(bridge, vlan_tag)
     _set_kernel_flag(ipv4_flag, 1)
@@ -246,7 +1205,27 @@ def delete_vlan_device_for_network(bridge, vlan_tag):
     delete_device(vlan_device_name)
 
 
+def _get_kernel_flag_path(flag):
+    # sysctl uses dots as separators and slashes for the dots in the names,
+    # e.g. net.ipv4.conf.br-ex/100.proxy_arp
+    return os.path.join('/proc/sys', *[part.replace('/', '.')
+                                       for part in flag.split('.')])
+
+
 def _set_kernel_flag(flag, value):
+    path = _get_kernel_flag_path(flag)
+    value = str(value)
+    try:
+        with open(path) as f:
+            if f.read().strip() == value:
+                return
+        with open(path, 'w') as f:
+            f.write(value)
+        return
+    except (IOError, OSError) as e:
+        LOG.debug("Unable to set {} through {}, using sysctl: {}".format(
+            flag, path, e))
+
     command = ["sysctl", "-w", "{}={}".format(flag, value)]
     try:
         return processutils.execute(*command, run_as_root=True)
@@ -256,346 +1235,703 @@ def _set_kernel_flag(flag, value):
         raise
 
 
+def _get_host_prefixlen(ip):
+    if get_ip_version(ip) == constants.IP_VERSION_6:
+        return 128
+    return 32
+
+
 def get_exposed_ips(nic):
-    exposed_ips = []
-    with pyroute2.NDB() as ndb:
-        exposed_ips = [ip.address
-                       for ip in ndb.interfaces[nic].ipaddr.summary()
-                       if ip.prefixlen == 32 or ip.prefixlen == 128]
-    return exposed_ips
+    return [address
+            for address, prefixlen in get_kernel_state().get_addresses(nic)
+            if prefixlen == 32 or prefixlen == 128]
 
 
 def get_nic_ip(nic, ip_version):
     prefix = 32
     if ip_version == constants.IP_VERSION_6:
         prefix = 128
-    exposed_ips = []
-    with pyroute2.NDB() as ndb:
-        exposed_ips = [ip.address
-                       for ip in ndb.interfaces[nic].ipaddr.summary().filter(
-                           prefixlen=prefix)]
-    return exposed_ips
+    return [address
+            for address, prefixlen in get_kernel_state().get_addresses(nic)
+            if prefixlen == prefix]
 
 
 def get_exposed_ips_on_network(nic, network):
-    exposed_ips = []
-    with pyroute2.NDB() as ndb:
-        exposed_ips = [ip.address
-                       for ip in ndb.interfaces[nic].ipaddr.summary()
-                       if ((ip.prefixlen == 32 or ip.prefixlen == 128) and
-                           ipaddress.ip_address(ip.address) in network)]
-    return exposed_ips
+    return get_kernel_state().get_host_addresses_on_network(nic, network)
+
+
+def get_exposed_routes(nic, table):
+    kernel_state = get_kernel_state()
+    oif = kernel_state.get_link_index(nic)
+    return [route['dst'] for route in kernel_state.get_routes([table])
+            if (route['oif'] == oif and route['dst'] and
+                not route['gateway'] and
+                route['type'] == rtnl.rt_type['unicast'] and
+                route['dst_len'] == _get_host_prefixlen(route['dst']))]
+
+
+def get_exposed_routes_on_network(nic, table, network):
+    kernel_state = get_kernel_state()
+    return kernel_state.get_host_routes_on_network(
+        table, kernel_state.get_link_index(nic), network)
 
 
 def get_ovn_ip_rules(routing_table):
-    # get the rules pointing to ovn bridges
+    # get the rules pointing to ovn bridges, whatever their priority
     ovn_ip_rules = {}
-    with pyroute2.NDB() as ndb:
-        rules_info = [(rule.table,
-                       "{}/{}".format(rule.dst, rule.dst_len),
-                       rule.family) for rule in ndb.rules.dump()
-                      if rule.table in routing_table]
-        for table, dst, family in rules_info:
-            ovn_ip_rules[dst] = {'table': table, 'family': family}
+    for rule in get_kernel_state().get_rules(routing_table):
+        if not rule['dst']:
+            continue
+        dst = "{}/{}".format(rule['dst'], rule['dst_len'])
+        rule_info = ovn_ip_rules.setdefault(
+            dst, {'table': rule['table'], 'family': rule['family'],
+                  'priorities': set()})
+        rule_info['priorities'].add(rule['priority'])
     return ovn_ip_rules
 
 
 def delete_exposed_ips(ips, nic):
-    with pyroute2.NDB() as ndb:
-        for ip in ips:
-            address = '{}/32'.format(ip)
-            if get_ip_version(ip) == constants.IP_VERSION_6:
-                address = '{}/128'.format(ip)
-            try:
-                ndb.interfaces[nic].ipaddr[address].remove().commit()
-            except KeyError:
-                LOG.debug("IP address {} already removed from nic {}.".format(
-                    ip, nic))
+    del_ips_from_dev_batch(nic, ips)
 
 
 def delete_ip_rules(ip_rules):
-    with pyroute2.NDB() as ndb:
-        for rule_ip, rule_info in ip_rules.items():
-            rule = {'dst': rule_ip.split("/")[0],
-                    'dst_len': rule_ip.split("/")[1],
-                    'table': rule_info['table'],
-                    'family': rule_info['family']}
-            try:
-                with ndb.rules[rule] as r:
-                    r.remove()
-            except KeyError:
-                LOG.debug("Rule {} already deleted".format(rule))
-            except pyroute2.netlink.exceptions.NetlinkError:
-                # FIXME: There is a issue with NDB and ip rules deletion:
-                # https://github.com/svinota/pyroute2/issues/771
-                LOG.debug("This should not happen, skipping")
-
-
-def delete_bridge_ip_routes(routing_tables, routing_tables_routes,
-                            extra_routes):
-    with pyroute2.NDB() as ndb:
-        for bridge, routes_info in routing_tables_routes.items():
-            if not extra_routes[bridge]:
+    kernel_state = get_kernel_state()
+    requests = []
+    for rule_ip, rule_info in ip_rules.items():
+        rule = {'dst': rule_ip.split("/")[0],
+                'dst_len': int(rule_ip.split("/")[1]),
+                'table': rule_info['table'],
+                'family': rule_info['family']}
+        priorities = kernel_state.get_rule_priorities(rule)
+        if not priorities:
+            LOG.debug("Rule {} already deleted".format(rule))
+            continue
+        # including the ones with other priorities, from previous versions
+        requests.extend((rule_ip, 'rule',
+                         dict(rule, priority=priority, command='del'))
+                        for priority in sorted(priorities))
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        rule = dict(kwargs)
+        del rule['command']
+        kernel_state.del_rule(rule)
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.ENOENT,),
+                          applied=_applied)
+
+
+class _NexthopMsg(netlink.nlmsg):
+    """Nexthop object message (struct nhmsg), unknown to pyroute2 0.6."""
+
+    prefix = 'NHA_'
+    fields = (('family', 'B'),
+              ('scope', 'B'),
+              ('protocol', 'B'),
+              ('resvd', 'B'),
+              ('flags', 'I'))
+    nla_map = (('NHA_UNSPEC', 'none'),
+               ('NHA_ID', 'uint32'),
+               ('NHA_GROUP', 'hex'),
+               ('NHA_GROUP_TYPE', 'uint16'),
+               ('NHA_BLACKHOLE', 'flag'),
+               ('NHA_OIF', 'uint32'),
+               ('NHA_GATEWAY', 'ipaddr'),
+               ('NHA_ENCAP_TYPE', 'uint16'),
+               ('NHA_ENCAP', 'hex'),
+               ('NHA_GROUPS', 'flag'),
+               ('NHA_MASTER', 'uint32'))
+
+
+class _NexthopRouteMsg(rtmsg.rtmsg_base, netlink.nlmsg):
+    """Route message with the RTA_NH_ID attribute of the nexthop used.
+
+    Not an rtmsg subclass, as pyroute2 keeps the compiled attributes
+    table of a message class in a class attribute, which would be
+    inherited from rtmsg (without RTA_NH_ID) once it is used.
+    """
+
+    nla_map = rtmsg.rtmsg_base.nla_map + (
+        ('RTA_PAD', 'hex'),
+        ('RTA_UID', 'uint32'),
+        ('RTA_TTL_PROPAGATE', 'uint8'),
+        ('RTA_IP_PROTO', 'uint8'),
+        ('RTA_SPORT', 'uint16'),
+        ('RTA_DPORT', 'uint16'),
+        ('RTA_NH_ID', 'uint32'))
+
+
+def _dump_nexthops(rtnl_socket):
+    msg = _NexthopMsg()
+    msg['family'] = AF_UNSPEC
+    return rtnl_socket.dump(msg, RTM_GETNEXTHOP)
+
+
+def _get_nexthop_owner(route, owner=None):
+    """Return the owner of the nexthop route is programmed through.
+
+    Unless given, e.g. the cr-lrp the route goes through, the routes
+    through a gateway are owned by the gateway on their table, and the
+    rest by their table and device, i.e. the provider network.
+    """
+    if owner is not None:
+        return owner
+    return (int(route['table']), route.get('gateway') or route['oif'])
+
+
+class Nexthops(object):
+    """Kernel nexthop objects the bridge routes are programmed through.
+
+    There is one nexthop per owner and family: a provider network (bridge
+    table and device) or a gateway, e.g. a cr-lrp, so all the routes
+    through it point to the same object and a sync only has to check a
+    few of them. When the device or gateway of an owner changes its
+    nexthop is replaced in place, keeping its id, which moves all its
+    routes at once. The ids are allocated within a range of their own,
+    and the unowned nexthops found on the kernel (e.g. after a restart)
+    are adopted by the owners matching them.
+
+    pyroute2 0.6 knows nothing of the nexthop objects, so their messages
+    are built here and sent through the shared RtnlSocket.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nexthops = None  # {id: (oif, gateway, family)}
+        self._owners = {}  # {(owner, family): id}
+
+    def _load(self):
+        with get_rtnl() as rtnl_socket:
+            msgs = _dump_nexthops(rtnl_socket)
+        self._nexthops = {}
+        for msg in msgs:
+            nexthop_id = msg.get_attr('NHA_ID')
+            if (nexthop_id is None or
+                    not (NEXTHOP_ID_BASE <= nexthop_id <
+                         NEXTHOP_ID_BASE + NEXTHOP_IDS)):
                 continue
-            for route_info in routes_info:
-                oif = ndb.interfaces[bridge]['index']
-                if route_info['vlan']:
-                    vlan_device_name = '{}.{}'.format(bridge,
-                                                      route_info['vlan'])
-                    oif = ndb.interfaces[vlan_device_name]['index']
-                if 'gateway' in route_info['route'].keys():  # subnet route
-                    possible_matchings = [
-                        r for r in extra_routes[bridge]
-                        if (r['dst'] == route_info['route']['dst'] and
-                            r['dst_len'] == route_info['route']['dst_len'] and
-                            r['gateway'] == route_info['route']['gateway'])]
-                else:  # cr-lrp
-                    possible_matchings = [
-                        r for r in extra_routes[bridge]
-                        if (r['dst'] == route_info['route']['dst'] and
-                            r['dst_len'] == route_info['route']['dst_len'] and
-                            r['oif'] == oif)]
-                for r in possible_matchings:
-                    extra_routes[bridge].remove(r)
-
-        for bridge, routes in extra_routes.items():
-            for route in routes:
-                r_info = {'dst': route['dst'],
-                          'dst_len': route['dst_len'],
-                          'family': route['family'],
-                          'oif': route['oif'],
-                          'gateway': route['gateway'],
-                          'table': routing_tables[bridge]}
-                try:
-                    with ndb.routes[r_info] as r:
-                        r.remove()
-                except KeyError:
-                    LOG.debug("Route already deleted: {}".format(route))
+            self._nexthops[nexthop_id] = (msg.get_attr('NHA_OIF'),
+                                          msg.get_attr('NHA_GATEWAY'),
+                                          msg['family'])
+
+    def _adopt(self, nexthop):
+        owned_ids = set(self._owners.values())
+        for nexthop_id, current in self._nexthops.items():
+            if current == nexthop and nexthop_id not in owned_ids:
+                return nexthop_id
+        return None
+
+    def _allocate(self):
+        used_ids = set(self._nexthops) | set(self._owners.values())
+        for nexthop_id in range(NEXTHOP_ID_BASE,
+                                NEXTHOP_ID_BASE + NEXTHOP_IDS):
+            if nexthop_id not in used_ids:
+                return nexthop_id
+        raise RuntimeError("No more nexthop ids available")
+
+    @staticmethod
+    def _replace(nexthop_id, nexthop):
+        oif, gateway, family = nexthop
+        msg = _NexthopMsg()
+        msg['family'] = family
+        msg['protocol'] = ROUTE_PROTO
+        msg['attrs'] = [('NHA_ID', nexthop_id), ('NHA_OIF', oif)]
+        if gateway:
+            # the gateway is only reachable through the bridge table,
+            # not the main one the nexthop would be validated against
+            msg['flags'] = RTNH_F_ONLINK
+            msg['attrs'].append(('NHA_GATEWAY', gateway))
+        with get_rtnl() as rtnl_socket:
+            rtnl_socket.request(msg, RTM_NEWNEXTHOP,
+                                netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE)
+
+    def ensure(self, owner, oif, gateway=None, family=AF_INET):
+        """Return the id of the owner nexthop, creating it if needed.
+
+        If the owner nexthop has another device or gateway it is replaced
+        with the same id.
+        """
+        with self._lock:
+            if self._nexthops is None:
+                self._load()
+            key = (owner, family)
+            nexthop = (oif, gateway, family)
+            nexthop_id = self._owners.get(key)
+            if nexthop_id is None:
+                nexthop_id = self._adopt(nexthop) or self._allocate()
+            if self._nexthops.get(nexthop_id) != nexthop:
+                self._replace(nexthop_id, nexthop)
+                self._nexthops[nexthop_id] = nexthop
+            self._owners[key] = nexthop_id
+            return nexthop_id
+
+    def invalidate(self):
+        """Reload the nexthops, e.g. the kernel removed some with a device."""
+        with self._lock:
+            self._nexthops = None
+
+    def sync(self, used_nexthops):
+        """Delete the nexthops not in used_nexthops, a set of ids.
+
+        The kernel deletes the routes using a nexthop with it, so this is
+        to be called once the routes are synced.
+        """
+        with self._lock:
+            if self._nexthops is None:
+                self._load()
+            extra_nexthops = [nexthop_id for nexthop_id in self._nexthops
+                              if nexthop_id not in used_nexthops]
+            requests = []
+            for nexthop_id in extra_nexthops:
+                msg = _NexthopMsg()
+                msg['family'] = AF_UNSPEC
+                msg['attrs'] = [('NHA_ID', nexthop_id)]
+                requests.append(_encode(msg, RTM_DELNEXTHOP))
+            with get_rtnl() as rtnl_socket:
+                codes = rtnl_socket.batch(requests)
+            for nexthop_id, code in zip(extra_nexthops, codes):
+                if code not in (0, errno.ENOENT):
+                    LOG.warning("Error deleting the nexthop {}: {}".format(
+                        nexthop_id, os.strerror(code)))
+                    continue
+                del self._nexthops[nexthop_id]
+            self._owners = {key: nexthop_id
+                            for key, nexthop_id in self._owners.items()
+                            if nexthop_id in used_nexthops}
+            return len(extra_nexthops)
+
+
+def _get_nexthop_route_msg(route, nexthop_id=None):
+    table = int(route['table'])
+    msg = _NexthopRouteMsg()
+    msg['family'] = route.get('family', AF_INET)
+    msg['dst_len'] = int(route.get('dst_len') or 0)
+    # the table field only fits the ids below 256, RTA_TABLE has them all
+    msg['table'] = table if table < 256 else _RT_TABLE_COMPAT
+    msg['attrs'] = [('RTA_TABLE', table)]
+    if route.get('dst') and route['dst'] != 'default':
+        msg['attrs'].append(('RTA_DST', route['dst']))
+    if nexthop_id is None:
+        # any scope, type and protocol, to delete it
+        msg['scope'] = rtnl.rt_scope['nowhere']
+        return msg
+    msg['proto'] = int(route.get('proto', ROUTE_PROTO))
+    msg['type'] = rtnl.rt_type['unicast']
+    msg['attrs'].append(('RTA_NH_ID', nexthop_id))
+    return msg
+
+
+def _add_nexthop_routes(nexthops, routes, owners=None):
+    """Add (or replace) the routes through the nexthops of their owners.
+
+    owners is a list with the nexthop owner of each route, if not the
+    default one (see _get_nexthop_owner). Returns the routes that failed.
+    """
+    kernel_state = get_kernel_state()
+    owners = owners or [None] * len(routes)
+    failed_routes = []
+    requests = []
+    for route, owner in zip(routes, owners):
+        try:
+            nexthop_id = nexthops.ensure(
+                _get_nexthop_owner(route, owner), route['oif'],
+                gateway=route.get('gateway'),
+                family=route.get('family', AF_INET))
+        except pyroute2.netlink.exceptions.NetlinkError as e:
+            LOG.warning("Error adding the nexthop of {}: {}".format(
+                route, e))
+            failed_routes.append(route)
+            continue
+        requests.append((route, _get_nexthop_route_msg(route, nexthop_id)))
+    with get_rtnl() as rtnl_socket:
+        codes = rtnl_socket.batch([
+            _encode(msg, rtnl.RTM_NEWROUTE,
+                    netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE)
+            for _route, msg in requests])
+    for (route, _msg), code in zip(requests, codes):
+        if code:
+            LOG.warning("Error adding the route {}: {}".format(
+                route, os.strerror(code)))
+            failed_routes.append(route)
+            continue
+        kernel_state.add_route(route)
+    if failed_routes:
+        # the kernel may have removed some nexthops with their device
+        nexthops.invalidate()
+    return failed_routes
+
+
+def _del_nexthop_routes(routes):
+    """Delete the routes using the nexthop objects.
+
+    They are matched by their destination and table only, as the kernel
+    does not match the routes using nexthop objects by device or gateway.
+    """
+    kernel_state = get_kernel_state()
+    with get_rtnl() as rtnl_socket:
+        codes = rtnl_socket.batch([
+            _encode(_get_nexthop_route_msg(route), rtnl.RTM_DELROUTE)
+            for route in routes])
+    for route, code in zip(routes, codes):
+        if code not in (0, errno.ESRCH, errno.ENOENT):
+            LOG.warning("Error deleting the route {}: {}".format(
+                route, os.strerror(code)))
+            continue
+        kernel_state.del_route(route)
+
+
+class RouteRegistry(object):
+    """Routes the agent added to the bridge (or VRF) routing tables.
+
+    The routes are indexed by (table, family, dst, dst_len, gateway or
+    oif), which is what tells two routes apart for the agent: subnet
+    routes are matched by their gateway and the rest by their device. It
+    replaces the {'br-ex': [{'vlan': vlan, 'route': route}]} lists, so
+    adding, removing and checking a route, as well as finding the stale
+    routes on a table, do not need to scan all the known routes.
+
+    If nexthops (a Nexthops instance) is given, the routes are programmed
+    through kernel nexthop objects instead of with their device and
+    gateway inline, the one of the owner given when adding them (if not
+    the default one, see _get_nexthop_owner).
+    """
+
+    def __init__(self, nexthops=None):
+        self.nexthops = nexthops
+        self._routes = {}  # {key: (dev, vlan, route)}
+        self._owners = {}  # {key: owner}
+        self._dsts = collections.Counter()  # {(dev, dst, dst_len): count}
+
+    @staticmethod
+    def _get_key(route):
+        dst = route.get('dst') or ''
+        if dst == 'default':
+            dst = ''
+        return (int(route['table']), route.get('family', AF_INET), dst,
+                int(route.get('dst_len') or 0),
+                route.get('gateway') or route.get('oif'))
+
+    def add(self, dev, route, vlan=None, owner=None):
+        key = self._get_key(route)
+        if owner is not None:
+            self._owners[key] = owner
+        if key in self._routes:
+            return
+        self._routes[key] = (dev, vlan, route)
+        self._dsts[(dev, route['dst'], int(route['dst_len']))] += 1
+
+    def remove(self, route):
+        """Forget about route, returning False if it was not there."""
+        key = self._get_key(route)
+        self._owners.pop(key, None)
+        entry = self._routes.pop(key, None)
+        if entry is None:
+            return False
+        dev, _, route = entry
+        dst = (dev, route['dst'], int(route['dst_len']))
+        self._dsts[dst] -= 1
+        if not self._dsts[dst]:
+            del self._dsts[dst]
+        return True
+
+    def __contains__(self, route):
+        return self._get_key(route) in self._routes
+
+    def __len__(self):
+        return len(self._routes)
+
+    def has_dst(self, dev, dst, dst_len):
+        return (dev, dst, int(dst_len)) in self._dsts
+
+    def get_owner(self, route):
+        """Return the nexthop owner route was added with, if any."""
+        return self._owners.get(self._get_key(route))
+
+    def get_routes(self, dev=None):
+        return [route for route_dev, _, route in self._routes.values()
+                if dev is None or route_dev == dev]
+
+    def get_vlan_devices(self):
+        return set('{}.{}'.format(dev, vlan)
+                   for dev, vlan, _ in self._routes.values() if vlan)
+
+    def get_stale(self, routes):
+        """Return the routes, e.g. from a table, that are not known."""
+        return [route for route in routes if route not in self]
+
+
+def delete_bridge_ip_routes(routing_tables, route_registry, extra_routes):
+    delete_ip_routes([dict(route, table=routing_tables[bridge])
+                      for bridge, routes in extra_routes.items()
+                      for route in route_registry.get_stale(routes)])
 
 
 def delete_routes_from_table(table):
-    with pyroute2.NDB() as ndb:
-        # FIXME: problem in pyroute2 removing routes with local (254) scope
-        table_routes = [r for r in ndb.routes.dump().filter(table=table)
-                        if r.scope != 254 and r.proto != 186]
-        for route in table_routes:
-            try:
-                with ndb.routes[route] as r:
-                    r.remove()
-            except KeyError:
-                LOG.debug("Route already deleted: {}".format(route))
+    # only the routes the agent added are mirrored, not the local or bgp
+    # ones
+    delete_ip_routes(get_kernel_state().get_routes([table]))
 
 
 def get_routes_on_tables(table_ids):
-    with pyroute2.NDB() as ndb:
-        # NOTE: skip bgp routes (proto 186)
-        return [r for r in ndb.routes.dump()
-                if r.table in table_ids and r.dst != '' and r.proto != 186]
+    return [r for r in get_kernel_state().get_routes(table_ids)
+            if r['dst'] != '']
+
+
+def _get_route_del_request(route):
+    """Return the IPRoute kwargs deleting route, whatever its scope and
+    protocol.
+    """
+    dst = route.get('dst') or ''
+    request = {'command': 'del',
+               'family': route.get('family', AF_INET),
+               'table': int(route['table']),
+               'dst': '' if dst == 'default' else dst,
+               'dst_len': int(route.get('dst_len') or 0),
+               'oif': route.get('oif'),
+               'scope': rtnl.rt_scope['nowhere']}
+    if route.get('gateway'):
+        request['gateway'] = route['gateway']
+    return request
 
 
 def delete_ip_routes(routes):
-    with pyroute2.NDB() as ndb:
-        for route in routes:
-            r_info = {'dst': route['dst'],
-                      'dst_len': route['dst_len'],
-                      'family': route['family'],
-                      'oif': route['oif'],
-                      'gateway': route['gateway'],
-                      'table': route['table']}
-            try:
-                with ndb.routes[r_info] as r:
-                    r.remove()
-            except KeyError:
-                LOG.debug("Route already deleted: {}".format(route))
+    kernel_state = get_kernel_state()
+    requests = []
+    for route in routes:
+        if not kernel_state.has_route(route):
+            LOG.debug("Route already deleted: {}".format(route))
+            continue
+        requests.append((route['dst'], 'route',
+                         _get_route_del_request(route)))
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        route = dict(kwargs)
+        del route['command']
+        kernel_state.del_route(route)
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.ESRCH,),
+                          applied=_applied)
+
+
+def _get_ndp_proxy_ip(ip):
+    return str(ipaddress.IPv6Network(ip, strict=False).network_address)
+
+
+def get_ndp_proxies(dev, vlan=None):
+    """Return the IPv6 addresses with an NDP proxy entry on the device.
+
+    The kernel does not notify about the proxy entries, so they are not
+    part of the kernel state mirror and this is a (filtered) dump.
+    """
+    dev_name = "{}.{}".format(dev, vlan) if vlan else dev
+    ifindex = get_kernel_state().get_link_index(dev_name)
+    with get_rtnl() as rtnl_socket:
+        # only the proxy entries are dumped when this is the only flag
+        entries = _dump_neighbours(rtnl_socket, ifindex, family=AF_INET6,
+                                   flags=ndmsg.NTF_PROXY)
+    return [entry.get_attr('NDA_DST') for entry in entries]
+
+
+def _ndp_proxies_batch(command, ips, dev, vlan=None, ignored_errors=()):
+    dev_name = "{}.{}".format(dev, vlan) if vlan else dev
+    ifindex = get_kernel_state().get_link_index(dev_name)
+    requests = [(ip, 'neigh', {'command': command,
+                               'dst': _get_ndp_proxy_ip(ip),
+                               'ifindex': ifindex,
+                               'family': AF_INET6,
+                               'flags': ndmsg.NTF_PROXY})
+                for ip in ips]
+    return _netlink_batch(requests,
+                          ignored_errors=ignored_errors)
+
+
+def add_ndp_proxies(ips, dev, vlan=None):
+    """Add an NDP proxy entry for the network of each ip in a batch."""
+    return _ndp_proxies_batch('add', ips, dev, vlan=vlan,
+                              ignored_errors=(errno.EEXIST,))
+
+
+def del_ndp_proxies(ips, dev, vlan=None):
+    """Delete the NDP proxy entry for the network of each ip in a batch."""
+    return _ndp_proxies_batch('del', ips, dev, vlan=vlan,
+                              ignored_errors=(errno.ENOENT,))
 
 
 def add_ndp_proxy(ip, dev, vlan=None):
-    # FIXME(ltomasbo): This should use pyroute instead but I didn't find
-    # out how
-    net_ip = str(ipaddress.IPv6Network(ip, strict=False).network_address)
-    dev_name = dev
-    if vlan:
-        dev_name = "{}.{}".format(dev, vlan)
-    command = ["ip", "-6", "nei", "add", "proxy", net_ip, "dev", dev_name]
-    try:
-        return processutils.execute(*command, run_as_root=True)
-    except Exception as e:
-        LOG.error("Unable to execute {}. Exception: {}".format(
-                  command, e))
-        raise
+    return add_ndp_proxies([ip], dev, vlan=vlan)
 
 
 def del_ndp_proxy(ip, dev, vlan=None):
-    # FIXME(ltomasbo): This should use pyroute instead but I didn't find
-    # out how
-    net_ip = str(ipaddress.IPv6Network(ip, strict=False).network_address)
-    dev_name = dev
-    if vlan:
-        dev_name = "{}.{}".format(dev, vlan)
-    command = ["ip", "-6", "nei", "del", "proxy", net_ip, "dev", dev_name]
-    try:
-        return processutils.execute(*command, run_as_root=True)
-    except Exception as e:
-        if "No such file or directory" in e.stderr:
-            # Already deleted
-            return
-        LOG.error("Unable to execute {}. Exception: {}".format(
-                  command, e))
-        raise
+    return del_ndp_proxies([ip], dev, vlan=vlan)
+
+
+def sync_ndp_proxies(ips, dev, vlan=None, delete=True):
+    """Make the networks of ips the only NDP proxy entries on the device.
+
+    If delete is False the extra entries are left in place. Returns the
+    number of entries added and removed.
+    """
+    proxy_ips = set(_get_ndp_proxy_ip(ip) for ip in ips)
+    current_proxy_ips = set(get_ndp_proxies(dev, vlan=vlan))
+    missing_ips = proxy_ips - current_proxy_ips
+    extra_ips = current_proxy_ips - proxy_ips if delete else set()
+    if missing_ips:
+        add_ndp_proxies(missing_ips, dev, vlan=vlan)
+    if extra_ips:
+        del_ndp_proxies(extra_ips, dev, vlan=vlan)
+    return len(missing_ips), len(extra_ips)
 
 
 def add_ips_to_dev(nic, ips, clear_local_route_at_table=False):
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.interfaces[nic] as iface:
-                for ip in ips:
-                    address = '{}/32'.format(ip)
-                    if get_ip_version(ip) == constants.IP_VERSION_6:
-                        address = '{}/128'.format(ip)
-                    iface.add_ip(address)
-        except KeyError:
-            # NDB raises KeyError: 'object exists'
-            # if the ip is already added
-            pass
+    add_ips_to_dev_batch(nic, ips)
 
     if clear_local_route_at_table:
-        with pyroute2.NDB() as ndb:
-            for ip in ips:
-                route = {'table': clear_local_route_at_table,
-                         'proto': 2,
-                         'scope': 254,
-                         'dst': ip}
-                try:
-                    with ndb.routes[route] as r:
-                        r.remove()
-                except (KeyError, ValueError):
-                    LOG.debug("Local route already deleted: {}".format(route))
+        requests = []
+        for ip in ips:
+            mask = _get_host_prefixlen(ip)
+            requests.append((ip, 'route', {
+                'command': 'del', 'table': int(clear_local_route_at_table),
+                'proto': rtnl.rt_proto['kernel'],
+                'scope': rtnl.rt_scope['host'],
+                'type': rtnl.rt_type['local'], 'dst': ip, 'dst_len': mask,
+                'family': AF_INET6 if mask == 128 else AF_INET}))
+        _netlink_batch(requests, ignored_errors=(errno.ESRCH,))
 
 
 def del_ips_from_dev(nic, ips):
-    with pyroute2.NDB() as ndb:
-        with ndb.interfaces[nic] as iface:
-            for ip in ips:
-                address = '{}/32'.format(ip)
-                if get_ip_version(ip) == constants.IP_VERSION_6:
-                    address = '{}/128'.format(ip)
-                iface.del_ip(address)
+    del_ips_from_dev_batch(nic, ips)
 
 
-def add_ip_rule(ip, table, dev=None, lladdr=None):
+def _get_rule(ip, table):
     ip_version = get_ip_version(ip)
     ip_info = ip.split("/")
 
     if len(ip_info) == 1:
-        rule = {'dst': ip_info[0], 'table': table, 'dst_len': 32}
+        rule = {'dst': ip_info[0], 'table': table, 'dst_len': 32,
+                'priority': RULE_PRIORITY}
         if ip_version == constants.IP_VERSION_6:
             rule['dst_len'] = 128
             rule['family'] = AF_INET6
     elif len(ip_info) == 2:
-        rule = {'dst': ip_info[0], 'table': table, 'dst_len': int(ip_info[1])}
+        rule = {'dst': ip_info[0], 'table': table, 'dst_len': int(ip_info[1]),
+                'priority': RULE_PRIORITY}
         if ip_version == constants.IP_VERSION_6:
             rule['family'] = AF_INET6
     else:
         LOG.error("Invalid ip: {}".format(ip))
+        return None
+    return rule
+
+
+def add_ip_rule(ip, table, dev=None, lladdr=None):
+    rule = _get_rule(ip, table)
+    if not rule:
         return
 
-    with pyroute2.NDB() as ndb:
-        try:
-            ndb.rules[rule]
-        except KeyError:
-            LOG.debug("Creating ip rule with: {}".format(rule))
-            ndb.rules.create(rule).commit()
+    kernel_state = get_kernel_state()
+    if not kernel_state.has_rule(rule):
+        LOG.debug("Creating ip rule with: {}".format(rule))
+        _netlink_request(ip, 'rule', dict(rule, command='add'))
+        kernel_state.add_rule(rule)
+    legacy_requests = _get_legacy_rule_requests(ip, rule)
+    if legacy_requests:
+        def _applied(method, kwargs):
+            kernel_state.del_rule(kwargs)
+
+        _netlink_batch(legacy_requests,
+                       ignored_errors=(errno.ENOENT,), applied=_applied)
 
     # FIXME: There is no support for creating neighbours in NDB
     # So we are using iproute here
     if lladdr:
         ip_version = get_ip_version(ip)
-        with pyroute2.IPRoute() as iproute:
-            # This is doing something like:
-            # sudo ip nei replace 172.24.4.69
-            # lladdr fa:16:3e:d3:5d:7b dev br-ex nud permanent
-            network_bridge_if = iproute.link_lookup(ifname=dev)[0]
-            if ip_version == constants.IP_VERSION_6:
-                iproute.neigh('set',
-                              dst=ip,
-                              lladdr=lladdr,
-                              family=AF_INET6,
-                              ifindex=network_bridge_if,
-                              state=ndmsg.states['permanent'])
-            else:
-                iproute.neigh('set',
-                              dst=ip,
-                              lladdr=lladdr,
-                              ifindex=network_bridge_if,
-                              state=ndmsg.states['permanent'])
+        network_bridge_if = kernel_state.get_link_index(dev)
+        if kernel_state.get_neighbour(network_bridge_if, ip) == lladdr:
+            return
+        # This is doing something like:
+        # sudo ip nei replace 172.24.4.69
+        # lladdr fa:16:3e:d3:5d:7b dev br-ex nud permanent
+        _netlink_request(ip, 'neigh', {
+            'command': 'set', 'dst': ip, 'lladdr': lladdr,
+            'family': (AF_INET6 if ip_version == constants.IP_VERSION_6
+                       else AF_INET),
+            'ifindex': network_bridge_if,
+            'state': ndmsg.states['permanent']})
+        kernel_state.add_neighbour(network_bridge_if, ip, lladdr)
 
 
 def del_ip_rule(ip, table, dev=None, lladdr=None):
-    ip_version = get_ip_version(ip)
-    ip_info = ip.split("/")
-
-    if len(ip_info) == 1:
-        rule = {'dst': ip_info[0], 'table': table, 'dst_len': 32}
-        if ip_version == constants.IP_VERSION_6:
-            rule['dst_len'] = 128
-            rule['family'] = AF_INET6
-    elif len(ip_info) == 2:
-        rule = {'dst': ip_info[0], 'table': table, 'dst_len': int(ip_info[1])}
-        if ip_version == constants.IP_VERSION_6:
-            rule['family'] = AF_INET6
-    else:
-        LOG.error("Invalid ip: {}".format(ip))
+    rule = _get_rule(ip, table)
+    if not rule:
         return
-    with pyroute2.NDB() as ndb:
-        try:
-            ndb.rules[rule].remove().commit()
-            LOG.debug("Deleting ip rule with: {}".format(rule))
-        except KeyError:
-            LOG.debug("Rule already deleted: {}".format(rule))
+    kernel_state = get_kernel_state()
+    priorities = kernel_state.get_rule_priorities(rule)
+    if not priorities:
+        LOG.debug("Rule already deleted: {}".format(rule))
+    # including the ones with other priorities, from previous versions
+    for priority in sorted(priorities):
+        rule['priority'] = priority
+        LOG.debug("Deleting ip rule with: {}".format(rule))
+        _netlink_request(ip, 'rule', dict(rule, command='del'),
+                         ignored_errors=(errno.ENOENT,))
+        kernel_state.del_rule(rule)
 
     # FIXME: There is no support for deleting neighbours in NDB
     # So we are using iproute here
     if lladdr:
         ip_version = get_ip_version(ip)
-        with pyroute2.IPRoute() as iproute:
-            # This is doing something like:
-            # sudo ip nei del 172.24.4.69
-            # lladdr fa:16:3e:d3:5d:7b dev br-ex nud permanent
-            network_bridge_if = iproute.link_lookup(
-                ifname=dev)[0]
-            if ip_version == constants.IP_VERSION_6:
-                iproute.neigh('del',
-                              dst=ip.split("/")[0],
-                              lladdr=lladdr,
-                              family=AF_INET6,
-                              ifindex=network_bridge_if,
-                              state=ndmsg.states['permanent'])
-            else:
-                iproute.neigh('del',
-                              dst=ip.split("/")[0],
-                              lladdr=lladdr,
-                              ifindex=network_bridge_if,
-                              state=ndmsg.states['permanent'])
+        network_bridge_if = kernel_state.get_link_index(dev)
+        if kernel_state.get_neighbour(network_bridge_if,
+                                      ip.split("/")[0]) is None:
+            return
+        # This is doing something like:
+        # sudo ip nei del 172.24.4.69
+        # lladdr fa:16:3e:d3:5d:7b dev br-ex nud permanent
+        _netlink_request(ip, 'neigh', {
+            'command': 'del', 'dst': ip.split("/")[0], 'lladdr': lladdr,
+            'family': (AF_INET6 if ip_version == constants.IP_VERSION_6
+                       else AF_INET),
+            'ifindex': network_bridge_if,
+            'state': ndmsg.states['permanent']})
+        kernel_state.del_neighbour(network_bridge_if, ip.split("/")[0])
 
 
 def add_unreachable_route(vrf_name):
-    # FIXME: This should use pyroute instead but I didn't find
-    # out how
-    for ip_version in [-4, -6]:
-        command = ["ip", ip_version, "route", "add", "vrf", vrf_name,
-                   "unreachable", "default", "metric", "4278198272"]
-        try:
-            return processutils.execute(*command, run_as_root=True)
-        except Exception as e:
-            if "RTNETLINK answers: File exists" in e.stderr:
-                continue
-            LOG.error("Unable to execute {}. Exception: {}".format(
-                      command, e))
-            raise
-
-
-def add_ip_route(ovn_routing_tables_routes, ip_address, route_table, dev,
-                 vlan=None, mask=None, via=None):
+    """Add the IPv4 and IPv6 unreachable default routes to the VRF table.
+
+    Routes already in place are skipped, so it can be called on every
+    sync.
+    """
+    kernel_state = get_kernel_state()
+    vrf = kernel_state.get_link(vrf_name)
+    if not vrf or not vrf.get('vrf_table'):
+        raise KeyError(vrf_name)
+    requests = []
+    for family in (AF_INET, AF_INET6):
+        route = {'family': family, 'table': vrf['vrf_table'], 'dst_len': 0,
+                 'type': rtnl.rt_type['unreachable'],
+                 'priority': UNREACHABLE_ROUTE_METRIC, 'proto': ROUTE_PROTO}
+        if not kernel_state.has_route(route):
+            requests.append((vrf_name, 'route', dict(route, command='add')))
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        route = dict(kwargs)
+        del route['command']
+        kernel_state.add_route(route)
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.EEXIST,),
+                          applied=_applied)
+
+
+def _get_route(ip_address, route_table, oif, mask=None, via=None):
     net_ip = ip_address
     if not mask:  # default /32 or /128
         if get_ip_version(ip_address) == constants.IP_VERSION_6:
@@ -611,15 +1947,8 @@ def add_ip_route(ovn_routing_tables_routes, ip_address, route_table, dev,
             net_ip = '{}'.format(ipaddress.IPv4Network(
                 ip, strict=False).network_address)
 
-    with pyroute2.NDB() as ndb:
-        if vlan:
-            oif_name = '{}.{}'.format(dev, vlan)
-            oif = ndb.interfaces[oif_name]['index']
-        else:
-            oif = ndb.interfaces[dev]['index']
-
     route = {'dst': net_ip, 'dst_len': int(mask), 'oif': oif,
-             'table': int(route_table), 'proto': 3}
+             'table': int(route_table), 'proto': ROUTE_PROTO}
     if via:
         route['gateway'] = via
         route['scope'] = 0
@@ -628,60 +1957,501 @@ def add_ip_route(ovn_routing_tables_routes, ip_address, route_table, dev,
     if get_ip_version(net_ip) == constants.IP_VERSION_6:
         route['family'] = AF_INET6
         del route['scope']
+    return route
 
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.routes[route] as r:
-                LOG.debug("Route already existing: {}".format(r))
-        except KeyError:
-            ndb.routes.create(route).commit()
-            LOG.debug("Route created at table {}: {}".format(route_table,
-                                                             route))
-    route_info = {'vlan': vlan, 'route': route}
-    ovn_routing_tables_routes.setdefault(dev, []).append(route_info)
 
+def add_ip_route(route_registry, ip_address, route_table, dev,
+                 vlan=None, mask=None, via=None, owner=None):
+    kernel_state = get_kernel_state()
+    if vlan:
+        oif_name = '{}.{}'.format(dev, vlan)
+        oif = kernel_state.get_link_index(oif_name)
+    else:
+        oif = kernel_state.get_link_index(dev)
+
+    route = _get_route(ip_address, route_table, oif, mask=mask, via=via)
+
+    if kernel_state.has_route(route):
+        LOG.debug("Route already existing: {}".format(route))
+    elif route_registry.nexthops:
+        if _add_nexthop_routes(route_registry.nexthops, [route],
+                               owners=[owner]):
+            return
+        LOG.debug("Route created at table {}: {}".format(route_table,
+                                                         route))
+    else:
+        _netlink_request(ip_address, 'route', dict(route, command='add'))
+        kernel_state.add_route(route)
+        LOG.debug("Route created at table {}: {}".format(route_table,
+                                                         route))
+    route_registry.add(dev, route, vlan=vlan, owner=owner)
 
-def del_ip_route(ovn_routing_tables_routes, ip_address, route_table, dev,
+
+def del_ip_route(route_registry, ip_address, route_table, dev,
                  vlan=None, mask=None, via=None):
-    net_ip = ip_address
-    if not mask:  # default /32 or /128
-        if get_ip_version(ip_address) == constants.IP_VERSION_6:
-            mask = 128
-        else:
-            mask = 32
+    kernel_state = get_kernel_state()
+    if vlan:
+        oif_name = '{}.{}'.format(dev, vlan)
+        oif = kernel_state.get_link_index(oif_name)
     else:
-        ip = '{}/{}'.format(ip_address, mask)
-        if get_ip_version(ip_address) == constants.IP_VERSION_6:
-            net_ip = '{}'.format(ipaddress.IPv6Network(
-                ip, strict=False).network_address)
-        else:
-            net_ip = '{}'.format(ipaddress.IPv4Network(
-                ip, strict=False).network_address)
+        oif = kernel_state.get_link_index(dev)
+
+    route = _get_route(ip_address, route_table, oif, mask=mask, via=via)
 
-    with pyroute2.NDB() as ndb:
-        if vlan:
-            oif_name = '{}.{}'.format(dev, vlan)
-            oif = ndb.interfaces[oif_name]['index']
+    try:
+        if not kernel_state.has_route(route):
+            raise KeyError(route)
+        if route_registry.nexthops:
+            _del_nexthop_routes([route])
+        else:
+            _netlink_request(ip_address, 'route',
+                             _get_route_del_request(route),
+                             ignored_errors=(errno.ESRCH,))
+            kernel_state.del_route(route)
+        LOG.debug("Route deleted at table {}: {}".format(route_table,
+                                                         route))
+        route_registry.remove(route)
+    except KeyError:
+        LOG.debug("Route already deleted: {}".format(route))
+
+
+def _compile_request(ipbatch, method, kwargs):
+    """Return the message of an IPRoute request, built by ipbatch."""
+    getattr(ipbatch, method)(**kwargs)
+    request = bytearray(ipbatch.batch)
+    ipbatch.reset()
+    if kwargs.get('command') == 'del':
+        # pyroute2 < 0.7 sets the create flags on the delete requests
+        # too, which the kernel rejects
+        length, msg_type, _flags, seq, pid = (
+            _NLMSG_HEADER.unpack_from(request))
+        _NLMSG_HEADER.pack_into(request, 0, length, msg_type,
+                                netlink.NLM_F_REQUEST, seq, pid)
+    return bytes(request)
+
+
+def _netlink_batch(requests, ignored_errors=(), applied=None):
+    """Send a list of netlink requests in one go.
+
+    requests is a list of (item, method, kwargs) tuples, where method is
+    the IPRoute method that builds the request for the item. They are
+    all sent before reading any ACK, and a failing request does not
+    abort the rest of the batch: the errors are returned as a list of
+    (item, error) tuples. If given, applied is called with the method
+    and kwargs of every request that succeeded or failed with one of
+    the ignored_errors.
+    """
+    if not requests:
+        return []
+    with get_ipbatch() as ipbatch:
+        msgs = [_compile_request(ipbatch, method, kwargs)
+                for _item, method, kwargs in requests]
+    with get_rtnl() as rtnl_socket:
+        codes = rtnl_socket.batch(msgs)
+    errors = []
+    for (item, method, kwargs), code in zip(requests, codes):
+        if code and code not in ignored_errors:
+            error = pyroute2.netlink.exceptions.NetlinkError(
+                code, os.strerror(code))
+            LOG.warning("Netlink {} request for {} failed: {}".format(
+                method, item, error))
+            errors.append((item, error))
+            continue
+        if applied:
+            applied(method, kwargs)
+    return errors
+
+
+def _netlink_request(item, method, kwargs, ignored_errors=()):
+    """Send a single netlink request, raising its error if any."""
+    errors = _netlink_batch([(item, method, kwargs)],
+                            ignored_errors=ignored_errors)
+    if errors:
+        raise errors[0][1]
+
+
+def _ips_to_dev_batch(command, nic, ips, ignored_errors):
+    kernel_state = get_kernel_state()
+    index = kernel_state.get_link_index(nic)
+    requests = []
+    for ip in ips:
+        mask = _get_host_prefixlen(ip)
+        if kernel_state.has_address(nic, ip, mask) == (command == 'add'):
+            LOG.debug("IP address {} already {} nic {}.".format(
+                ip, 'added to' if command == 'add' else 'removed from', nic))
+            continue
+        family = AF_INET6 if mask == 128 else AF_INET
+        requests.append((ip, 'addr', {
+            'command': command, 'index': index, 'address': ip,
+            'mask': mask, 'family': family}))
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        if command == 'add':
+            kernel_state.add_address(nic, kwargs['address'], kwargs['mask'])
+        else:
+            kernel_state.del_address(nic, kwargs['address'], kwargs['mask'])
+
+    return _netlink_batch(requests,
+                          ignored_errors=ignored_errors,
+                          applied=_applied)
+
+
+def add_ips_to_dev_batch(nic, ips):
+    """Add the /32 or /128 ips missing on nic in a single batch."""
+    return _ips_to_dev_batch('add', nic, ips, (errno.EEXIST,))
+
+
+def del_ips_from_dev_batch(nic, ips):
+    """Remove the /32 or /128 ips present on nic in a single batch."""
+    return _ips_to_dev_batch('del', nic, ips, (errno.EADDRNOTAVAIL,))
+
+
+def _exposed_routes_batch(command, nic, ips, table, ignored_errors):
+    kernel_state = get_kernel_state()
+    oif = kernel_state.get_link_index(nic)
+    requests = []
+    for ip in ips:
+        route = _get_route(ip, table, oif)
+        if kernel_state.has_route(route) == (command == 'add'):
+            LOG.debug("Route for {} already {} table {}.".format(
+                ip, 'added to' if command == 'add' else 'removed from',
+                table))
+            continue
+        requests.append((ip, 'route', dict(route, command=command)))
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        route = dict(kwargs)
+        del route['command']
+        if command == 'add':
+            kernel_state.add_route(route)
+        else:
+            kernel_state.del_route(route)
+
+    return _netlink_batch(requests,
+                          ignored_errors=ignored_errors,
+                          applied=_applied)
+
+
+def add_exposed_routes_batch(nic, ips, table):
+    """Add the /32 or /128 routes through nic missing on table."""
+    return _exposed_routes_batch('add', nic, ips, table, (errno.EEXIST,))
+
+
+def del_exposed_routes_batch(nic, ips, table):
+    """Remove the /32 or /128 routes through nic present on table."""
+    return _exposed_routes_batch('del', nic, ips, table, (errno.ESRCH,))
+
+
+def _get_legacy_rule_requests(ip, rule):
+    """Return the requests deleting the rules like rule but with another
+    priority, e.g. the ones from previous versions, which left it to the
+    kernel.
+    """
+    priorities = get_kernel_state().get_rule_priorities(rule)
+    return [(ip, 'rule', dict(rule, priority=priority, command='del'))
+            for priority in sorted(priorities - {_rule_priority(rule)})]
+
+
+def add_ip_rules_batch(ips, table, dev=None, lladdr=None):
+    """Add the ip rules (and neighbours, if lladdr is given) in a batch.
+
+    The existing rules are skipped, as the kernel does not reject
+    duplicated rules, and the ones with another priority (from previous
+    versions) are replaced.
+    """
+    kernel_state = get_kernel_state()
+    rules = [(ip, _get_rule(ip, table)) for ip in ips]
+    requests = []
+    legacy_requests = []
+    for ip, rule in rules:
+        if not rule:
+            continue
+        legacy_requests.extend(_get_legacy_rule_requests(ip, rule))
+        if kernel_state.has_rule(rule):
+            continue
+        LOG.debug("Creating ip rule with: {}".format(rule))
+        requests.append((ip, 'rule', dict(rule, command='add')))
+    if lladdr:
+        requests.extend(_get_neighbour_requests(
+            'set', [ip for ip, rule in rules if rule], dev, lladdr))
+    # once the rules replacing them are there
+    requests.extend(legacy_requests)
+    if not requests:
+        return []
+
+    def _applied(method, kwargs):
+        if method != 'rule':
+            kernel_state.add_neighbour(kwargs['ifindex'], kwargs['dst'],
+                                       lladdr)
+        elif kwargs['command'] == 'add':
+            kernel_state.add_rule(kwargs)
         else:
-            oif = ndb.interfaces[dev]['index']
+            kernel_state.del_rule(kwargs)
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.ENOENT,),
+                          applied=_applied)
+
+
+def _get_neighbour_requests(command, ips, dev, lladdr=None):
+    kernel_state = get_kernel_state()
+    ifindex = kernel_state.get_link_index(dev)
+    requests = []
+    for ip in ips:
+        dst = ip.split("/")[0]
+        neighbour = kernel_state.get_neighbour(ifindex, dst)
+        if command == 'set' and neighbour == lladdr:
+            continue
+        if command == 'del' and neighbour is None:
+            continue
+        request = {'command': command, 'dst': dst,
+                   'ifindex': ifindex, 'state': ndmsg.states['permanent']}
+        if lladdr:
+            request['lladdr'] = lladdr
+        if get_ip_version(dst) == constants.IP_VERSION_6:
+            request['family'] = AF_INET6
+        else:
+            request['family'] = AF_INET
+        requests.append((ip, 'neigh', request))
+    return requests
 
-    route = {'dst': net_ip, 'dst_len': int(mask), 'oif': oif,
-             'table': int(route_table), 'proto': 3}
-    if via:
-        route['gateway'] = via
-        route['scope'] = 0
-    else:
-        route['scope'] = 253
-    if get_ip_version(net_ip) == constants.IP_VERSION_6:
-        route['family'] = AF_INET6
 
-    with pyroute2.NDB() as ndb:
-        try:
-            with ndb.routes[route] as r:
-                r.remove()
-            LOG.debug("Route deleted at table {}: {}".format(route_table,
-                                                             route))
-            route_info = {'vlan': vlan, 'route': route}
-            ovn_routing_tables_routes[dev].remove(route_info)
-        except (KeyError, ValueError):
-            LOG.debug("Route already deleted: {}".format(route))
+def add_ip_neighbours_batch(ips, dev, lladdr):
+    """Add a permanent neighbour entry with lladdr for each ip on dev."""
+    requests = _get_neighbour_requests('set', ips, dev, lladdr)
+    if not requests:
+        return []
+
+    kernel_state = get_kernel_state()
+
+    def _applied(method, kwargs):
+        kernel_state.add_neighbour(kwargs['ifindex'], kwargs['dst'], lladdr)
+
+    return _netlink_batch(requests, applied=_applied)
+
+
+def del_ip_neighbours_batch(ips, dev):
+    """Remove the permanent neighbour entries of the ips on dev."""
+    requests = _get_neighbour_requests('del', ips, dev)
+    if not requests:
+        return []
+
+    kernel_state = get_kernel_state()
+
+    def _applied(method, kwargs):
+        kernel_state.del_neighbour(kwargs['ifindex'], kwargs['dst'])
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.ENOENT,),
+                          applied=_applied)
+
+
+def add_ip_routes_batch(route_registry, ips, route_table, dev, vlan=None,
+                        mask=None, via=None, owner=None):
+    """Add a route per ip on the route_table in a single batch."""
+    kernel_state = get_kernel_state()
+    oif_name = '{}.{}'.format(dev, vlan) if vlan else dev
+    oif = kernel_state.get_link_index(oif_name)
+    requests = []
+    for ip in ips:
+        route = _get_route(ip, route_table, oif, mask=mask, via=via)
+        if kernel_state.has_route(route):
+            route_registry.add(dev, route, vlan=vlan, owner=owner)
+            continue
+        requests.append((ip, 'route', dict(route, command='add')))
+    if not requests:
+        return []
+
+    if route_registry.nexthops:
+        routes = [kwargs for _, _, kwargs in requests]
+        for route in routes:
+            del route['command']
+        failed_routes = _add_nexthop_routes(route_registry.nexthops, routes,
+                                            owners=[owner] * len(routes))
+        for route in routes:
+            if route not in failed_routes:
+                route_registry.add(dev, route, vlan=vlan, owner=owner)
+        return [(route['dst'], None) for route in failed_routes]
+
+    def _applied(method, kwargs):
+        route = dict(kwargs)
+        del route['command']
+        kernel_state.add_route(route)
+        route_registry.add(dev, route, vlan=vlan, owner=owner)
+
+    return _netlink_batch(requests,
+                          ignored_errors=(errno.EEXIST,),
+                          applied=_applied)
+
+
+def get_bridge_route(ip_address, route_table, dev, vlan=None, mask=None,
+                     via=None):
+    """Return the route add_ip_route would create, without creating it."""
+    oif_name = '{}.{}'.format(dev, vlan) if vlan else dev
+    oif = get_kernel_state().get_link_index(oif_name)
+    return _get_route(ip_address, route_table, oif, mask=mask, via=via)
+
+
+def sync_exposed_ips(nic, ips, delete=True):
+    """Make ips the only /32 and /128 addresses on nic.
+
+    If delete is False the extra addresses are left in place. Returns the
+    number of addresses added and removed.
+    """
+    exposed_ips = set(get_exposed_ips(nic))
+    missing_ips = [ip for ip in ips if ip not in exposed_ips]
+    extra_ips = [ip for ip in exposed_ips if ip not in ips] if delete else []
+    if missing_ips:
+        add_ips_to_dev_batch(nic, missing_ips)
+    if extra_ips:
+        delete_exposed_ips(extra_ips, nic)
+    return len(missing_ips), len(extra_ips)
+
+
+def sync_exposed_routes(nic, ips, table, delete=True):
+    """Make ips the only /32 and /128 routes through nic on table.
+
+    If delete is False the extra routes are left in place. Returns the
+    number of routes added and removed.
+    """
+    exposed_ips = set(get_exposed_routes(nic, table))
+    missing_ips = [ip for ip in ips if ip not in exposed_ips]
+    extra_ips = [ip for ip in exposed_ips if ip not in ips] if delete else []
+    if missing_ips:
+        add_exposed_routes_batch(nic, missing_ips, table)
+    if extra_ips:
+        del_exposed_routes_batch(nic, extra_ips, table)
+    return len(missing_ips), len(extra_ips)
+
+
+def sync_ip_rules(ip_rules, routing_tables, delete=True):
+    """Make ip_rules the only rules pointing to the routing_tables.
+
+    ip_rules is a dict indexed by the rule destination (ip/prefixlen)
+    with the table, dev and (optional) lladdr of each rule, like
+    {'10.0.0.1/32': {'table': 200, 'dev': 'br-ex', 'lladdr': None}}.
+    The neighbours of the rules with lladdr are also ensured. If delete
+    is False the extra rules are left in place. Any rule pointing to the
+    routing_tables is considered, whatever its priority: the ones from
+    previous versions, which left it to the kernel, are replaced (or
+    deleted if extra). Returns the number of rules added and removed.
+    """
+    current_rules = get_ovn_ip_rules(routing_tables)
+    extra_rules = {dst: rule_info
+                   for dst, rule_info in current_rules.items()
+                   if dst not in ip_rules} if delete else {}
+    batches = collections.defaultdict(list)
+    for dst, rule_info in ip_rules.items():
+        batch = (rule_info['table'], rule_info['dev'],
+                 rule_info.get('lladdr'))
+        batches[batch].append(dst)
+    for (table, dev, lladdr), dsts in batches.items():
+        # existing rules and neighbours are skipped by the batch
+        add_ip_rules_batch(dsts, table, dev=dev, lladdr=lladdr)
+    if extra_rules:
+        delete_ip_rules(extra_rules)
+    missing_rules = 0
+    legacy_rules = 0
+    for dst in ip_rules:
+        priorities = current_rules.get(dst, {}).get('priorities', set())
+        if RULE_PRIORITY not in priorities:
+            missing_rules += 1
+        if priorities - {RULE_PRIORITY}:
+            legacy_rules += 1
+    return missing_rules, len(extra_rules) + legacy_rules
+
+
+def sync_ip_neighbours(ip_rules, devs, delete=True):
+    """Make the ip_rules neighbours the only permanent ones on devs.
+
+    ip_rules is a dict like the sync_ip_rules one, and a permanent
+    neighbour entry is ensured for the ones with lladdr. If delete is
+    False the extra neighbours are left in place. Returns the number of
+    neighbours added and removed.
+    """
+    kernel_state = get_kernel_state()
+    batches = collections.defaultdict(list)
+    desired = collections.defaultdict(set)
+    for dst, rule_info in ip_rules.items():
+        if not rule_info.get('lladdr'):
+            continue
+        batches[(rule_info['dev'], rule_info['lladdr'])].append(dst)
+        desired[rule_info['dev']].add(dst.split("/")[0])
+    missing_neighbours = 0
+    for (dev, lladdr), dsts in batches.items():
+        ifindex = kernel_state.get_link_index(dev)
+        missing_neighbours += len([
+            dst for dst in dsts
+            if kernel_state.get_neighbour(ifindex, dst.split("/")[0]) !=
+            lladdr])
+        # existing neighbours are skipped by the batch
+        add_ip_neighbours_batch(dsts, dev, lladdr)
+    extra_neighbours = 0
+    for dev in devs if delete else ():
+        extra_dsts = [dst for dst in kernel_state.get_neighbours(
+            kernel_state.get_link_index(dev)) if dst not in desired[dev]]
+        if extra_dsts:
+            extra_neighbours += len(extra_dsts)
+            del_ip_neighbours_batch(extra_dsts, dev)
+    return missing_neighbours, extra_neighbours
+
+
+def sync_bridge_routes(routing_tables, route_registry, delete=True):
+    """Make the route_registry routes the only ones on the bridge tables.
+
+    The default route of each table through its bridge is left alone, as
+    it is managed by ensure_routing_table_for_bridge. If delete is False
+    the extra routes (and nexthops) are left in place. Returns the number
+    of routes added and removed.
+    """
+    kernel_state = get_kernel_state()
+    default_oifs = {}
+    for bridge, table in routing_tables.items():
+        link = kernel_state.get_link(bridge)
+        default_oifs[table] = link['index'] if link else None
+
+    current_routes = RouteRegistry()
+    for route in kernel_state.get_routes(list(routing_tables.values())):
+        if not route['dst'] and route['oif'] == default_oifs[route['table']]:
+            continue
+        current_routes.add(None, route)
+
+    missing_routes = current_routes.get_stale(route_registry.get_routes())
+    extra_routes = (route_registry.get_stale(current_routes.get_routes())
+                    if delete else [])
+    nexthops = route_registry.nexthops
+    if nexthops:
+        if missing_routes:
+            _add_nexthop_routes(
+                nexthops, missing_routes,
+                owners=[route_registry.get_owner(route)
+                        for route in missing_routes])
+        if extra_routes:
+            _del_nexthop_routes(extra_routes)
+        used_nexthops = set(
+            nexthops.ensure(
+                _get_nexthop_owner(route, route_registry.get_owner(route)),
+                route['oif'], gateway=route.get('gateway'),
+                family=route.get('family', AF_INET))
+            for route in route_registry.get_routes())
+        if delete:
+            nexthops.sync(used_nexthops)
+        return len(missing_routes), len(extra_routes)
+    if missing_routes:
+        requests = [(route['dst'], 'route', dict(route, command='add'))
+                    for route in missing_routes]
+
+        def _applied(method, kwargs):
+            route = dict(kwargs)
+            del route['command']
+            kernel_state.add_route(route)
+
+        _netlink_batch(requests,
+                       ignored_errors=(errno.EEXIST,), applied=_applied)
+    if extra_routes:
+        delete_ip_routes(extra_routes)
+    return len(missing_routes), len(extra_routes)